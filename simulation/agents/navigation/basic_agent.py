@@ -10,11 +10,17 @@ It can also make use of the global route planner to follow a specifed route
 """
 
 import carla
+import numpy as np
 from shapely.geometry import Polygon
+from shapely.prepared import prep
 
 from agents.navigation.local_planner import LocalPlanner, RoadOption
 from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.tools.misc import (get_speed, is_within_distance,
+from agents.navigation.planner_registry import get_planner_registry
+from agents.tools.state_cache import ActorStateCache
+from agents.tools.waypoint_cache import get_waypoint_cache
+from agents.tools.debug_draw import get_debug_drawer
+from agents.tools.misc import (is_within_distance, are_within_distance,
                                get_trafficlight_trigger_location,
                                compute_distance)
 
@@ -35,8 +41,13 @@ class BasicAgent(object):
             :param target_speed: speed (in Km/h) at which the vehicle will move
             :param opt_dict: dictionary in case some of its parameters want to be changed.
                 This also applies to parameters related to the LocalPlanner.
+                'state_cache' is an ActorStateCache shared with the LocalPlanner.
+                'route_cache_dir' is the directory of the route graph cache of the GlobalRoutePlanner.
+                'route_from_opendrive' builds the route graph from the OpenDRIVE content of the map.
             :param map_inst: carla.Map instance to avoid the expensive call of getting it.
+                Without it, the map is shared through the planner registry.
             :param grp_inst: GlobalRoutePlanner instance to avoid the expensive call of getting it.
+                Without it, the planner is shared through the planner registry.
 
         """
         self._vehicle = vehicle
@@ -46,9 +57,10 @@ class BasicAgent(object):
                 self._map = map_inst
             else:
                 print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._map = self._world.get_map()
+                self._map = get_planner_registry().get_map(self._world)
         else:
-            self._map = self._world.get_map()
+            self._map = get_planner_registry().get_map(self._world)
+        self._waypoint_cache = get_waypoint_cache(self._map)
         self._last_traffic_light = None
 
         # Base parameters
@@ -63,6 +75,17 @@ class BasicAgent(object):
         self._speed_ratio = 1
         self._max_brake = 0.5
         self._offset = 0
+        self._corridor_pose_tolerance = 0.1  # meters
+        self._corridor_yaw_tolerance = 0.5  # degrees
+        self._state_cache = None
+        self._route_cache_dir = None
+        self._route_from_opendrive = False
+        self._destination = None
+        self._vehicle_list = None
+        self._vehicle_list_ids = None
+        self._route_polygon_key = None
+        self._route_polygon = None
+        self._corridor = None
 
         # Change parameters according to the dictionary
         opt_dict['target_speed'] = target_speed
@@ -86,17 +109,30 @@ class BasicAgent(object):
             self._max_brake = opt_dict['max_brake']
         if 'offset' in opt_dict:
             self._offset = opt_dict['offset']
+        if 'state_cache' in opt_dict:
+            self._state_cache = opt_dict['state_cache']
+        if 'route_cache_dir' in opt_dict:
+            self._route_cache_dir = opt_dict['route_cache_dir']
+        if 'route_from_opendrive' in opt_dict:
+            self._route_from_opendrive = opt_dict['route_from_opendrive']
+        if self._state_cache is None:
+            self._state_cache = ActorStateCache()
 
         # Initialize the planners
-        self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict, map_inst=self._map)
+        self._local_planner = LocalPlanner(
+            self._vehicle, opt_dict=dict(opt_dict, state_cache=self._state_cache), map_inst=self._map)
         if grp_inst:
             if isinstance(grp_inst, GlobalRoutePlanner):
                 self._global_planner = grp_inst
             else:
-                print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+                print("Warning: Ignoring the given planner as it is not a 'GlobalRoutePlanner'")
+                self._global_planner = get_planner_registry().get_planner(
+                    self._map, self._sampling_resolution, cache_dir=self._route_cache_dir,
+                    from_opendrive=self._route_from_opendrive)
         else:
-            self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._global_planner = get_planner_registry().get_planner(
+                self._map, self._sampling_resolution, cache_dir=self._route_cache_dir,
+                from_opendrive=self._route_from_opendrive)
 
         # Get the static elements of the scene
         self._lights_list = self._world.get_actors().filter("*traffic_light*")
@@ -138,7 +174,7 @@ class BasicAgent(object):
         """Get method for protected member local planner"""
         return self._global_planner
 
-    def set_destination(self, end_location, start_location=None):
+    def set_destination(self, end_location, start_location=None, stream=True):
         """
         This method creates a list of waypoints between a starting and ending location,
         based on the route returned by the global router, and adds it to the local planner.
@@ -147,19 +183,41 @@ class BasicAgent(object):
 
             :param end_location (carla.Location): final location of the route
             :param start_location (carla.Location): starting location of the route
+            :param stream (bool): if True, the waypoints of the route are resolved as the
+                local planner consumes them instead of all at once
         """
         if not start_location:
             start_location = self._local_planner.target_waypoint.transform.location
             clean_queue = True
         else:
-            start_location = self._vehicle.get_location()
+            start_location = self._state_cache.get_location(self._vehicle)
             clean_queue = False
 
         start_waypoint = self._map.get_waypoint(start_location)
         end_waypoint = self._map.get_waypoint(end_location)
 
-        route_trace = self.trace_route(start_waypoint, end_waypoint)
-        self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
+        if stream:
+            route_trace = self._global_planner.iter_route(
+                start_waypoint.transform.location, end_waypoint.transform.location)
+            self._local_planner.set_global_plan_stream(route_trace, clean_queue=clean_queue)
+        else:
+            route_trace = self.trace_route(start_waypoint, end_waypoint)
+            self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
+        self._destination = end_waypoint.transform.location
+
+    def replan(self):
+        """
+        Plans again from the vehicle location to the last destination, e.g. after
+        the vehicle was driven off its route. The new route is spliced into the
+        current plan where it joins it, so most of the plan is kept.
+
+            :return: number of new waypoints in the plan, or None without destination
+        """
+        if self._destination is None:
+            return None
+        start_location = self._state_cache.get_location(self._vehicle)
+        route_trace = self._global_planner.replan_route(start_location, self._destination)
+        return self._local_planner.splice_plan(route_trace)
 
     def set_global_plan(self, plan, stop_waypoint_creation=True, clean_queue=True):
         """
@@ -191,9 +249,9 @@ class BasicAgent(object):
         hazard_detected = False
 
         # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
+        vehicle_list = self._get_vehicle_list()
 
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        vehicle_speed = self._state_cache.get_speed(self._vehicle) / 3.6
 
         # Check for possible vehicle obstacles
         max_vehicle_distance = self._base_vehicle_threshold + self._speed_ratio * vehicle_speed
@@ -217,6 +275,10 @@ class BasicAgent(object):
         """Check whether the agent has reached its destination."""
         return self._local_planner.done()
 
+    def destroy(self):
+        """Stops the background work of the agent, call it once the agent is not used anymore"""
+        self._local_planner.stop()
+
     def ignore_traffic_lights(self, active=True):
         """(De)activates the checks for traffic lights"""
         self._ignore_traffic_lights = active
@@ -239,9 +301,9 @@ class BasicAgent(object):
         Use 'direction' to specify either a 'left' or 'right' lane change,
         and the other 3 fine tune the maneuver
         """
-        speed = self._vehicle.get_velocity().length()
+        speed = self._state_cache.get_velocity(self._vehicle).length()
         path = self._generate_lane_change_path(
-            self._map.get_waypoint(self._vehicle.get_location()),
+            self._map.get_waypoint(self._state_cache.get_location(self._vehicle)),
             direction,
             same_lane_time * speed,
             other_lane_time * speed,
@@ -279,7 +341,7 @@ class BasicAgent(object):
             else:
                 return (True, self._last_traffic_light)
 
-        ego_vehicle_location = self._vehicle.get_location()
+        ego_vehicle_location = self._state_cache.get_location(self._vehicle)
         ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
 
         for traffic_light in lights_list:
@@ -306,7 +368,7 @@ class BasicAgent(object):
             if traffic_light.state != carla.TrafficLightState.Red:
                 continue
 
-            if is_within_distance(trigger_wp.transform, self._vehicle.get_transform(), max_distance, [0, 90]):
+            if is_within_distance(trigger_wp.transform, self._state_cache.get_transform(self._vehicle), max_distance, [0, 90]):
                 self._last_traffic_light = traffic_light
                 return (True, traffic_light)
 
@@ -321,42 +383,20 @@ class BasicAgent(object):
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
         """
-        def get_route_polygon():
-            route_bb = []
-            extent_y = self._vehicle.bounding_box.extent.y
-            r_ext = extent_y + self._offset
-            l_ext = -extent_y + self._offset
-            r_vec = ego_transform.get_right_vector()
-            p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-            p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-            route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            for wp, _ in self._local_planner.get_plan():
-                if ego_location.distance(wp.transform.location) > max_distance:
-                    break
-
-                r_vec = wp.transform.get_right_vector()
-                p1 = wp.transform.location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-                p2 = wp.transform.location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-                route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            # Two points don't create a polygon, nothing to check
-            if len(route_bb) < 3:
-                return None
-
-            return Polygon(route_bb)
-
         if self._ignore_vehicles:
             return (False, None, -1)
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            vehicle_list = self._get_vehicle_list()
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
+        # Copied, the cached transform is shared with the other consumers of the frame
+        cached_transform = self._state_cache.get_transform(self._vehicle)
+        ego_transform = carla.Transform(cached_transform.location, cached_transform.rotation)
         ego_location = ego_transform.location
+
         ego_wpt = self._map.get_waypoint(ego_location)
 
         # Get the right offset
@@ -371,56 +411,131 @@ class BasicAgent(object):
         opposite_invasion = abs(self._offset) + self._vehicle.bounding_box.extent.y > ego_wpt.lane_width / 2
         use_bbs = self._use_bbs_detection or opposite_invasion or ego_wpt.is_junction
 
-        # Get the route bounding box
-        route_polygon = get_route_polygon()
-
-        for target_vehicle in vehicle_list:
-            if target_vehicle.id == self._vehicle.id:
-                continue
-
-            target_transform = target_vehicle.get_transform()
-            if target_transform.location.distance(ego_location) > max_distance:
-                continue
+        # Broad phase: the vehicles within the distance, with the poses of the snapshot
+        targets = [target_vehicle for target_vehicle in vehicle_list if target_vehicle.id != self._vehicle.id]
+        if not targets:
+            return (False, None, -1)
+        locations, rotations = self._state_cache.get_poses(targets)
+        ego_xyz = np.array([ego_location.x, ego_location.y, ego_location.z])
+        candidates = np.flatnonzero(np.linalg.norm(locations - ego_xyz, axis=1) <= max_distance)
+        if candidates.size == 0:
+            return (False, None, -1)
 
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+        # Distance and angle test of the simplified approach for all the candidates at once,
+        # from the front of the ego to the rear of the targets
+        pitch = np.radians(rotations[candidates, 0])
+        yaw = np.radians(rotations[candidates, 1])
+        extents = np.array([targets[i].bounding_box.extent.x for i in candidates])
+        rears = locations[candidates, :2] - extents[:, None] * np.stack(
+            (np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw)), axis=1)
+        ego_forward = ego_transform.get_forward_vector()
+        in_front = are_within_distance(
+            rears, (ego_front_transform.location.x, ego_front_transform.location.y),
+            (ego_forward.x, ego_forward.y), max_distance, [low_angle_th, up_angle_th])
+
+        route_polygon = None
+        for index, target_in_front in zip(candidates.tolist(), in_front.tolist()):
+            target_vehicle = targets[index]
+            target_transform = self._state_cache.get_transform(target_vehicle)
+            target_wpt = self._state_cache.get_waypoint(target_vehicle, self._map, lane_type=carla.LaneType.Any)
 
             # General approach for junctions and vehicles invading other lanes due to the offset
+            if (use_bbs or target_wpt.is_junction) and route_polygon is None:
+                route_polygon = self._get_route_polygon(ego_location, ego_transform, max_distance)
             if (use_bbs or target_wpt.is_junction) and route_polygon:
 
-                target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                target_polygon = Polygon(target_list)
+                target_vertices = target_vehicle.bounding_box.get_world_vertices(target_transform)
+                target_polygon = Polygon([[v.x, v.y, v.z] for v in target_vertices])
 
                 if route_polygon.intersects(target_polygon):
-                    return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+                    return (True, target_vehicle, compute_distance(target_transform.location, ego_location))
 
             # Simplified approach, using only the plan waypoints (similar to TM)
             else:
+                if not target_in_front:
+                    continue
 
                 if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id  + lane_offset:
                     next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
                     if not next_wpt:
                         continue
-                    self._world.debug.draw_point(
-                        next_wpt.location, size=0.1, color=carla.Color(120, 0, 120), life_time=10
-                    )
+                    drawer = get_debug_drawer()
+                    if drawer.enabled:
+                        drawer.point(next_wpt.transform.location, size=0.1, color=carla.Color(120, 0, 120), life_time=10)
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
                         continue
 
-                target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
-                target_rear_transform = target_transform
-                target_rear_transform.location -= carla.Location(
-                    x=target_extent * target_forward_vector.x,
-                    y=target_extent * target_forward_vector.y,
-                )
-
-                if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
-                    return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
+                return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
 
         return (False, None, -1)
 
+    def _get_route_polygon(self, ego_location, ego_transform, max_distance):
+        """
+        Returns the prepared polygon of the lane corridor of the plan ahead of the
+        vehicle, False if there is none.
+
+        The side points of the plan waypoints are kept between the calls: the
+        ones of the consumed waypoints are dropped and only those of the waypoints
+        new to the horizon are computed. The polygon itself is reused as long as
+        the horizon is the same and the vehicle moved less than the pose tolerance.
+        """
+        plan = self._local_planner.get_plan()
+        extent_y = self._vehicle.bounding_box.extent.y
+        r_ext = extent_y + self._offset
+        l_ext = -extent_y + self._offset
+        horizon = plan.horizon(ego_location, max_distance)
+        sides = self._corridor_sides(plan, horizon, r_ext, l_ext)
+
+        ego_yaw = ego_transform.rotation.yaw
+        key = (plan.generation, plan.start, horizon, self._offset)
+        if self._route_polygon_key is not None:
+            polygon_key, anchor, anchor_yaw = self._route_polygon_key
+            if polygon_key == key and ego_location.distance(anchor) < self._corridor_pose_tolerance \
+                    and abs((ego_yaw - anchor_yaw + 180.0) % 360.0 - 180.0) < self._corridor_yaw_tolerance:
+                return self._route_polygon
+
+        # The corridor starts at the sides of the vehicle
+        r_vec = ego_transform.get_right_vector()
+        p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
+        p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
+        route_bb = np.concatenate((np.array([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]]), sides.reshape(-1, 3)))
+
+        # Two points don't create a polygon, nothing to check
+        route_polygon = prep(Polygon(route_bb)) if len(route_bb) >= 3 else False
+        anchor = carla.Location(ego_location.x, ego_location.y, ego_location.z)
+        self._route_polygon_key, self._route_polygon = (key, anchor, ego_yaw), route_polygon
+        return route_polygon
+
+    def _corridor_sides(self, plan, horizon, r_ext, l_ext):
+        """
+        Returns the right and left points of the first horizon waypoints of the
+        plan, array (horizon, 2, 3), updating the kept ones incrementally
+        """
+        cached = self._corridor
+        if cached is not None and cached[:3] == (plan.generation, r_ext, l_ext) and cached[3] <= plan.start:
+            sides = cached[4][plan.start - cached[3]:]
+        else:
+            sides = np.empty((0, 2, 3))
+        known = len(sides)
+        if known < horizon:
+            centers = plan.xyz(known, horizon)
+            offsets = np.zeros_like(centers)
+            offsets[:, :2] = plan.right_vectors(known, horizon)
+            sides = np.concatenate((sides, np.stack((centers + r_ext * offsets, centers + l_ext * offsets), axis=1)))
+        self._corridor = (plan.generation, r_ext, l_ext, plan.start, sides)
+        return sides[:horizon]
+
+    def _get_vehicle_list(self):
+        """
+        Returns the vehicles of the world. They are only fetched again when the
+        actors of the snapshot of the state cache change.
+        """
+        actor_ids = self._state_cache.actor_ids()
+        if self._vehicle_list is None or actor_ids is None or actor_ids != self._vehicle_list_ids:
+            self._vehicle_list = self._world.get_actors().filter("*vehicle*")
+            self._vehicle_list_ids = actor_ids
+        return self._vehicle_list
+
     def _generate_lane_change_path(self, waypoint, direction='left', distance_same_lane=10,
                                 distance_other_lane=25, lane_change_distance=25,
                                 check=True, lane_changes=1, step_distance=2):
@@ -441,14 +556,13 @@ class BasicAgent(object):
         # Same lane
         distance = 0
         while distance < distance_same_lane:
-            next_wps = plan[-1][0].next(step_distance)
-            print("next_wps:", next_wps)
+            next_wps = self._waypoint_cache.next(plan[-1][0], step_distance)
             if not next_wps:
                 return []
-            for wp in next_wps:
-                self._world.debug.draw_point(
-                    wp.location, size=0.1, color=carla.Color(0, 255, 120), life_time=10
-                )
+            drawer = get_debug_drawer()
+            if drawer.enabled:
+                for wp in next_wps:
+                    drawer.point(wp.transform.location, size=0.1, color=carla.Color(0, 255, 120), life_time=10)
             next_wp = next_wps[0]
             distance += next_wp.transform.location.distance(plan[-1][0].transform.location)
             plan.append((next_wp, RoadOption.LANEFOLLOW))
@@ -468,24 +582,24 @@ class BasicAgent(object):
         while lane_changes_done < lane_changes:
 
             # Move forward
-            next_wps = plan[-1][0].next(lane_change_distance)
+            next_wps = self._waypoint_cache.next(plan[-1][0], lane_change_distance)
             if not next_wps:
                 return []
-            for wp in next_wps:
-                self._world.debug.draw_point(
-                    wp.location, size=0.1, color=carla.Color(120, 0, 120), life_time=10
-                )
+            drawer = get_debug_drawer()
+            if drawer.enabled:
+                for wp in next_wps:
+                    drawer.point(wp.transform.location, size=0.1, color=carla.Color(120, 0, 120), life_time=10)
             next_wp = next_wps[0]
 
             # Get the side lane
             if direction == 'left':
                 if check and str(next_wp.lane_change) not in ['Left', 'Both']:
                     return []
-                side_wp = next_wp.get_left_lane()
+                side_wp = self._waypoint_cache.left_lane(next_wp)
             else:
                 if check and str(next_wp.lane_change) not in ['Right', 'Both']:
                     return []
-                side_wp = next_wp.get_right_lane()
+                side_wp = self._waypoint_cache.right_lane(next_wp)
 
             if not side_wp or side_wp.lane_type != carla.LaneType.Driving:
                 return []
@@ -497,8 +611,7 @@ class BasicAgent(object):
         # Other lane
         distance = 0
         while distance < distance_other_lane:
-            next_wps = plan[-1][0].next(step_distance)
-            print("next_wps:", next_wps)
+            next_wps = self._waypoint_cache.next(plan[-1][0], step_distance)
             if not next_wps:
                 return []
             next_wp = next_wps[0]
@@ -9,7 +9,7 @@ from collections import deque
 import math
 import numpy as np
 import carla
-from agents.tools.misc import get_speed
+from agents.tools.state_cache import ActorStateCache
 
 
 class VehiclePIDController():
@@ -21,7 +21,7 @@ class VehiclePIDController():
 
 
     def __init__(self, vehicle, args_lateral, args_longitudinal, offset=0, max_throttle=0.75, max_brake=0.3,
-                 max_steering=0.8):
+                 max_steering=0.8, state_cache=None):
         """
         Constructor method.
 
@@ -39,6 +39,7 @@ class VehiclePIDController():
         :param offset: If different than zero, the vehicle will drive displaced from the center line.
         Positive values imply a right offset while negative ones mean a left one. Numbers high enough
         to cause the vehicle to drive through other lanes might break the controller.
+        :param state_cache: ActorStateCache the vehicle state is read from
         """
 
         self.max_brake = max_brake
@@ -48,8 +49,11 @@ class VehiclePIDController():
         self._vehicle = vehicle
         self._world = self._vehicle.get_world()
         self.past_steering = self._vehicle.get_control().steer
+        self._state_cache = state_cache if state_cache is not None else ActorStateCache()
         self._lon_controller = PIDLongitudinalController(self._vehicle, **args_longitudinal)
         self._lat_controller = PIDLateralController(self._vehicle, offset, **args_lateral)
+        self._lon_controller.set_state_cache(self._state_cache)
+        self._lat_controller.set_state_cache(self._state_cache)
 
     def run_step(self, target_speed, waypoint):
         """
@@ -126,6 +130,11 @@ class PIDLongitudinalController():
         self._k_d = K_D
         self._dt = dt
         self._error_buffer = deque(maxlen=10)
+        self._state_cache = ActorStateCache()
+
+    def set_state_cache(self, state_cache):
+        """Reads the vehicle state from the given ActorStateCache"""
+        self._state_cache = state_cache
 
     def run_step(self, target_speed, debug=False):
         """
@@ -135,7 +144,7 @@ class PIDLongitudinalController():
             :param debug: boolean for debugging
             :return: throttle control
         """
-        current_speed = get_speed(self._vehicle)
+        current_speed = self._state_cache.get_speed(self._vehicle)
 
         if debug:
             print('Current speed = {}'.format(current_speed))
@@ -195,6 +204,11 @@ class PIDLateralController():
         self._dt = dt
         self._offset = offset
         self._e_buffer = deque(maxlen=10)
+        self._state_cache = ActorStateCache()
+
+    def set_state_cache(self, state_cache):
+        """Reads the vehicle state from the given ActorStateCache"""
+        self._state_cache = state_cache
 
     def run_step(self, waypoint):
         """
@@ -206,7 +220,7 @@ class PIDLateralController():
             -1 maximum steering to left
             +1 maximum steering to right
         """
-        return self._pid_control(waypoint, self._vehicle.get_transform())
+        return self._pid_control(waypoint, self._state_cache.get_transform(self._vehicle))
 
     def set_offset(self, offset):
         """Changes the offset"""
@@ -8,78 +8,339 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+import collections
 import math
+import threading
 import numpy as np
-import networkx as nx
 
 import carla
 from agents.navigation.local_planner import RoadOption
 from agents.tools.misc import vector
+from agents.tools.waypoint_cache import get_waypoint_cache
+from agents.navigation.opendrive import OpenDriveMap, build_graph_data
+from agents.navigation.route_graph import NoRouteError, RouteGraph, RouteGraphBuilder
+from agents.navigation.spatial_index import SegmentGrid
+from agents.navigation.route_graph_data import (
+    cache_path, carla_waypoint_key, load_graph_data, resolve_waypoint,
+    road_id_to_edge_from_data, save_graph_data)
 
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, cache_dir=None, from_opendrive=False, route_cache_size=256,
+                 waypoint_cache_size=4096, destination_tree_cache_size=4):
+        """
+        :param wmap: carla.Map to plan on
+        :param sampling_resolution: distance between the waypoints of the routes
+        :param cache_dir: directory of the route graph cache. If given, the graph is
+            loaded from there when it was built before for the same map content and
+            resolution, and saved there otherwise.
+        :param from_opendrive: if True, a graph that is not cached is built from the
+            OpenDRIVE content of the map (see opendrive) instead of its topology
+        :param route_cache_size: number of searched routes kept, keyed by the edges
+            the origin and destination are localized on. 0 disables the cache.
+        :param waypoint_cache_size: number of resolved route waypoints kept, the least
+            recently used are resolved with the map again. 0 disables the cache.
+        :param destination_tree_cache_size: number of reverse shortest path trees
+            kept for replan_route, one per destination node
+        """
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
         self._topology = None
+        self._builder = None
         self._graph = None
+        self._graph_data = None
+        self._waypoints = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._waypoint_cache_size = waypoint_cache_size
         self._id_map = None
         self._road_id_to_edge = None
-
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
-
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        self._lane_index = None
+        self._waypoint_cache = get_waypoint_cache(wmap)
+        self._route_cache = collections.OrderedDict()
+        self._route_cache_size = route_cache_size
+        self._destination_trees = collections.OrderedDict()
+        self._destination_tree_cache_size = destination_tree_cache_size
+
+        # Build the graph, or load it from the cache
+        builder = 'opendrive' if from_opendrive else 'topology'
+        graph_cache_path = cache_path(cache_dir, wmap, sampling_resolution, builder) if cache_dir else None
+        graph_data = load_graph_data(graph_cache_path) if graph_cache_path else None
+        if graph_data is None and from_opendrive:
+            graph_data = build_graph_data(OpenDriveMap.from_string(wmap.to_opendrive()), sampling_resolution)
+            if graph_cache_path:
+                save_graph_data(graph_cache_path, graph_data)
+        if graph_data is None:
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+            graph_data = self._builder.graph_data(sampling_resolution)
+            # Only the graph data is kept, the waypoints are resolved again when needed
+            self._topology, self._builder = None, None
+            if graph_cache_path:
+                save_graph_data(graph_cache_path, graph_data)
+        self._load_graph(graph_data)
 
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
         from origin to destination
         """
-        route_trace = []
-        route = self._path_search(origin, destination)
+        return self._trace(self._path_search(origin, destination), origin, destination)
+
+    def iter_route(self, origin, destination):
+        """
+        This method returns the route of trace_route as an iterator of
+        (carla.Waypoint, RoadOption). The route is searched right away, which
+        raises NoRouteError if there is none, but its waypoints are only
+        resolved, edge by edge, as the iterator is consumed.
+        """
+        return self._iter_trace(self._path_search(origin, destination), origin, destination)
+
+    def replan_route(self, origin, destination):
+        """
+        This method returns list of (carla.Waypoint, RoadOption) from origin to
+        destination like trace_route, over the reverse shortest path tree of the
+        destination. The trees of the last destinations are kept, so replanning
+        towards the same destination from anywhere, e.g. after the vehicle left
+        its route, only walks the tree.
+        """
+        start, end = self._localize(origin), self._localize(destination)
+        tree = self._destination_tree(end[0])
+        route = self._graph.tree_path(tree, start[0])
+        route.append(end[1])
+        return self._trace(route, origin, destination)
+
+    def distance_matrix(self, origins, destinations):
+        """
+        This method returns the matrix of the route lengths from every origin to
+        every destination, with one search per origin lane. The lengths are in
+        meters, counted along the graph at the sampling resolution from the
+        position of the origin on its lane to the position of the destination
+        on its lane, and inf where there is no route. As with trace_route, a
+        destination behind the origin on the same lane is at 0.
+
+            :param origins: list of carla.Location
+            :param destinations: list of carla.Location
+            :return: numpy array (len(origins), len(destinations))
+        """
+        starts, ends, trees = self._search_trees(origins, destinations)
+        graph = self._graph
+        distances = np.full((len(starts), len(ends)), np.inf)
+        # Waypoints between the start of the lane and the origins and destinations
+        origin_offsets = [self._lane_offset(origin, start) for origin, start in zip(origins, starts)]
+        destination_offsets = [self._lane_offset(destination, end) for destination, end in zip(destinations, ends)]
+        for i, start in enumerate(starts):
+            for j, end in enumerate(ends):
+                cost = graph.tree_cost(trees[start[0]], end[0])
+                cost = max(cost - origin_offsets[i] + destination_offsets[j], 0)
+                distances[i, j] = cost * self._sampling_resolution
+        return distances
+
+    def _lane_offset(self, location, lane):
+        """
+        Returns the number of waypoints between the start of a lane edge and the
+        waypoint of the edge closest to the location
+        """
+        edge = self._graph.edge(*lane)
+        polyline = [int(self._graph.edge_entry_waypoint[edge])] + self._graph.edge_path(edge) + \
+            [int(self._graph.edge_exit_waypoint[edge])]
+        return self._find_closest_in_list(location, polyline)
+
+    def route_matrix(self, origins, destinations):
+        """
+        This method returns the routes from every origin to every destination as
+        lists of (carla.Waypoint, RoadOption), like trace_route, with one search
+        per origin lane. The routes are the shortest ones in the graph and can
+        differ from the ones of trace_route, whose A* heuristic is in meters
+        while the edge lengths are in waypoints. Pairs without a route are None.
+
+            :param origins: list of carla.Location
+            :param destinations: list of carla.Location
+            :return: list of lists of routes, indexed [origin][destination]
+        """
+        starts, ends, trees = self._search_trees(origins, destinations)
+        routes = []
+        for origin, start in zip(origins, starts):
+            row = []
+            for destination, end in zip(destinations, ends):
+                try:
+                    route = self._graph.tree_path(trees[start[0]], end[0])
+                except NoRouteError:
+                    row.append(None)
+                    continue
+                row.append(self._trace(route + [end[1]], origin, destination))
+            routes.append(row)
+        return routes
+
+    def _search_trees(self, origins, destinations):
+        """
+        Localizes the origins and destinations and builds the shortest path tree
+        of every distinct origin node, each stopping once all destinations are settled
+        """
+        starts = [self._localize(origin) for origin in origins]
+        ends = [self._localize(destination) for destination in destinations]
+        targets = {end[0] for end in ends}
+        trees = {}
+        for start in starts:
+            if start[0] not in trees:
+                trees[start[0]] = self._graph.shortest_path_tree(start[0], targets)
+        return starts, ends, trees
+
+    def _destination_tree(self, node):
+        """Returns the reverse shortest path tree rooted at the node, dropping the least recently used"""
+        with self._cache_lock:
+            tree = self._destination_trees.get(node)
+            if tree is not None:
+                self._destination_trees.move_to_end(node)
+                return tree
+        tree = self._graph.shortest_path_tree(node, reverse=True)
+        if self._destination_tree_cache_size > 0:
+            with self._cache_lock:
+                self._destination_trees[node] = tree
+                if len(self._destination_trees) > self._destination_tree_cache_size:
+                    self._destination_trees.popitem(last=False)
+        return tree
+
+    def _trace(self, route, origin, destination):
+        """
+        This method turns a route of node ids into a list of
+        (carla.Waypoint, RoadOption) from origin to destination
+        """
+        return list(self._iter_trace(route, origin, destination))
+
+    def _iter_trace(self, route, origin, destination):
+        """
+        This method turns a route of node ids into an iterator of
+        (carla.Waypoint, RoadOption) from origin to destination. The turn
+        decisions are taken right away, as each depends on the previous ones,
+        the waypoints are resolved as the iterator is consumed.
+        """
+        decisions = []
+        previous_decision, intersection_end_node = RoadOption.VOID, -1
+        for i in range(len(route) - 1):
+            previous_decision, intersection_end_node = self._turn_decision(
+                i, route, previous_decision, intersection_end_node)
+            decisions.append(previous_decision)
         current_waypoint = self._wmap.get_waypoint(origin)
         destination_waypoint = self._wmap.get_waypoint(destination)
+        return self._trace_edges(route, decisions, current_waypoint, destination, destination_waypoint)
 
+    def _trace_edges(self, route, decisions, current_waypoint, destination, destination_waypoint):
+        """
+        Generator of the (carla.Waypoint, RoadOption) of the edges of a route,
+        resolving the waypoints of one edge at a time
+        """
         for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
-            edge = self._graph.edges[route[i], route[i+1]]
+            road_option = decisions[i]
+            edge = self._graph.edge(route[i], route[i+1])
+            edge_type = self._graph.edge_type[edge]
             path = []
 
-            if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
-                route_trace.append((current_waypoint, road_option))
-                exit_wp = edge['exit_waypoint']
-                n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
-                next_edge = self._graph.edges[n1, n2]
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path'])-1, closest_index+5)
-                    current_waypoint = next_edge['path'][closest_index]
+            if edge_type != RoadOption.LANEFOLLOW and edge_type != RoadOption.VOID:
+                yield current_waypoint, road_option
+                n1, n2 = self._lane_edge(self._graph.edge_exit_waypoint[edge])
+                next_edge = self._graph.edge(n1, n2)
+                next_path = self._graph.edge_path(next_edge)
+                if next_path:
+                    closest_index = self._find_closest_in_list(current_waypoint.transform.location, next_path)
+                    closest_index = min(len(next_path)-1, closest_index+5)
+                    current_waypoint = self._waypoint(next_path[closest_index])
                 else:
-                    current_waypoint = next_edge['exit_waypoint']
-                route_trace.append((current_waypoint, road_option))
+                    current_waypoint = self._waypoint(self._graph.edge_exit_waypoint[next_edge])
+                yield current_waypoint, road_option
 
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
-                    route_trace.append((current_waypoint, road_option))
-                    if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*self._sampling_resolution:
-                        break
-                    elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
-                        if closest_index > destination_index:
-                            break
-
-        return route_trace
+                path = path + [int(self._graph.edge_entry_waypoint[edge])] + self._graph.edge_path(edge) + \
+                    [int(self._graph.edge_exit_waypoint[edge])]
+                closest_index = self._find_closest_in_list(current_waypoint.transform.location, path)
+                end_index = len(path)
+                if len(route)-i <= 2:
+                    end_index = self._destination_index(path, closest_index, destination, destination_waypoint)
+                for index in path[closest_index:end_index]:
+                    current_waypoint = self._waypoint(index)
+                    yield current_waypoint, road_option
+
+    def graph_data(self):
+        """Returns the graph as serializable graph data, see route_graph_data"""
+        return self._graph_data
+
+    def _load_graph(self, data):
+        """
+        This function sets up the route graph over graph data. The waypoints
+        are only resolved with the map once a route passes them
+        """
+        self._graph_data = data
+        self._graph = RouteGraph(data)
+        with self._cache_lock:
+            self._waypoints.clear()
+        self._road_id_to_edge = road_id_to_edge_from_data(data)
+        self._lane_index = self._build_lane_index()
+
+    def _build_lane_index(self):
+        """
+        This function builds the spatial index of the lanes: the segments between
+        the consecutive waypoints of every lane edge, labelled with the waypoint
+        they start at
+        """
+        graph = self._graph
+        starts, ends = [], []
+        for edge in np.flatnonzero(graph.edge_type == RoadOption.LANEFOLLOW).tolist():
+            polyline = [int(graph.edge_entry_waypoint[edge])] + graph.edge_path(edge) + \
+                [int(graph.edge_exit_waypoint[edge])]
+            starts.extend(polyline[:-1])
+            ends.extend(polyline[1:])
+        xyz = self._graph_data['waypoint_xyz']
+        return SegmentGrid(xyz[starts], xyz[ends], np.array(starts, dtype=np.int64))
+
+    def _waypoint(self, index):
+        """
+        Returns the carla.Waypoint with the given index in the graph data, or None for -1
+        """
+        index = int(index)
+        if index < 0:
+            return None
+        with self._cache_lock:
+            waypoint = self._waypoints.get(index)
+            if waypoint is not None:
+                self._waypoints.move_to_end(index)
+                return waypoint
+        # The map is queried without the lock, routes are traced from several threads
+        waypoint = resolve_waypoint(self._wmap, self._graph_data, index)
+        if self._waypoint_cache_size > 0:
+            with self._cache_lock:
+                self._waypoints[index] = waypoint
+                if len(self._waypoints) > self._waypoint_cache_size:
+                    self._waypoints.popitem(last=False)
+        return waypoint
+
+    def _destination_index(self, path, closest_index, destination, destination_waypoint):
+        """
+        Returns the index in the path of the last edge of a route after which the
+        route ends: past the first waypoint close to the destination, or past
+        the first waypoint in the lane of the destination if the route enters
+        that lane after the destination.
+        """
+        data = self._graph_data
+        destination_xyz = np.array([destination.x, destination.y, destination.z])
+        stop = np.linalg.norm(data['waypoint_xyz'][path] - destination_xyz, axis=1) < 2*self._sampling_resolution
+        same_lane = (data['waypoint_road'][path] == destination_waypoint.road_id) \
+            & (data['waypoint_section'][path] == destination_waypoint.section_id) \
+            & (data['waypoint_lane'][path] == destination_waypoint.lane_id)
+        if same_lane[closest_index:].any() and \
+                closest_index > self._find_closest_in_list(destination_waypoint.transform.location, path):
+            stop |= same_lane
+        hits = np.flatnonzero(stop[closest_index:])
+        return closest_index + int(hits[0]) + 1 if hits.size else len(path)
+
+    def _lane_edge(self, index):
+        """Returns the edge (n1, n2) of the lane of the waypoint with the given index"""
+        data = self._graph_data
+        return self._road_id_to_edge[int(data['waypoint_road'][index])][int(data['waypoint_section'][index])][
+            int(data['waypoint_lane'][index])]
 
     def _build_topology(self):
         """
@@ -107,15 +368,15 @@ class GlobalRoutePlanner(object):
             seg_dict['path'] = []
             endloc = wp2.transform.location
             if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
+                w = self._waypoint_cache.next(wp1, self._sampling_resolution)[0]
                 while w.transform.location.distance(endloc) > self._sampling_resolution:
                     seg_dict['path'].append(w)
-                    next_ws = w.next(self._sampling_resolution)
+                    next_ws = self._waypoint_cache.next(w, self._sampling_resolution)
                     if len(next_ws) == 0:
                         break
                     w = next_ws[0]
             else:
-                next_wps = wp1.next(self._sampling_resolution)
+                next_wps = self._waypoint_cache.next(wp1, self._sampling_resolution)
                 if len(next_wps) == 0:
                     continue
                 seg_dict['path'].append(next_wps[0])
@@ -123,8 +384,8 @@ class GlobalRoutePlanner(object):
 
     def _build_graph(self):
         """
-        This function builds a networkx graph representation of topology, creating several class attributes:
-        - graph (networkx.DiGraph): networkx graph representing the world map, with:
+        This function builds a graph representation of topology, creating several class attributes:
+        - builder (RouteGraphBuilder): collects the graph representing the world map, with:
             Node properties:
                 vertex: (x,y,z) position in world map
             Edge properties:
@@ -136,9 +397,9 @@ class GlobalRoutePlanner(object):
         - road_id_to_edge (dictionary): map from road id to edge in the graph
         """
 
-        self._graph = nx.DiGraph()
-        self._id_map = dict()  # Map with structure {(x,y,z): id, ... }
-        self._road_id_to_edge = dict()  # Map with structure {road_id: {lane_id: edge, ... }, ... }
+        self._builder = RouteGraphBuilder(carla_waypoint_key)
+        self._id_map = self._builder.id_map  # Map with structure {(x,y,z): id, ... }
+        self._road_id_to_edge = self._builder.road_id_to_edge  # Map with structure {road_id: {lane_id: edge, ... }, ... }
 
         for segment in self._topology:
             entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
@@ -147,14 +408,9 @@ class GlobalRoutePlanner(object):
             intersection = entry_wp.is_junction
             road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
 
-            for vertex in entry_xyz, exit_xyz:
-                # Adding unique nodes and populating id_map
-                if vertex not in self._id_map:
-                    new_id = len(self._id_map)
-                    self._id_map[vertex] = new_id
-                    self._graph.add_node(new_id, vertex=vertex)
-            n1 = self._id_map[entry_xyz]
-            n2 = self._id_map[exit_xyz]
+            # Adding unique nodes and populating id_map
+            n1 = self._builder.add_node(entry_xyz)
+            n2 = self._builder.add_node(exit_xyz)
             if road_id not in self._road_id_to_edge:
                 self._road_id_to_edge[road_id] = dict()
             if section_id not in self._road_id_to_edge[road_id]:
@@ -165,7 +421,7 @@ class GlobalRoutePlanner(object):
             exit_carla_vector = exit_wp.transform.rotation.get_forward_vector()
 
             # Adding edge with attributes
-            self._graph.add_edge(
+            self._builder.add_edge(
                 n1, n2,
                 length=len(path) + 1, path=path,
                 entry_waypoint=entry_wp, exit_waypoint=exit_wp,
@@ -200,20 +456,20 @@ class GlobalRoutePlanner(object):
                 n1 = self._id_map[exit_xyz]
                 n2 = -1*count_loose_ends
                 self._road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
-                next_wp = end_wp.next(hop_resolution)
+                next_wp = self._waypoint_cache.next(end_wp, hop_resolution)
                 path = []
                 while next_wp is not None and next_wp \
                         and next_wp[0].road_id == road_id \
                         and next_wp[0].section_id == section_id \
                         and next_wp[0].lane_id == lane_id:
                     path.append(next_wp[0])
-                    next_wp = next_wp[0].next(hop_resolution)
+                    next_wp = self._waypoint_cache.next(next_wp[0], hop_resolution)
                 if path:
                     n2_xyz = (path[-1].transform.location.x,
                               path[-1].transform.location.y,
                               path[-1].transform.location.z)
-                    self._graph.add_node(n2, vertex=n2_xyz)
-                    self._graph.add_edge(
+                    self._builder.add_node(n2_xyz, node_id=n2)
+                    self._builder.add_edge(
                         n1, n2,
                         length=len(path) + 1, path=path,
                         entry_waypoint=end_wp, exit_waypoint=path[-1],
@@ -234,27 +490,27 @@ class GlobalRoutePlanner(object):
                     next_waypoint, next_road_option, next_segment = None, None, None
 
                     if waypoint.right_lane_marking and waypoint.right_lane_marking.lane_change & carla.LaneChange.Right and not right_found:
-                        next_waypoint = waypoint.get_right_lane()
+                        next_waypoint = self._waypoint_cache.right_lane(waypoint)
                         if next_waypoint is not None \
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANERIGHT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._localize_on_map(next_waypoint.transform.location)
                             if next_segment is not None:
-                                self._graph.add_edge(
+                                self._builder.add_edge(
                                     self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
                                     exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
                                     path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
                                 right_found = True
                     if waypoint.left_lane_marking and waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
-                        next_waypoint = waypoint.get_left_lane()
+                        next_waypoint = self._waypoint_cache.left_lane(waypoint)
                         if next_waypoint is not None \
                                 and next_waypoint.lane_type == carla.LaneType.Driving \
                                 and waypoint.road_id == next_waypoint.road_id:
                             next_road_option = RoadOption.CHANGELANELEFT
-                            next_segment = self._localize(next_waypoint.transform.location)
+                            next_segment = self._localize_on_map(next_waypoint.transform.location)
                             if next_segment is not None:
-                                self._graph.add_edge(
+                                self._builder.add_edge(
                                     self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
                                     exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
                                     path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
@@ -267,6 +523,20 @@ class GlobalRoutePlanner(object):
         This function finds the road segment that a given location
         is part of, returning the edge it belongs to
         """
+        index, _ = self._lane_index.nearest((location.x, location.y, location.z))
+        edge = None
+        if index is not None:
+            try:
+                edge = self._lane_edge(index)
+            except KeyError:
+                pass
+        return edge
+
+    def _localize_on_map(self, location):
+        """
+        This function finds the edge of a location with the map, used while the
+        graph is built and the lane index does not exist yet
+        """
         waypoint = self._wmap.get_waypoint(location)
         edge = None
         try:
@@ -275,15 +545,6 @@ class GlobalRoutePlanner(object):
             pass
         return edge
 
-    def _distance_heuristic(self, n1, n2):
-        """
-        Distance heuristic calculator for path searching
-        in self._graph
-        """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1-l2)
-
     def _path_search(self, origin, destination):
         """
         This function finds the shortest path connecting origin and destination
@@ -295,12 +556,31 @@ class GlobalRoutePlanner(object):
         """
         start, end = self._localize(origin), self._localize(destination)
 
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
-        route.append(end[1])
+        key = (start, end)
+        if key in self._route_cache:
+            self._route_cache.move_to_end(key)
+            route = self._route_cache[key]
+            if route is None:
+                raise NoRouteError('Node {} is not reachable from node {}'.format(end[0], start[0]))
+            return list(route)
+
+        try:
+            route = self._graph.astar(start[0], end[0])
+            route.append(end[1])
+        except NoRouteError:
+            self._cache_route(key, None)
+            raise
+        self._cache_route(key, tuple(route))
         return route
 
+    def _cache_route(self, key, route):
+        """Stores a searched route, None if there is none, dropping the least recently used"""
+        if self._route_cache_size <= 0:
+            return
+        self._route_cache[key] = route
+        if len(self._route_cache) > self._route_cache_size:
+            self._route_cache.popitem(last=False)
+
     def _successive_last_intersection_edge(self, index, route):
         """
         This method returns the last successive intersection edge
@@ -312,10 +592,11 @@ class GlobalRoutePlanner(object):
         last_intersection_edge = None
         last_node = None
         for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
-            candidate_edge = self._graph.edges[node1, node2]
+            candidate_edge = self._graph.edge(node1, node2)
             if node1 == route[index]:
                 last_intersection_edge = candidate_edge
-            if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
+            if self._graph.edge_type[candidate_edge] == RoadOption.LANEFOLLOW \
+                    and self._graph.edge_intersection[candidate_edge]:
                 last_intersection_edge = candidate_edge
                 last_node = node2
             else:
@@ -323,43 +604,45 @@ class GlobalRoutePlanner(object):
 
         return last_node, last_intersection_edge
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _turn_decision(self, index, route, previous_decision, intersection_end_node, threshold=math.radians(35)):
         """
         This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        around current index of route list, and the last node of the intersection
+        it was taken for. Both are passed on to the decision of the next index.
         """
 
+        graph = self._graph
         decision = None
         previous_node = route[index-1]
         current_node = route[index]
         next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
+        next_edge = graph.edge(current_node, next_node)
         if index > 0:
-            if self._previous_decision != RoadOption.VOID \
-                    and self._intersection_end_node > 0 \
-                    and self._intersection_end_node != previous_node \
-                    and next_edge['type'] == RoadOption.LANEFOLLOW \
-                    and next_edge['intersection']:
-                decision = self._previous_decision
+            if previous_decision != RoadOption.VOID \
+                    and intersection_end_node > 0 \
+                    and intersection_end_node != previous_node \
+                    and graph.edge_type[next_edge] == RoadOption.LANEFOLLOW \
+                    and graph.edge_intersection[next_edge]:
+                decision = previous_decision
             else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
-                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
-                    'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
+                intersection_end_node = -1
+                current_edge = graph.edge(previous_node, current_node)
+                calculate_turn = graph.edge_type[current_edge] == RoadOption.LANEFOLLOW \
+                    and not graph.edge_intersection[current_edge] \
+                    and graph.edge_type[next_edge] == RoadOption.LANEFOLLOW and graph.edge_intersection[next_edge]
                 if calculate_turn:
                     last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
+                    intersection_end_node = last_node
                     if tail_edge is not None:
                         next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
+                    cv, nv = graph.edge_vector('exit', current_edge), graph.edge_vector('exit', next_edge)
                     if cv is None or nv is None:
-                        return next_edge['type']
+                        return RoadOption(int(graph.edge_type[next_edge])), intersection_end_node
                     cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
+                    for neighbor, select_edge in graph.out_edges(current_node):
+                        if graph.edge_type[select_edge] == RoadOption.LANEFOLLOW:
                             if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
+                                sv = graph.edge_vector('net', select_edge)
                                 cross_list.append(np.cross(cv, sv)[2])
                     next_cross = np.cross(cv, nv)[2]
                     deviation = math.acos(np.clip(
@@ -377,22 +660,18 @@ class GlobalRoutePlanner(object):
                     elif next_cross > 0:
                         decision = RoadOption.RIGHT
                 else:
-                    decision = next_edge['type']
+                    decision = RoadOption(int(graph.edge_type[next_edge]))
 
         else:
-            decision = next_edge['type']
-
-        self._previous_decision = decision
-        return decision
-
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+            decision = RoadOption(int(graph.edge_type[next_edge]))
+
+        return decision, intersection_end_node
+
+    def _find_closest_in_list(self, location, waypoint_indices):
+        """
+        Returns the position in the list of waypoint indices of the waypoint
+        closest to the location, the first one on ties
+        """
+        xyz = self._graph_data['waypoint_xyz'][waypoint_indices]
+        distances = np.linalg.norm(xyz - np.array([location.x, location.y, location.z]), axis=1)
+        return int(np.argmin(distances))
@@ -6,12 +6,18 @@
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
 from enum import IntEnum
-from collections import deque
+import collections
+import itertools
 import random
+import threading
+import weakref
 
 import carla
 from agents.navigation.controller import VehiclePIDController
-from agents.tools.misc import draw_waypoints, get_speed
+from agents.navigation.waypoint_plan import WaypointPlan
+from agents.tools.misc import draw_waypoints
+from agents.tools.state_cache import ActorStateCache
+from agents.tools.waypoint_cache import get_waypoint_cache
 
 
 class RoadOption(IntEnum):
@@ -53,6 +59,9 @@ class LocalPlanner(object):
             max_brake: maximum brake applied to the vehicle
             max_steering: maximum steering applied to the vehicle
             offset: distance between the route waypoints and the center of the lane
+            state_cache: ActorStateCache updated with the snapshot of every tick
+            prefetch_horizon: extends the plan without a global plan from a background thread
+            horizon_budget: maximum time in seconds run_step waits for prefetched waypoints
         :param map_inst: carla.Map instance to avoid the expensive call of getting it.
         """
         self._vehicle = vehicle
@@ -65,12 +74,14 @@ class LocalPlanner(object):
                 self._map = self._world.get_map()
         else:
             self._map = self._world.get_map()
+        self._waypoint_cache = get_waypoint_cache(self._map)
 
         self._vehicle_controller = None
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = WaypointPlan()
+        self._plan_stream = None
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
 
@@ -87,6 +98,12 @@ class LocalPlanner(object):
         self._base_min_distance = 3.0
         self._distance_ratio = 0.5
         self._follow_speed_limits = False
+        self._state_cache = None
+        self._prefetch_horizon = True
+        self._horizon_budget = 0.002
+        self._horizon_prefetcher = None
+        self._stop_prefetcher = None
+        self._prefetch_anchor = None
 
         # Overload parameters
         if opt_dict:
@@ -114,6 +131,14 @@ class LocalPlanner(object):
                 self._distance_ratio = opt_dict['distance_ratio']
             if 'follow_speed_limits' in opt_dict:
                 self._follow_speed_limits = opt_dict['follow_speed_limits']
+            if 'state_cache' in opt_dict:
+                self._state_cache = opt_dict['state_cache']
+            if 'prefetch_horizon' in opt_dict:
+                self._prefetch_horizon = opt_dict['prefetch_horizon']
+            if 'horizon_budget' in opt_dict:
+                self._horizon_budget = opt_dict['horizon_budget']
+        if self._state_cache is None:
+            self._state_cache = ActorStateCache()
 
         # initializing controller
         self._init_controller()
@@ -121,6 +146,15 @@ class LocalPlanner(object):
     def reset_vehicle(self):
         """Reset the ego-vehicle"""
         self._vehicle = None
+        self.stop()
+
+    def stop(self):
+        """Stops the background prefetching of the horizon, it starts again when needed"""
+        if self._horizon_prefetcher is not None:
+            self._stop_prefetcher()
+            self._horizon_prefetcher = None
+            self._stop_prefetcher = None
+            self._prefetch_anchor = None
 
     def _init_controller(self):
         """Controller initialization"""
@@ -130,12 +164,13 @@ class LocalPlanner(object):
                                                         offset=self._offset,
                                                         max_throttle=self._max_throt,
                                                         max_brake=self._max_brake,
-                                                        max_steering=self._max_steer)
+                                                        max_steering=self._max_steer,
+                                                        state_cache=self._state_cache)
 
         # Compute the current vehicle waypoint
-        current_waypoint = self._map.get_waypoint(self._vehicle.get_location())
+        current_waypoint = self._map.get_waypoint(self._state_cache.get_location(self._vehicle))
         self.target_waypoint, self.target_road_option = (current_waypoint, RoadOption.LANEFOLLOW)
-        self._waypoints_queue.append((self.target_waypoint, self.target_road_option))
+        self._waypoints_queue.append(self.target_waypoint, self.target_road_option)
 
     def set_speed(self, speed):
         """
@@ -165,29 +200,39 @@ class LocalPlanner(object):
         :param k: how many waypoints to compute
         :return:
         """
-        # check we do not overflow the queue
-        available_entries = self._waypoints_queue.maxlen - len(self._waypoints_queue)
-        k = min(available_entries, k)
-
         for _ in range(k):
             last_waypoint = self._waypoints_queue[-1][0]
-            next_waypoints = list(last_waypoint.next(self._sampling_radius))
-
-            if len(next_waypoints) == 0:
+            next_step = _next_plan_step(last_waypoint, self._sampling_radius, self._waypoint_cache)
+            if next_step is None:
                 break
-            elif len(next_waypoints) == 1:
-                # only one option available ==> lanefollowing
-                next_waypoint = next_waypoints[0]
-                road_option = RoadOption.LANEFOLLOW
-            else:
-                # random choice between the possible options
-                road_options_list = _retrieve_options(
-                    next_waypoints, last_waypoint)
-                road_option = random.choice(road_options_list)
-                next_waypoint = next_waypoints[road_options_list.index(
-                    road_option)]
+            self._waypoints_queue.append(*next_step)
 
-            self._waypoints_queue.append((next_waypoint, road_option))
+    def _take_prefetched_waypoints(self, k):
+        """
+        Add up to k waypoints of the background prefetcher to the trajectory queue,
+        waiting at most the horizon budget if none is ready.
+
+        :param k: how many waypoints to add
+        :return:
+        """
+        if len(self._waypoints_queue) == 0:
+            return
+        if self._horizon_prefetcher is None:
+            self._horizon_prefetcher = HorizonPrefetcher(
+                self._sampling_radius, self._waypoint_cache, ahead=self._min_waypoint_queue_length)
+            # Also stopped once the planner is collected, if nobody stopped it
+            self._stop_prefetcher = weakref.finalize(self, self._horizon_prefetcher.stop)
+
+        # The prefetched waypoints only follow the plan if it still ends where they start
+        last_waypoint = self._waypoints_queue[-1][0]
+        if last_waypoint is not self._prefetch_anchor:
+            self._horizon_prefetcher.reset(last_waypoint)
+            self._prefetch_anchor = last_waypoint
+
+        plan = self._horizon_prefetcher.take(k, timeout=self._horizon_budget)
+        if plan:
+            self._waypoints_queue.extend(plan)
+            self._prefetch_anchor = plan[-1][0]
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
         """
@@ -202,19 +247,70 @@ class LocalPlanner(object):
         """
         if clean_queue:
             self._waypoints_queue.clear()
+            self._plan_stream = None
+        elif self._plan_stream is not None:
+            # The rest of a streamed plan comes before the new one
+            self._waypoints_queue.extend(self._plan_stream)
+            self._plan_stream = None
+        self._waypoints_queue.extend(current_plan)
 
-        # Remake the waypoints queue if the new plan has a higher length than the queue
-        new_plan_length = len(current_plan) + len(self._waypoints_queue)
-        if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
+        self._stop_waypoint_creation = stop_waypoint_creation
 
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+    def set_global_plan_stream(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
+        """
+        Adds a new plan like set_global_plan, but from an iterator of
+        [carla.Waypoint, RoadOption] pairs, e.g. GlobalRoutePlanner.iter_route.
+        The plan is only taken from the iterator as far as the horizon of the
+        queue reaches.
 
-        self._stop_waypoint_creation = stop_waypoint_creation
+        :param current_plan: iterator of (carla.Waypoint, RoadOption)
+        :param stop_waypoint_creation: bool
+        :param clean_queue: bool
+        :return:
+        """
+        self.set_global_plan([], stop_waypoint_creation=stop_waypoint_creation, clean_queue=clean_queue)
+        self._plan_stream = iter(current_plan)
+        self._take_streamed_waypoints(self._min_waypoint_queue_length)
+
+    def _take_streamed_waypoints(self, k):
+        """
+        Add up to k waypoints of the streamed plan to the trajectory queue.
+
+        :param k: how many waypoints to add
+        :return:
+        """
+        plan = list(itertools.islice(self._plan_stream, k))
+        self._waypoints_queue.extend(plan)
+        if len(plan) < k:
+            self._plan_stream = None
+
+    def splice_plan(self, route):
+        """
+        Replaces the start of the plan with a route that joins it, e.g. a way back
+        to the plan after the vehicle left it. The plan is kept from the first
+        waypoint of the route that is part of it; if there is none, the route
+        replaces the plan.
+
+        :param route: list of (carla.Waypoint, RoadOption)
+        :return: number of waypoints taken from the route
+        """
+        stream = self._plan_stream
+        positions = {}
+        for i, (waypoint, _) in enumerate(self._waypoints_queue):
+            positions.setdefault(waypoint.id, i)
+
+        prefix, remaining = route, []
+        for k, (waypoint, _) in enumerate(route):
+            if waypoint.id in positions:
+                prefix = route[:k]
+                remaining = list(self._waypoints_queue)[positions[waypoint.id]:]
+                break
+
+        self.set_global_plan(prefix + remaining, stop_waypoint_creation=self._stop_waypoint_creation)
+        if remaining:
+            # The streamed rest of the plan still follows the kept part
+            self._plan_stream = stream
+        return len(prefix)
 
     def set_offset(self, offset):
         """Sets an offset for the vehicle"""
@@ -229,33 +325,25 @@ class LocalPlanner(object):
         :return: control to be applied
         """
         if self._follow_speed_limits:
-            self._target_speed = self._vehicle.get_speed_limit()
-
-        # Add more waypoints too few in the horizon
-        if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
-            self._compute_next_waypoints(k=self._min_waypoint_queue_length)
+            self._target_speed = self._state_cache.get_speed_limit(self._vehicle)
+
+        # Take more of a streamed plan, or add more waypoints, if too few in the horizon
+        if self._plan_stream is not None and len(self._waypoints_queue) < self._min_waypoint_queue_length:
+            self._take_streamed_waypoints(k=self._min_waypoint_queue_length)
+        if not self._stop_waypoint_creation and self._plan_stream is None \
+                and len(self._waypoints_queue) < self._min_waypoint_queue_length:
+            if self._prefetch_horizon:
+                self._take_prefetched_waypoints(k=self._min_waypoint_queue_length)
+            else:
+                self._compute_next_waypoints(k=self._min_waypoint_queue_length)
 
         # Purge the queue of obsolete waypoints
-        veh_location = self._vehicle.get_location()
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        veh_location = self._state_cache.get_location(self._vehicle)
+        vehicle_speed = self._state_cache.get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + self._distance_ratio * vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Don't remove the last waypoint until very close by
+        self._waypoints_queue.purge(veh_location, self._min_distance, last_min_distance=1)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -291,7 +379,10 @@ class LocalPlanner(object):
                 return None, RoadOption.VOID
 
     def get_plan(self):
-        """Returns the current plan of the local planner"""
+        """
+        Returns the current plan of the local planner, as a WaypointPlan. Of a
+        streamed plan, it only holds the part taken so far.
+        """
         return self._waypoints_queue
 
     def done(self):
@@ -300,16 +391,121 @@ class LocalPlanner(object):
 
         :return: boolean
         """
-        return len(self._waypoints_queue) == 0
+        return len(self._waypoints_queue) == 0 and self._plan_stream is None
+
+
+class HorizonPrefetcher(object):
+    """
+    Background producer of the waypoints that extend a plan past its last
+    waypoint, choosing randomly at intersections like
+    LocalPlanner._compute_next_waypoints. It keeps a number of waypoints
+    ready ahead of demand, so the control loop only takes them.
+    """
+
+    def __init__(self, sampling_radius, waypoint_cache=None, ahead=100):
+        """
+        :param sampling_radius: distance between the waypoints
+        :param waypoint_cache: optional WaypointCache for the successor queries
+        :param ahead: number of waypoints kept ready
+        """
+        self._sampling_radius = sampling_radius
+        self._waypoint_cache = waypoint_cache
+        self._ahead = ahead
+        self._condition = threading.Condition()
+        self._pending = collections.deque()
+        self._tail = None
+        self._generation = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='horizon-prefetch', daemon=True)
+        self._thread.start()
+
+    def reset(self, waypoint):
+        """Drops the prepared waypoints and continues from the given waypoint"""
+        with self._condition:
+            self._pending.clear()
+            self._tail = waypoint
+            self._generation += 1
+            self._condition.notify_all()
+
+    def take(self, k, timeout=0.0):
+        """
+        Returns up to k prepared (carla.Waypoint, RoadOption), waiting at most
+        timeout seconds if none is ready. Returns an empty list at a dead end.
+        """
+        with self._condition:
+            if not self._pending and self._tail is not None:
+                self._condition.wait_for(lambda: self._pending or self._tail is None, timeout)
+            plan = [self._pending.popleft() for _ in range(min(k, len(self._pending)))]
+            self._condition.notify_all()
+        return plan
+
+    def stop(self):
+        """Stops the producer thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        # A planner collected by the producer thread itself stops it from there
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopped or (self._tail is not None and len(self._pending) < self._ahead))
+                if self._stopped:
+                    return
+                waypoint, generation = self._tail, self._generation
+
+            # The map is queried without the lock, the result is dropped if the plan was reset meanwhile
+            next_step = _next_plan_step(waypoint, self._sampling_radius, self._waypoint_cache)
+
+            with self._condition:
+                if generation != self._generation:
+                    continue
+                if next_step is None:
+                    self._tail = None
+                else:
+                    self._pending.append(next_step)
+                    self._tail = next_step[0]
+                self._condition.notify_all()
+
+
+def _next_plan_step(waypoint, sampling_radius, waypoint_cache=None):
+    """
+    Computes the waypoint following another one in a plan, choosing randomly
+    between the options at intersections.
+
+    :param waypoint: last waypoint of the plan
+    :param sampling_radius: distance to the next waypoint
+    :param waypoint_cache: optional WaypointCache for the successor queries
+    :return: (carla.Waypoint, RoadOption), or None if the lane ends
+    """
+    if waypoint_cache is not None:
+        next_waypoints = waypoint_cache.next(waypoint, sampling_radius)
+    else:
+        next_waypoints = list(waypoint.next(sampling_radius))
+
+    if len(next_waypoints) == 0:
+        return None
+    elif len(next_waypoints) == 1:
+        # only one option available ==> lanefollowing
+        return next_waypoints[0], RoadOption.LANEFOLLOW
+    else:
+        # random choice between the possible options
+        road_options_list = _retrieve_options(next_waypoints, waypoint, waypoint_cache)
+        road_option = random.choice(road_options_list)
+        return next_waypoints[road_options_list.index(road_option)], road_option
 
 
-def _retrieve_options(list_waypoints, current_waypoint):
+def _retrieve_options(list_waypoints, current_waypoint, waypoint_cache=None):
     """
     Compute the type of connection between the current active waypoint and the multiple waypoints present in
     list_waypoints. The result is encoded as a list of RoadOption enums.
 
     :param list_waypoints: list with the possible target waypoints in case of multiple options
     :param current_waypoint: current active waypoint
+    :param waypoint_cache: optional WaypointCache for the successor queries
     :return: list of RoadOption enums representing the type of connection from the active waypoint to each
              candidate in list_waypoints
     """
@@ -318,7 +514,10 @@ def _retrieve_options(list_waypoints, current_waypoint):
         # this is needed because something we are linking to
         # the beggining of an intersection, therefore the
         # variation in angle is small
-        next_next_waypoint = next_waypoint.next(3.0)[0]
+        if waypoint_cache is not None:
+            next_next_waypoint = waypoint_cache.next(next_waypoint, 3.0)[0]
+        else:
+            next_next_waypoint = next_waypoint.next(3.0)[0]
         link = _compute_connection(current_waypoint, next_next_waypoint)
         options.append(link)
 
@@ -0,0 +1,636 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module builds the route graph of the GlobalRoutePlanner straight from an
+OpenDRIVE (.xodr) file, without a CARLA server.
+
+The reference lines (lines, arcs, spirals, cubic polynomials and parametric
+cubic curves), lane offsets, lane widths and elevations are sampled with numpy.
+The lanes of type driving become the topology segments of the planner, joined
+through the road and junction links, and adjacent driving lanes whose lane
+marking allows it get lane change links. The result is graph data as in
+route_graph_data, in CARLA coordinates (y to the right), so it can be cached,
+loaded by the GlobalRoutePlanner and used to plan and check routes offline.
+
+Not modelled: superelevation, lane heights and the loose ends of the CARLA
+topology (every lane ends at the end of its lane section here).
+
+Build the cache of a map and check a route from the simulation directory with
+
+    python -m agents.navigation.opendrive ../custommap/HRI_custommap.xodr --map_name conflictmap \
+        --route -200 -36 -140 -36
+"""
+
+import argparse
+import collections
+import math
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from agents.navigation.route_graph import NoRouteError, RouteGraph, RouteGraphBuilder
+from agents.navigation.route_graph_data import cache_file_name, road_id_to_edge_from_data, save_graph_data
+
+# Values of agents.navigation.local_planner.RoadOption
+LANEFOLLOW = 4
+CHANGELANELEFT = 5
+CHANGELANERIGHT = 6
+
+# Distance of the topology end points from the borders of their lane section
+EPSILON = 1e-3
+# Integration step of the curves without a closed form
+INTEGRATION_STEP = 0.05
+
+LaneWaypoint = collections.namedtuple(
+    'LaneWaypoint', ['road_id', 'section_id', 'lane_id', 's', 'x', 'y', 'z', 'yaw'])
+LaneWaypoint.__doc__ = """
+Waypoint at the center of a lane, in CARLA coordinates. The yaw (in degrees)
+points in the driving direction of the lane.
+"""
+
+_Link = collections.namedtuple('_Link', ['element_type', 'element_id', 'contact_point'])
+_Connection = collections.namedtuple(
+    '_Connection', ['incoming_road', 'road', 'contact_point', 'lane_links', 'direct'])
+
+
+def _int(value):
+    # Some exporters write ids as floats, e.g. '1.0'
+    return int(float(value))
+
+
+def lane_waypoint_key(waypoint):
+    """Returns the OpenDRIVE key and the position of a LaneWaypoint, see graph_data_from_edges"""
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s), \
+        (waypoint.x, waypoint.y, waypoint.z)
+
+
+class _Polynomials(object):
+    """Piecewise cubic polynomials a + b*ds + c*ds^2 + d*ds^3, each starting at its own s"""
+
+    def __init__(self, starts, coefficients):
+        self._starts = np.asarray(starts, dtype=np.float64)
+        self._coefficients = np.asarray(coefficients, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def from_elements(cls, elements, start_attribute='s'):
+        elements = sorted(elements, key=lambda e: float(e.get(start_attribute, 0)))
+        return cls([float(e.get(start_attribute, 0)) for e in elements],
+                   [[float(e.get(k, 0)) for k in 'abcd'] for e in elements])
+
+    def __call__(self, s):
+        s = np.asarray(s, dtype=np.float64)
+        if len(self._starts) == 0:
+            return np.zeros_like(s)
+        index = np.clip(np.searchsorted(self._starts, s, side='right') - 1, 0, len(self._starts) - 1)
+        ds = s - self._starts[index]
+        a, b, c, d = self._coefficients[index].T
+        return a + ds * (b + ds * (c + ds * d))
+
+
+def _integrate(length, heading):
+    """
+    Integrates the position of a curve given by its heading on a fine grid,
+    returns the grid of arc lengths and the local x, y and heading on it.
+
+        :param heading: function of the arc lengths returning the heading
+    """
+    count = max(2, int(math.ceil(length / INTEGRATION_STEP)) + 1)
+    grid = np.linspace(0.0, length, count)
+    angles = heading(grid)
+    step = np.diff(grid)
+    x = np.concatenate(([0.0], np.cumsum(step * (np.cos(angles[1:]) + np.cos(angles[:-1])) / 2)))
+    y = np.concatenate(([0.0], np.cumsum(step * (np.sin(angles[1:]) + np.sin(angles[:-1])) / 2)))
+    return grid, x, y, angles
+
+
+class _Geometry(object):
+    """Geometry element of the plan view of a road"""
+
+    def __init__(self, element):
+        self.s = float(element.get('s'))
+        self.x = float(element.get('x'))
+        self.y = float(element.get('y'))
+        self.hdg = float(element.get('hdg'))
+        self.length = float(element.get('length'))
+        shape = element[0]
+        self.kind = shape.tag
+        self.attributes = {k: (v if k == 'pRange' else float(v)) for k, v in shape.attrib.items()}
+        self._table = None
+        if self.kind == 'spiral':
+            self._table = _integrate(self.length, self._spiral_heading)
+        elif self.kind == 'poly3':
+            self._table = self._poly3_table()
+        elif self.kind not in ('line', 'arc', 'paramPoly3'):
+            raise ValueError('Unsupported OpenDRIVE geometry <{}>'.format(self.kind))
+
+    def _spiral_heading(self, ds):
+        k0 = self.attributes['curvStart']
+        rate = (self.attributes['curvEnd'] - k0) / self.length if self.length > 0 else 0.0
+        return ds * (k0 + rate * ds / 2)
+
+    def _poly3_table(self):
+        a, b, c, d = (self.attributes[k] for k in 'abcd')
+        # The length of the curve bounds u, the sampled u are then mapped to the arc length
+        count = max(2, int(math.ceil(self.length / INTEGRATION_STEP)) + 1)
+        u = np.linspace(0.0, self.length, count)
+        v = a + u * (b + u * (c + u * d))
+        slope = b + u * (2 * c + 3 * d * u)
+        arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(u), np.diff(v)))))
+        return arc, u, v, np.arctan(slope)
+
+    def sample(self, ds):
+        """
+        Returns the x, y and heading of the reference line at the offsets ds
+        from the start of the geometry.
+        """
+        if self.kind == 'line':
+            u, v, heading = ds, np.zeros_like(ds), np.zeros_like(ds)
+        elif self.kind == 'arc':
+            k = self.attributes['curvature']
+            heading = k * ds
+            if abs(k) < 1e-12:
+                u, v = ds, np.zeros_like(ds)
+            else:
+                u, v = np.sin(heading) / k, (1 - np.cos(heading)) / k
+        elif self.kind == 'paramPoly3':
+            p = ds if self.attributes.get('pRange', 'normalized') == 'arcLength' else ds / self.length
+            au, bu, cu, du = (self.attributes.get(k, 0.0) for k in ('aU', 'bU', 'cU', 'dU'))
+            av, bv, cv, dv = (self.attributes.get(k, 0.0) for k in ('aV', 'bV', 'cV', 'dV'))
+            u = au + p * (bu + p * (cu + p * du))
+            v = av + p * (bv + p * (cv + p * dv))
+            heading = np.arctan2(bv + p * (2 * cv + 3 * dv * p), bu + p * (2 * cu + 3 * du * p))
+        else:
+            grid, x, y, table_heading = self._table
+            u, v, heading = (np.interp(ds, grid, values) for values in (x, y, table_heading))
+        cos_hdg, sin_hdg = math.cos(self.hdg), math.sin(self.hdg)
+        return self.x + u * cos_hdg - v * sin_hdg, self.y + u * sin_hdg + v * cos_hdg, self.hdg + heading
+
+
+class _Lane(object):
+    """Lane of a lane section"""
+
+    def __init__(self, element):
+        self.id = _int(element.get('id'))
+        self.type = element.get('type')
+        self.width = _Polynomials.from_elements(element.findall('width'), start_attribute='sOffset')
+        predecessor = element.find('link/predecessor')
+        successor = element.find('link/successor')
+        self.predecessor = _int(predecessor.get('id')) if predecessor is not None else None
+        self.successor = _int(successor.get('id')) if successor is not None else None
+        marks = sorted(element.findall('roadMark'), key=lambda e: float(e.get('sOffset', 0)))
+        self._mark_starts = np.array([float(e.get('sOffset', 0)) for e in marks])
+        self._mark_lane_changes = [_lane_change(e) for e in marks]
+
+    def lane_change(self, ds):
+        """Returns the lane change allowed by the road mark of the lane at the offset ds"""
+        if not self._mark_lane_changes:
+            return 'none'
+        index = max(0, int(np.searchsorted(self._mark_starts, ds, side='right')) - 1)
+        return self._mark_lane_changes[index]
+
+
+def _lane_change(road_mark):
+    """
+    Returns the lane change ('increase', 'decrease', 'both' or 'none') of a
+    road mark. Without a laneChange attribute, only broken marks can be crossed.
+    """
+    lane_change = road_mark.get('laneChange')
+    if lane_change is not None:
+        return lane_change
+    kinds = road_mark.get('type', 'none').split()
+    return 'both' if kinds and all(kind == 'broken' for kind in kinds) else 'none'
+
+
+class _LaneSection(object):
+    """Lane section of a road, from s to end"""
+
+    def __init__(self, element, s, end):
+        self.s = s
+        self.end = end
+        self.lanes = {}
+        for side in ('left', 'center', 'right'):
+            for lane in element.findall(side + '/lane'):
+                lane = _Lane(lane)
+                self.lanes[lane.id] = lane
+
+
+def _parse_link(element, tag):
+    if element is None or element.find(tag) is None:
+        return None
+    link = element.find(tag)
+    return _Link(link.get('elementType', 'road'), _int(link.get('elementId')), link.get('contactPoint'))
+
+
+class _Road(object):
+    """Road with its reference line, elevation, lane offsets and lane sections"""
+
+    def __init__(self, element):
+        self.id = _int(element.get('id'))
+        self.junction = _int(element.get('junction', -1))
+        self.length = float(element.get('length'))
+        link = element.find('link')
+        self.predecessor = _parse_link(link, 'predecessor')
+        self.successor = _parse_link(link, 'successor')
+        self.geometries = sorted(
+            (_Geometry(e) for e in element.findall('planView/geometry')), key=lambda g: g.s)
+        self._geometry_starts = np.array([g.s for g in self.geometries])
+        self.elevation = _Polynomials.from_elements(element.findall('elevationProfile/elevation'))
+        self.lane_offset = _Polynomials.from_elements(element.findall('lanes/laneOffset'))
+        sections = sorted(element.findall('lanes/laneSection'), key=lambda e: float(e.get('s')))
+        starts = [float(e.get('s')) for e in sections]
+        ends = starts[1:] + [self.length]
+        self.sections = [_LaneSection(e, s, end) for e, s, end in zip(sections, starts, ends)]
+
+    def reference_line(self, s):
+        """Returns the x, y and heading of the reference line at s, in OpenDRIVE coordinates"""
+        s = np.clip(np.asarray(s, dtype=np.float64), 0.0, self.length)
+        x, y, heading = np.empty_like(s), np.empty_like(s), np.empty_like(s)
+        index = np.clip(
+            np.searchsorted(self._geometry_starts, s, side='right') - 1, 0, len(self.geometries) - 1)
+        for i, geometry in enumerate(self.geometries):
+            mask = index == i
+            if mask.any():
+                x[mask], y[mask], heading[mask] = geometry.sample(s[mask] - geometry.s)
+        return x, y, heading
+
+    def lane_center(self, section_id, lane_id, s):
+        """
+        Returns the x, y, z and yaw (driving direction, degrees) of the center
+        of a lane at s, in CARLA coordinates.
+        """
+        s = np.asarray(s, dtype=np.float64)
+        section = self.sections[section_id]
+        ds = s - section.s
+        side = 1 if lane_id > 0 else -1
+        t = self.lane_offset(s)
+        for inner_id in range(side, lane_id, side):
+            if inner_id in section.lanes:
+                t = t + side * section.lanes[inner_id].width(ds)
+        t = t + side * section.lanes[lane_id].width(ds) / 2
+        x, y, heading = self.reference_line(s)
+        x, y = x - t * np.sin(heading), y + t * np.cos(heading)
+        if lane_id > 0:
+            heading = heading + math.pi
+        # OpenDRIVE is right-handed, CARLA flips the y axis
+        return x, -y, self.elevation(s), -np.degrees(heading)
+
+
+class OpenDriveMap(object):
+    """
+    Roads, lanes and junctions of an OpenDRIVE file.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: root element of the parsed OpenDRIVE document
+        """
+        self.roads = collections.OrderedDict()
+        for element in root.findall('road'):
+            road = _Road(element)
+            self.roads[road.id] = road
+        self.junctions = {}
+        for element in root.findall('junction'):
+            connections = []
+            for connection in element.findall('connection'):
+                # Direct junctions link the incoming road to a linked road
+                direct = connection.get('connectingRoad') is None
+                road = connection.get('linkedRoad') if direct else connection.get('connectingRoad')
+                lane_links = [(_int(l.get('from')), _int(l.get('to'))) for l in connection.findall('laneLink')]
+                connections.append(_Connection(
+                    _int(connection.get('incomingRoad')), _int(road), connection.get('contactPoint'),
+                    lane_links, direct))
+            self.junctions[_int(element.get('id'))] = connections
+
+    @classmethod
+    def from_string(cls, opendrive):
+        return cls(ET.fromstring(opendrive))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(ET.parse(path).getroot())
+
+    def driving_lanes(self):
+        """Yields the (road_id, section_id, lane_id) of all the lanes of type driving"""
+        for road in self.roads.values():
+            for section_id, section in enumerate(road.sections):
+                for lane_id, lane in section.lanes.items():
+                    if lane_id != 0 and lane.type == 'driving':
+                        yield road.id, section_id, lane_id
+
+    def lane_range(self, road_id, section_id, lane_id):
+        """
+        Returns the s of the entry and the exit of a lane. Lanes with negative
+        ids are driven along s, the others against it.
+        """
+        section = self.roads[road_id].sections[section_id]
+        start, end = section.s + EPSILON, max(section.s + EPSILON, section.end - EPSILON)
+        return (start, end) if lane_id < 0 else (end, start)
+
+    def waypoints(self, road_id, section_id, lane_id, s):
+        """Returns the LaneWaypoints of a lane at the given s values"""
+        s = np.asarray(s, dtype=np.float64).reshape(-1)
+        x, y, z, yaw = self.roads[road_id].lane_center(section_id, lane_id, s)
+        return [LaneWaypoint(road_id, section_id, lane_id, *values)
+                for values in zip(s.tolist(), x.tolist(), y.tolist(), z.tolist(), yaw.tolist())]
+
+    def waypoint(self, road_id, section_id, lane_id, s):
+        return self.waypoints(road_id, section_id, lane_id, [s])[0]
+
+    def successors(self, road_id, section_id, lane_id):
+        """Returns the (road_id, section_id, lane_id) of the lanes following a lane"""
+        road = self.roads[road_id]
+        lane = road.sections[section_id].lanes[lane_id]
+        forward = lane_id < 0
+        next_lane_id = lane.successor if forward else lane.predecessor
+        next_section_id = section_id + (1 if forward else -1)
+        candidates = []
+        if 0 <= next_section_id < len(road.sections):
+            if next_lane_id is None:
+                next_lane_id = self._linked_back(road_id, next_section_id, forward, lane_id)
+            if next_lane_id is not None:
+                candidates.append((road_id, next_section_id, next_lane_id))
+        else:
+            link = road.successor if forward else road.predecessor
+            if link is None:
+                pass
+            elif link.element_type == 'road':
+                target = self._section_at_contact(link.element_id, link.contact_point)
+                if target is not None and next_lane_id is None:
+                    # Some exporters only write the link on one of the two lanes
+                    linked_road = self.roads[link.element_id]
+                    back_link = linked_road.predecessor if link.contact_point == 'start' else linked_road.successor
+                    if back_link is not None and back_link.element_type == 'road' \
+                            and back_link.element_id == road_id:
+                        next_lane_id = self._linked_back(
+                            target[0], target[1], link.contact_point == 'start', lane_id)
+                if target is not None and next_lane_id is not None:
+                    candidates.append(target + (next_lane_id,))
+            else:
+                for connection in self.junctions.get(link.element_id, []):
+                    if connection.incoming_road == road_id:
+                        target = self._section_at_contact(connection.road, connection.contact_point)
+                        candidates.extend(
+                            target + (to_id,) for from_id, to_id in connection.lane_links
+                            if from_id == lane_id and target is not None)
+                    elif connection.direct and connection.road == road_id:
+                        # Direct junctions are driven in both directions, back to the
+                        # end of the incoming road that touches the junction
+                        incoming = self.roads.get(connection.incoming_road)
+                        if incoming is None:
+                            continue
+                        is_successor = incoming.successor is not None and incoming.successor.element_type == 'junction' \
+                            and incoming.successor.element_id == link.element_id
+                        target = self._section_at_contact(incoming.id, 'end' if is_successor else 'start')
+                        candidates.extend(
+                            target + (from_id,) for from_id, to_id in connection.lane_links if to_id == lane_id)
+        return [c for c in candidates if self._is_driving(*c)]
+
+    def _section_at_contact(self, road_id, contact_point):
+        road = self.roads.get(road_id)
+        if road is None:
+            return None
+        return road_id, 0 if contact_point == 'start' else len(road.sections) - 1
+
+    def _linked_back(self, road_id, section_id, at_start, lane_id):
+        """
+        Returns the lane of a lane section whose predecessor (at_start) or
+        successor link names the given lane, or None.
+        """
+        for candidate in self.roads[road_id].sections[section_id].lanes.values():
+            if (candidate.predecessor if at_start else candidate.successor) == lane_id:
+                return candidate.id
+        return None
+
+    def _is_driving(self, road_id, section_id, lane_id):
+        lane = self.roads[road_id].sections[section_id].lanes.get(lane_id)
+        return lane is not None and lane_id != 0 and lane.type == 'driving'
+
+    def advance(self, waypoint, distance, max_hops=100):
+        """
+        Returns the waypoint at the given distance ahead of a waypoint, following
+        the first successor at the end of the lane, or None at a dead end.
+        """
+        road_id, section_id, lane_id, s = waypoint[:4]
+        for _ in range(max_hops):
+            _, exit_s = self.lane_range(road_id, section_id, lane_id)
+            direction = 1 if lane_id < 0 else -1
+            remaining = (exit_s - s) * direction
+            if distance <= remaining:
+                return self.waypoint(road_id, section_id, lane_id, s + direction * distance)
+            successors = self.successors(road_id, section_id, lane_id)
+            if not successors:
+                return None
+            distance -= max(remaining, 0.0)
+            road_id, section_id, lane_id = successors[0]
+            s = self.lane_range(road_id, section_id, lane_id)[0]
+        return None
+
+    def lane_change(self, waypoint, right):
+        """
+        Returns the waypoint on the driving lane to the right (or left) of a
+        waypoint, or None if there is none or the lane marking forbids the change.
+        """
+        road_id, section_id, lane_id, s = waypoint[:4]
+        section = self.roads[road_id].sections[section_id]
+        side = 1 if lane_id > 0 else -1
+        if right:
+            # The right side of the driving direction is the outer side of both road sides
+            target_id, marking_lane_id = lane_id + side, lane_id
+        else:
+            target_id, marking_lane_id = lane_id - side, lane_id - side
+            if target_id == 0:
+                target_id = -side
+        marking_lane = section.lanes.get(marking_lane_id)
+        if marking_lane is None or not self._is_driving(road_id, section_id, target_id):
+            return None
+        lane_change = marking_lane.lane_change(s - section.s)
+        allowed = lane_change == 'both' \
+            or (lane_change == 'increase' and target_id > lane_id) \
+            or (lane_change == 'decrease' and target_id < lane_id)
+        if not allowed:
+            return None
+        return self.waypoint(road_id, section_id, target_id, s)
+
+
+def _forward_vector(waypoint):
+    yaw = math.radians(waypoint.yaw)
+    return np.array([math.cos(yaw), math.sin(yaw), 0.0])
+
+
+def _distance(waypoint_1, waypoint_2):
+    return math.sqrt((waypoint_1.x - waypoint_2.x) ** 2 + (waypoint_1.y - waypoint_2.y) ** 2
+                     + (waypoint_1.z - waypoint_2.z) ** 2)
+
+
+def _unit_vector(waypoint_1, waypoint_2):
+    offset = np.array([waypoint_2.x - waypoint_1.x, waypoint_2.y - waypoint_1.y, waypoint_2.z - waypoint_1.z])
+    return offset / (np.linalg.norm(offset) + np.finfo(float).eps)
+
+
+def _topology(odr_map, sampling_resolution):
+    """
+    Returns the topology segments of the driving lanes, as the GlobalRoutePlanner
+    builds them from carla.Map.get_topology.
+    """
+    topology = []
+    for road_id, section_id, lane_id in odr_map.driving_lanes():
+        entry_s, exit_s = odr_map.lane_range(road_id, section_id, lane_id)
+        entry, exit_wp = odr_map.waypoints(road_id, section_id, lane_id, [entry_s, exit_s])
+        if _distance(entry, exit_wp) > sampling_resolution:
+            direction = 1 if lane_id < 0 else -1
+            count = int(abs(exit_s - entry_s) // sampling_resolution)
+            s_values = entry_s + direction * sampling_resolution * np.arange(1, count + 1)
+            path = odr_map.waypoints(road_id, section_id, lane_id, s_values)
+            xyz = np.array([(w.x, w.y, w.z) for w in path]).reshape(-1, 3)
+            close = np.flatnonzero(np.linalg.norm(xyz - [exit_wp.x, exit_wp.y, exit_wp.z], axis=1)
+                                   <= sampling_resolution)
+            if close.size:
+                path = path[:close[0]]
+        else:
+            next_wp = odr_map.advance(entry, sampling_resolution)
+            if next_wp is None:
+                continue
+            path = [next_wp]
+        topology.append({
+            'entry': entry, 'exit': exit_wp, 'path': path,
+            # Rounding off to avoid floating point imprecision
+            'entryxyz': tuple(np.round([entry.x, entry.y, entry.z], 0).tolist()),
+            'exitxyz': tuple(np.round([exit_wp.x, exit_wp.y, exit_wp.z], 0).tolist()),
+        })
+    return topology
+
+
+def build_graph_data(odr_map, sampling_resolution):
+    """
+    Builds the graph data of the GlobalRoutePlanner for an OpenDRIVE map.
+
+        :param odr_map: OpenDriveMap
+        :param sampling_resolution: distance between the path waypoints
+    """
+    topology = _topology(odr_map, sampling_resolution)
+    builder = RouteGraphBuilder(lane_waypoint_key)
+
+    for segment in topology:
+        entry_wp, exit_wp, path = segment['entry'], segment['exit'], segment['path']
+        n1, n2 = builder.add_node(segment['entryxyz']), builder.add_node(segment['exitxyz'])
+        builder.add_lane(entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id, (n1, n2))
+        builder.add_edge(
+            n1, n2,
+            length=len(path) + 1, path=path,
+            entry_waypoint=entry_wp, exit_waypoint=exit_wp,
+            entry_vector=_forward_vector(entry_wp), exit_vector=_forward_vector(exit_wp),
+            net_vector=_unit_vector(entry_wp, exit_wp),
+            intersection=odr_map.roads[entry_wp.road_id].junction != -1, type=LANEFOLLOW)
+
+    # Lane change links
+    for segment in topology:
+        entry_wp = segment['entry']
+        if odr_map.roads[entry_wp.road_id].junction != -1:
+            continue
+        found = {True: False, False: False}
+        for waypoint in segment['path']:
+            for right in (True, False):
+                if found[right]:
+                    continue
+                next_waypoint = odr_map.lane_change(waypoint, right)
+                if next_waypoint is None:
+                    continue
+                next_segment = builder.road_id_to_edge.get(next_waypoint.road_id, {}).get(
+                    next_waypoint.section_id, {}).get(next_waypoint.lane_id)
+                if next_segment is not None:
+                    builder.add_edge(
+                        builder.id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
+                        exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
+                        path=[], length=0, type=CHANGELANERIGHT if right else CHANGELANELEFT,
+                        change_waypoint=next_waypoint)
+                    found[right] = True
+            if found[True] and found[False]:
+                break
+
+    return builder.graph_data(sampling_resolution)
+
+
+def plan_route(data, origin, destination):
+    """
+    Plans a route on graph data with A*, like GlobalRoutePlanner._path_search.
+
+        :param data: graph data, see route_graph_data
+        :param origin: (x, y, z) of the start, in CARLA coordinates
+        :param destination: (x, y, z) of the end, in CARLA coordinates
+        :return: the node ids of the route and the indices of its waypoints in
+            the graph data, or (None, None) if the destination is not reachable
+    """
+    road_id_to_edge = road_id_to_edge_from_data(data)
+    xyz = data['waypoint_xyz']
+
+    def localize(location):
+        index = int(np.argmin(np.linalg.norm(xyz - np.asarray(location, dtype=np.float64), axis=1)))
+        return road_id_to_edge[int(data['waypoint_road'][index])][int(data['waypoint_section'][index])][
+            int(data['waypoint_lane'][index])]
+
+    graph = RouteGraph(data)
+    start, end = localize(origin), localize(destination)
+    try:
+        route = graph.astar(start[0], end[0])
+    except NoRouteError:
+        return None, None
+    route.append(end[1])
+
+    offsets = data['edge_path_offsets']
+    waypoints = []
+    for n1, n2 in zip(route[:-1], route[1:]):
+        i = graph.edge(n1, n2)
+        if data['edge_type'][i] == LANEFOLLOW:
+            waypoints.append(int(data['edge_entry_waypoint'][i]))
+            waypoints.extend(data['path_waypoints'][offsets[i]:offsets[i + 1]].tolist())
+            waypoints.append(int(data['edge_exit_waypoint'][i]))
+    return route, waypoints
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Builds and caches the route graph of an OpenDRIVE map without a CARLA server')
+    argparser.add_argument('xodr', help='OpenDRIVE file of the map')
+    argparser.add_argument(
+        '--sampling_resolution', type=float, default=2.0, help='Distance between the path waypoints in meters')
+    argparser.add_argument(
+        '--map_name', default=None,
+        help='Name of the map in CARLA, used in the cache file name (default: the file name without extension)')
+    argparser.add_argument(
+        '--cache_dir', default='route_cache', help="Directory of the route graph cache, '' skips saving")
+    argparser.add_argument(
+        '--route', type=float, nargs=4, metavar=('X1', 'Y1', 'X2', 'Y2'), action='append', default=[],
+        help='Check that a route exists between two locations in CARLA coordinates, can be repeated')
+    args = argparser.parse_args()
+
+    with open(args.xodr, encoding='utf-8') as xodr_file:
+        opendrive = xodr_file.read()
+    data = build_graph_data(OpenDriveMap.from_string(opendrive), args.sampling_resolution)
+    print('{} nodes, {} edges ({} lane changes), {} waypoints'.format(
+        len(data['node_ids']), len(data['edge_src']), int((data['edge_type'] != LANEFOLLOW).sum()),
+        len(data['waypoint_s'])))
+
+    if args.cache_dir:
+        map_name = args.map_name or os.path.splitext(os.path.basename(args.xodr))[0]
+        path = os.path.join(args.cache_dir, cache_file_name(map_name, opendrive, args.sampling_resolution, 'opendrive'))
+        save_graph_data(path, data)
+        print('Saved the route graph to {}'.format(path))
+
+    failed = 0
+    for x1, y1, x2, y2 in args.route:
+        route, waypoints = plan_route(data, (x1, y1, 0.0), (x2, y2, 0.0))
+        if route is None:
+            failed += 1
+            print('No route from ({}, {}) to ({}, {})'.format(x1, y1, x2, y2))
+            continue
+        xyz = data['waypoint_xyz'][waypoints]
+        length = np.linalg.norm(np.diff(xyz, axis=0), axis=1).sum()
+        print('Route from ({}, {}) to ({}, {}): {} edges, {} waypoints, {:.1f} m'.format(
+            x1, y1, x2, y2, len(route) - 1, len(waypoints), length))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a process-wide registry of the carla.Map and
+GlobalRoutePlanner instances shared by the agents.
+"""
+
+import concurrent.futures
+import threading
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+
+
+class PlannerRegistry(object):
+    """
+    Hands out one carla.Map per world episode and one GlobalRoutePlanner per map
+    name and sampling resolution, so agents share them instead of each fetching
+    the map and building the route graph again.
+
+    A planner can be built in a background thread with prefetch while the
+    caller sets up the rest of the simulation, get_planner then waits for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._planners = {}
+
+    def register_map(self, world, wmap):
+        """Registers a carla.Map already fetched for the world"""
+        with self._lock:
+            self._maps[world.id] = wmap
+
+    def get_map(self, world):
+        """Returns the carla.Map of the world, fetched once per episode"""
+        with self._lock:
+            wmap = self._maps.get(world.id)
+        if wmap is None:
+            wmap = world.get_map()
+            with self._lock:
+                wmap = self._maps.setdefault(world.id, wmap)
+        return wmap
+
+    def prefetch(self, wmap, sampling_resolution, **kwargs):
+        """
+        Starts building the planner of the map in a background thread, unless it
+        is built or being built already.
+
+            :param wmap: carla.Map to plan on
+            :param sampling_resolution: distance between the waypoints of the routes
+            :param kwargs: other arguments of the GlobalRoutePlanner, only used if it
+                is built by this call
+            :return: concurrent.futures.Future of the planner
+        """
+        return self._planner_future(wmap, sampling_resolution, kwargs, background=True)
+
+    def get_planner(self, wmap, sampling_resolution, **kwargs):
+        """
+        Returns the planner of the map, waiting for a prefetch or building it
+        in this thread. Arguments as for prefetch.
+        """
+        return self._planner_future(wmap, sampling_resolution, kwargs, background=False).result()
+
+    def clear(self):
+        """Forgets all maps and planners, e.g. after the map content changed"""
+        with self._lock:
+            self._maps.clear()
+            self._planners.clear()
+
+    def _planner_future(self, wmap, sampling_resolution, kwargs, background):
+        key = (wmap.name, float(sampling_resolution))
+        with self._lock:
+            future = self._planners.get(key)
+            created = future is None
+            if created:
+                future = concurrent.futures.Future()
+                self._planners[key] = future
+        if created:
+            if background:
+                thread = threading.Thread(
+                    target=self._build, args=(key, future, wmap, sampling_resolution, kwargs),
+                    name='route-planner', daemon=True)
+                thread.start()
+            else:
+                self._build(key, future, wmap, sampling_resolution, kwargs)
+        return future
+
+    def _build(self, key, future, wmap, sampling_resolution, kwargs):
+        try:
+            planner = GlobalRoutePlanner(wmap, sampling_resolution, **kwargs)
+        except Exception as error:  # pylint: disable=broad-except
+            # Failed builds are not kept, the next request tries again
+            with self._lock:
+                if self._planners.get(key) is future:
+                    del self._planners[key]
+            future.set_exception(error)
+        else:
+            future.set_result(planner)
+
+
+_registry = PlannerRegistry()
+
+
+def get_planner_registry():
+    """Returns the registry shared by the process"""
+    return _registry
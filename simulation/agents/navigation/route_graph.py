@@ -0,0 +1,299 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides the compact route graph of the GlobalRoutePlanner.
+
+The graph keeps the nodes and edges of the graph data (see route_graph_data)
+in contiguous arrays, with the outgoing edges of every node in CSR form
+(indptr / adjacent nodes / adjacent edges). The waypoints of the edges stay
+indices into the waypoint table of the graph data, so no carla.Waypoint is
+created until a route needs it.
+"""
+
+import collections
+import heapq
+import itertools
+import math
+
+import numpy as np
+
+from agents.navigation.route_graph_data import graph_data_from_edges
+
+
+class NoRouteError(Exception):
+    """Raised when the destination node can not be reached from the origin node"""
+
+
+ShortestPathTree = collections.namedtuple('ShortestPathTree', ['root', 'costs', 'parents', 'reverse'])
+ShortestPathTree.__doc__ = """
+Result of RouteGraph.shortest_path_tree, with the costs and the parents of the
+nodes indexed by node row. Nodes that were not reached cost inf, the root and
+the unreached nodes have the parent -1.
+"""
+
+
+class RouteGraph(object):
+    """
+    Directed route graph over the arrays of the graph data.
+
+    Nodes are addressed by their node id, edges by their index in the edge
+    arrays. The outgoing edges of a node keep the order of the graph data.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: graph data, see route_graph_data
+        """
+        self.node_ids = data['node_ids']
+        self.node_xyz = data['node_xyz']
+        self._node_index = {node_id: row for row, node_id in enumerate(self.node_ids.tolist())}
+
+        self.edge_src = data['edge_src']
+        self.edge_dst = data['edge_dst']
+        self.edge_length = data['edge_length'].astype(np.float64)
+        self.edge_type = data['edge_type']
+        self.edge_intersection = data['edge_intersection']
+        self.edge_entry_vector = data['edge_entry_vector']
+        self.edge_exit_vector = data['edge_exit_vector']
+        self.edge_net_vector = data['edge_net_vector']
+        self.edge_entry_waypoint = data['edge_entry_waypoint']
+        self.edge_exit_waypoint = data['edge_exit_waypoint']
+        self.edge_change_waypoint = data['edge_change_waypoint']
+        self.edge_path_offsets = data['edge_path_offsets']
+        self.path_waypoints = data['path_waypoints']
+
+        # Outgoing edges in CSR form, a stable sort keeps the order of the edges of a node
+        src_rows = np.array([self._node_index[n] for n in self.edge_src.tolist()], dtype=np.int64)
+        dst_rows = np.array([self._node_index[n] for n in self.edge_dst.tolist()], dtype=np.int64)
+        order = np.argsort(src_rows, kind='stable')
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(src_rows, minlength=len(self.node_ids)))))
+        self.adjacent_nodes = dst_rows[order]
+        self.adjacent_edges = order
+        self._edge_rows = (src_rows, dst_rows)
+
+        # Plain lists for the search loop, indexing numpy arrays per element is slow
+        self._indptr = self.indptr.tolist()
+        self._adjacent_nodes = self.adjacent_nodes.tolist()
+        self._adjacent_edges = self.adjacent_edges.tolist()
+        self._lengths = self.edge_length.tolist()
+        self._xyz = self.node_xyz.tolist()
+        self._reverse = None
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_src)
+
+    def node_row(self, node_id):
+        return self._node_index[node_id]
+
+    def vertex(self, node_id):
+        """Returns the (x, y, z) of a node"""
+        return tuple(self._xyz[self._node_index[node_id]])
+
+    def out_edges(self, node_id):
+        """Returns the (neighbor node id, edge index) of the outgoing edges of a node"""
+        row = self._node_index[node_id]
+        start, end = self._indptr[row], self._indptr[row + 1]
+        node_ids = self.node_ids
+        return [(int(node_ids[n]), e) for n, e in zip(self._adjacent_nodes[start:end], self._adjacent_edges[start:end])]
+
+    def successors(self, node_id):
+        return [n for n, _ in self.out_edges(node_id)]
+
+    def edge(self, n1, n2):
+        """Returns the index of the edge from n1 to n2, raises KeyError if there is none"""
+        row, target = self._node_index[n1], self._node_index[n2]
+        for k in range(self._indptr[row], self._indptr[row + 1]):
+            if self._adjacent_nodes[k] == target:
+                return self._adjacent_edges[k]
+        raise KeyError((n1, n2))
+
+    def edge_vector(self, name, edge):
+        """Returns the entry, exit or net vector of an edge, None if it has none"""
+        value = getattr(self, 'edge_{}_vector'.format(name))[edge]
+        return None if np.isnan(value).any() else value
+
+    def edge_path(self, edge):
+        """Returns the waypoint indices of the path of an edge"""
+        return self.path_waypoints[self.edge_path_offsets[edge]:self.edge_path_offsets[edge + 1]].tolist()
+
+    def astar(self, source, target):
+        """
+        A* search with the straight line distance between the nodes as heuristic
+        and the edge lengths as weights. Expands the nodes in the same order as
+        networkx.astar_path.
+
+            :param source: node id of the start
+            :param target: node id of the end
+            :return: list of node ids from source to target
+        """
+        source, target = self._node_index[source], self._node_index[target]
+        indptr, adjacent_nodes, adjacent_edges = self._indptr, self._adjacent_nodes, self._adjacent_edges
+        lengths, xyz = self._lengths, self._xyz
+        tx, ty, tz = xyz[target]
+
+        def heuristic(row):
+            x, y, z = xyz[row]
+            return math.sqrt((x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2)
+
+        counter = itertools.count()
+        queue = [(0, next(counter), source, 0, -1)]
+        # Cost of the queued nodes, and parents of the expanded ones (-1 for the source)
+        unseen, unexplored = -1.0, -2
+        queued_cost = [unseen] * len(self._indptr)
+        explored = [unexplored] * len(self._indptr)
+        while queue:
+            _, _, row, cost, parent = heapq.heappop(queue)
+            if row == target:
+                path = [row]
+                node = parent
+                while node != -1:
+                    path.append(node)
+                    node = explored[node]
+                path.reverse()
+                node_ids = self.node_ids
+                return [int(node_ids[r]) for r in path]
+            if explored[row] != unexplored:
+                if explored[row] == -1:
+                    continue
+                if queued_cost[row] < cost:
+                    continue
+            explored[row] = parent
+            for k in range(indptr[row], indptr[row + 1]):
+                neighbor = adjacent_nodes[k]
+                neighbor_cost = cost + lengths[adjacent_edges[k]]
+                previous_cost = queued_cost[neighbor]
+                if previous_cost != unseen and previous_cost <= neighbor_cost:
+                    continue
+                queued_cost[neighbor] = neighbor_cost
+                heapq.heappush(queue, (neighbor_cost + heuristic(neighbor), next(counter), neighbor, neighbor_cost, row))
+        raise NoRouteError('Node {} is not reachable from node {}'.format(
+            int(self.node_ids[target]), int(self.node_ids[source])))
+
+    def _reverse_adjacency(self):
+        """Returns the incoming edges of the nodes in CSR form, built on first use"""
+        if self._reverse is None:
+            src_rows, dst_rows = self._edge_rows
+            order = np.argsort(dst_rows, kind='stable')
+            indptr = np.concatenate(([0], np.cumsum(np.bincount(dst_rows, minlength=len(self.node_ids)))))
+            self._reverse = (indptr.tolist(), src_rows[order].tolist(), order.tolist())
+        return self._reverse
+
+    def shortest_path_tree(self, root, targets=None, reverse=False):
+        """
+        Dijkstra search from a node with the edge lengths as weights, so one
+        search answers the routes between the node and any number of targets.
+
+            :param root: node id of the root of the tree
+            :param targets: optional node ids, the search stops once they are all settled
+            :param reverse: if True, the tree holds the routes from the nodes to the
+                root instead of the routes from the root to the nodes
+            :return: ShortestPathTree
+        """
+        if reverse:
+            indptr, adjacent_nodes, adjacent_edges = self._reverse_adjacency()
+        else:
+            indptr, adjacent_nodes, adjacent_edges = self._indptr, self._adjacent_nodes, self._adjacent_edges
+        lengths = self._lengths
+        source = self._node_index[root]
+        remaining = None if targets is None else {self._node_index[t] for t in targets}
+
+        costs = [math.inf] * len(self._indptr)
+        parents = [-1] * len(self._indptr)
+        settled = [False] * len(self._indptr)
+        costs[source] = 0
+        queue = [(0, source)]
+        while queue:
+            cost, row = heapq.heappop(queue)
+            if settled[row]:
+                continue
+            settled[row] = True
+            if remaining is not None:
+                remaining.discard(row)
+                if not remaining:
+                    break
+            for k in range(indptr[row], indptr[row + 1]):
+                neighbor = adjacent_nodes[k]
+                neighbor_cost = cost + lengths[adjacent_edges[k]]
+                if neighbor_cost < costs[neighbor]:
+                    costs[neighbor] = neighbor_cost
+                    parents[neighbor] = row
+                    heapq.heappush(queue, (neighbor_cost, neighbor))
+        return ShortestPathTree(root, costs, parents, reverse)
+
+    def tree_cost(self, tree, node_id):
+        """Returns the cost of the route between the root of a tree and a node, inf if there is none"""
+        return tree.costs[self._node_index[node_id]]
+
+    def tree_path(self, tree, node_id):
+        """
+        Returns the node ids of the route between the root of a tree and a node,
+        from the root for a tree and to the root for a reverse tree. Raises
+        NoRouteError if the node was not reached.
+        """
+        row = self._node_index[node_id]
+        if tree.costs[row] == math.inf:
+            if tree.reverse:
+                raise NoRouteError('Node {} is not reachable from node {}'.format(tree.root, node_id))
+            raise NoRouteError('Node {} is not reachable from node {}'.format(node_id, tree.root))
+        path = [row]
+        while tree.parents[row] != -1:
+            row = tree.parents[row]
+            path.append(row)
+        if not tree.reverse:
+            path.reverse()
+        node_ids = self.node_ids
+        return [int(node_ids[r]) for r in path]
+
+
+class RouteGraphBuilder(object):
+    """
+    Collects the nodes and edges of a route graph and turns them into graph data.
+
+    Nodes are numbered in insertion order by their rounded position. Adding an
+    edge that exists updates its attributes, as networkx.DiGraph.add_edge does.
+    """
+
+    def __init__(self, waypoint_key):
+        """
+        :param waypoint_key: function returning the OpenDRIVE key and the position
+            of the waypoints of the edges, see graph_data_from_edges
+        """
+        self._waypoint_key = waypoint_key
+        self.id_map = dict()  # Map with structure {(x,y,z): id, ... }
+        self.road_id_to_edge = dict()  # Map with structure {road_id: {section_id: {lane_id: edge}}}
+        self._vertices = collections.OrderedDict()
+        self._adjacency = collections.OrderedDict()
+
+    def add_node(self, vertex, node_id=None):
+        """
+        Returns the id of the node at the vertex, adding it if needed. Nodes with
+        an explicit id are not registered in the id map.
+        """
+        if node_id is None:
+            if vertex in self.id_map:
+                return self.id_map[vertex]
+            node_id = len(self.id_map)
+            self.id_map[vertex] = node_id
+        if node_id not in self._vertices:
+            self._vertices[node_id] = vertex
+            self._adjacency[node_id] = collections.OrderedDict()
+        return node_id
+
+    def add_lane(self, road_id, section_id, lane_id, edge):
+        self.road_id_to_edge.setdefault(road_id, {}).setdefault(section_id, {})[lane_id] = edge
+
+    def add_edge(self, n1, n2, **attributes):
+        self._adjacency[n1].setdefault(n2, {}).update(attributes)
+
+    def graph_data(self, sampling_resolution):
+        """Returns the graph data of the collected graph"""
+        nodes = list(self._vertices.items())
+        edges = [(n1, n2, attributes)
+                 for n1, successors in self._adjacency.items() for n2, attributes in successors.items()]
+        return graph_data_from_edges(
+            nodes, edges, self.road_id_to_edge, sampling_resolution, self._waypoint_key)
@@ -0,0 +1,197 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a serializable representation of the GlobalRoutePlanner graph.
+
+The graph data is a dictionary of numpy arrays with the nodes, the edges and
+their attributes. Waypoints are stored as OpenDRIVE keys (road_id, section_id,
+lane_id, s) together with their position, and are turned back into
+carla.Waypoint objects with carla.Map.get_waypoint_xodr, so a planner can be
+rebuilt without walking the map again. The data is cached on disk, keyed by
+the map name, a hash of the OpenDRIVE content, the sampling resolution and the
+builder. The same data can be built offline from an OpenDRIVE file, see
+opendrive, but it can differ from the one walked from the map topology, so
+the two are cached apart.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+GRAPH_DATA_VERSION = 1
+
+_EDGE_VECTORS = ('entry_vector', 'exit_vector', 'net_vector')
+
+# Builders of the graph data, the GlobalRoutePlanner topology or an OpenDRIVE file
+GRAPH_BUILDERS = ('topology', 'opendrive')
+
+
+def opendrive_hash(opendrive):
+    """Returns the SHA-1 hex digest of the OpenDRIVE content"""
+    return hashlib.sha1(opendrive.encode('utf-8')).hexdigest()
+
+
+def cache_file_name(map_name, opendrive, sampling_resolution, builder):
+    """
+    Returns the file name of the cached graph data of a map at the given resolution.
+
+        :param map_name: name of the map, without the path
+        :param opendrive: OpenDRIVE content of the map
+        :param sampling_resolution: distance between the path waypoints
+        :param builder: builder of the graph data, one of GRAPH_BUILDERS
+    """
+    if builder not in GRAPH_BUILDERS:
+        raise ValueError("Unknown route graph builder '{}', expected one of {}".format(builder, GRAPH_BUILDERS))
+    return '{}_{}_{:g}_{}.npz'.format(map_name, opendrive_hash(opendrive)[:16], sampling_resolution, builder)
+
+
+def cache_path(cache_dir, wmap, sampling_resolution, builder):
+    """
+    Returns the path of the cached graph data of the map at the given resolution.
+    """
+    map_name = wmap.name.split('/')[-1]
+    return os.path.join(cache_dir, cache_file_name(map_name, wmap.to_opendrive(), sampling_resolution, builder))
+
+
+def carla_waypoint_key(waypoint):
+    """Returns the OpenDRIVE key (road_id, section_id, lane_id, s) and the position of a carla.Waypoint"""
+    location = waypoint.transform.location
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s), \
+        (location.x, location.y, location.z)
+
+
+class _WaypointTable(object):
+    """Collects unique waypoints as OpenDRIVE keys and positions"""
+
+    def __init__(self, waypoint_key):
+        self._waypoint_key = waypoint_key
+        self._index = {}
+        self.keys = []
+        self.xyz = []
+
+    def add(self, waypoint):
+        if waypoint is None:
+            return -1
+        key, xyz = self._waypoint_key(waypoint)
+        rounded_key = key[:3] + (round(key[3], 4),)
+        if rounded_key not in self._index:
+            self._index[rounded_key] = len(self.keys)
+            # The exact s, a rounded one can fall outside of the lane
+            self.keys.append(key)
+            self.xyz.append(xyz)
+        return self._index[rounded_key]
+
+
+def graph_data_from_edges(nodes, edges, road_id_to_edge, sampling_resolution, waypoint_key):
+    """
+    Converts the nodes and edges of a route graph into graph data.
+
+        :param nodes: list of (node_id, (x, y, z))
+        :param edges: list of (n1, n2, attributes) with the edge attributes of the GlobalRoutePlanner
+        :param road_id_to_edge: map {road_id: {section_id: {lane_id: (n1, n2)}}}
+        :param sampling_resolution: distance between the path waypoints
+        :param waypoint_key: function returning the OpenDRIVE key and the position of a waypoint
+    """
+    waypoints = _WaypointTable(waypoint_key)
+
+    data = {
+        'version': np.array(GRAPH_DATA_VERSION),
+        'sampling_resolution': np.array(sampling_resolution, dtype=np.float64),
+        'node_ids': np.array([n for n, _ in nodes], dtype=np.int64).reshape(-1),
+        'node_xyz': np.array([vertex for _, vertex in nodes], dtype=np.float64).reshape(-1, 3),
+        'edge_src': np.array([e[0] for e in edges], dtype=np.int64),
+        'edge_dst': np.array([e[1] for e in edges], dtype=np.int64),
+        'edge_type': np.array([int(e[2]['type']) for e in edges], dtype=np.int8),
+        'edge_length': np.array([e[2]['length'] for e in edges], dtype=np.int64),
+        'edge_intersection': np.array([bool(e[2]['intersection']) for e in edges], dtype=bool),
+    }
+    for name in _EDGE_VECTORS:
+        vectors = np.full((len(edges), 3), np.nan)
+        for i, (_, _, attributes) in enumerate(edges):
+            if attributes.get(name) is not None:
+                vectors[i] = attributes[name]
+        data['edge_' + name] = vectors
+
+    path_offsets = [0]
+    path_waypoints = []
+    entry_waypoints, exit_waypoints, change_waypoints = [], [], []
+    for _, _, attributes in edges:
+        entry_waypoints.append(waypoints.add(attributes['entry_waypoint']))
+        exit_waypoints.append(waypoints.add(attributes['exit_waypoint']))
+        change_waypoints.append(waypoints.add(attributes.get('change_waypoint')))
+        path_waypoints.extend(waypoints.add(wp) for wp in attributes['path'])
+        path_offsets.append(len(path_waypoints))
+    data['edge_entry_waypoint'] = np.array(entry_waypoints, dtype=np.int64)
+    data['edge_exit_waypoint'] = np.array(exit_waypoints, dtype=np.int64)
+    data['edge_change_waypoint'] = np.array(change_waypoints, dtype=np.int64)
+    data['edge_path_offsets'] = np.array(path_offsets, dtype=np.int64)
+    data['path_waypoints'] = np.array(path_waypoints, dtype=np.int64)
+
+    keys = np.array(waypoints.keys, dtype=np.float64).reshape(-1, 4)
+    data['waypoint_road'] = keys[:, 0].astype(np.int64)
+    data['waypoint_section'] = keys[:, 1].astype(np.int64)
+    data['waypoint_lane'] = keys[:, 2].astype(np.int64)
+    data['waypoint_s'] = keys[:, 3]
+    data['waypoint_xyz'] = np.array(waypoints.xyz, dtype=np.float64).reshape(-1, 3)
+
+    lane_edges = [
+        (road_id, section_id, lane_id, n1, n2)
+        for road_id, sections in road_id_to_edge.items()
+        for section_id, lanes in sections.items()
+        for lane_id, (n1, n2) in lanes.items()
+    ]
+    data['lane_edges'] = np.array(lane_edges, dtype=np.int64).reshape(-1, 5)
+    return data
+
+
+def road_id_to_edge_from_data(data):
+    """Returns the map {road_id: {section_id: {lane_id: (n1, n2)}}} of the graph data"""
+    road_id_to_edge = {}
+    for road_id, section_id, lane_id, n1, n2 in data['lane_edges'].tolist():
+        road_id_to_edge.setdefault(road_id, {}).setdefault(section_id, {})[lane_id] = (n1, n2)
+    return road_id_to_edge
+
+
+def resolve_waypoint(wmap, data, index):
+    """
+    Returns the carla.Waypoint of the graph data with the given index, or None for -1.
+    """
+    if index < 0:
+        return None
+    road_id = int(data['waypoint_road'][index])
+    lane_id = int(data['waypoint_lane'][index])
+    waypoint = wmap.get_waypoint_xodr(road_id, lane_id, float(data['waypoint_s'][index]))
+    if waypoint is None:
+        # Fall back to the closest waypoint to the stored position. Imported here,
+        # the graph data itself is built and read without the CARLA client library.
+        import carla
+        x, y, z = data['waypoint_xyz'][index]
+        waypoint = wmap.get_waypoint(carla.Location(float(x), float(y), float(z)))
+    return waypoint
+
+
+def save_graph_data(path, data):
+    """Writes the graph data atomically to a .npz file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **data)
+    os.replace(tmp_path, path)
+
+
+def load_graph_data(path):
+    """Reads graph data written by save_graph_data, or returns None if it is missing or outdated"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as archive:
+            data = {name: archive[name] for name in archive.files}
+    except (OSError, ValueError) as error:
+        print("Warning: Ignoring the unreadable route graph cache {}: {}".format(path, error))
+        return None
+    if int(data.get('version', -1)) != GRAPH_DATA_VERSION:
+        return None
+    return data
@@ -0,0 +1,113 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a uniform grid index over line segments, used to find
+the lane closest to a location without querying the map.
+"""
+
+import math
+
+import numpy as np
+
+
+class SegmentGrid(object):
+    """
+    Uniform grid over the x-y bounding boxes of 3D line segments.
+
+    A segment is registered in every cell its bounding box overlaps. The
+    nearest segment to a point is searched in rings of cells around the cell
+    of the point, until no unvisited cell can hold a closer segment.
+    """
+
+    def __init__(self, starts, ends, labels, cell_size=10.0):
+        """
+        :param starts: array (N, 3) of the start points of the segments
+        :param ends: array (N, 3) of the end points of the segments
+        :param labels: array (N,) of the values returned for the segments
+        :param cell_size: side of the grid cells in meters
+        """
+        self._starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        self._vectors = np.asarray(ends, dtype=np.float64).reshape(-1, 3) - self._starts
+        self._squared_lengths = np.einsum('ij,ij->i', self._vectors, self._vectors)
+        self._labels = np.asarray(labels)
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        if len(self._starts) == 0:
+            self._min_cell = self._max_cell = (0, 0)
+            return
+
+        points = np.stack((self._starts[:, :2], self._starts[:, :2] + self._vectors[:, :2]))
+        low = np.floor(points.min(axis=0) / self.cell_size).astype(np.int64)
+        high = np.floor(points.max(axis=0) / self.cell_size).astype(np.int64)
+        self._min_cell = tuple(low.min(axis=0).tolist())
+        self._max_cell = tuple(high.max(axis=0).tolist())
+
+        # Register every segment in the cells of its bounding box, one cell offset at a time
+        spans = high - low
+        cell_x, cell_y, segments = [], [], []
+        for dx in range(int(spans[:, 0].max()) + 1):
+            for dy in range(int(spans[:, 1].max()) + 1):
+                selected = np.flatnonzero((spans[:, 0] >= dx) & (spans[:, 1] >= dy))
+                cell_x.append(low[selected, 0] + dx)
+                cell_y.append(low[selected, 1] + dy)
+                segments.append(selected)
+        cell_x, cell_y, segments = np.concatenate(cell_x), np.concatenate(cell_y), np.concatenate(segments)
+        order = np.lexsort((segments, cell_y, cell_x))
+        cell_x, cell_y, segments = cell_x[order], cell_y[order], segments[order]
+        boundaries = np.flatnonzero((np.diff(cell_x) != 0) | (np.diff(cell_y) != 0)) + 1
+        for chunk_x, chunk_y, chunk in zip(
+                np.split(cell_x, boundaries), np.split(cell_y, boundaries), np.split(segments, boundaries)):
+            self._cells[(int(chunk_x[0]), int(chunk_y[0]))] = chunk
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _ring(self, cx, cy, ring):
+        """Returns the segments registered in the cells at Chebyshev distance ring"""
+        if ring == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = [(cx + i, cy + j) for i in range(-ring, ring + 1) for j in (-ring, ring)]
+            cells += [(cx + i, cy + j) for i in (-ring, ring) for j in range(-ring + 1, ring)]
+        found = [self._cells[cell] for cell in cells if cell in self._cells]
+        return np.concatenate(found) if found else None
+
+    def distances(self, point, segments):
+        """Returns the distances of a point to the given segments"""
+        offsets = np.asarray(point, dtype=np.float64) - self._starts[segments]
+        vectors = self._vectors[segments]
+        squared_lengths = self._squared_lengths[segments]
+        t = np.einsum('ij,ij->i', offsets, vectors) / np.where(squared_lengths > 0, squared_lengths, 1.0)
+        t = np.clip(t, 0.0, 1.0)
+        return np.linalg.norm(offsets - t[:, None] * vectors, axis=1)
+
+    def nearest(self, point):
+        """
+        Returns the label of the segment nearest to a point (x, y, z) and its
+        distance, or (None, inf) if the grid is empty.
+        """
+        if not self._cells:
+            return None, math.inf
+        cx = int(math.floor(point[0] / self.cell_size))
+        cy = int(math.floor(point[1] / self.cell_size))
+        # Beyond this ring there are no more cells
+        last_ring = max(abs(cx - self._min_cell[0]), abs(cx - self._max_cell[0]),
+                        abs(cy - self._min_cell[1]), abs(cy - self._max_cell[1]))
+        best_segment, best_distance = -1, math.inf
+        # Rings before this one are outside of the grid
+        ring = max(0, cx - self._max_cell[0], self._min_cell[0] - cx, cy - self._max_cell[1], self._min_cell[1] - cy)
+        while ring <= last_ring:
+            segments = self._ring(cx, cy, ring)
+            if segments is not None:
+                distances = self.distances(point, segments)
+                # Ties go to the segment given first, as in a linear scan
+                closest = segments[distances == distances.min()].min()
+                distance = float(distances.min())
+                if distance < best_distance or (distance == best_distance and closest < best_segment):
+                    best_segment, best_distance = int(closest), distance
+            # Segments in the next rings are at least this far away
+            if best_distance <= ring * self.cell_size:
+                break
+            ring += 1
+        return self._labels[best_segment].item(), best_distance
@@ -0,0 +1,182 @@
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains the array-backed waypoint plan of the LocalPlanner. """
+
+import numpy as np
+
+
+class WaypointPlan(object):
+    """
+    Queue of (carla.Waypoint, RoadOption) pairs kept in parallel numpy arrays.
+
+    The position, yaw, OpenDRIVE ids and road option of every entry are stored
+    in arrays, so purging the reached waypoints and looking at the horizon are
+    vectorized operations on slices. Consumed entries are skipped by moving a
+    head index; the arrays are compacted when they run out of space. Iterating
+    and indexing yield (carla.Waypoint, RoadOption) pairs like a deque, indices
+    being relative to the head.
+    """
+
+    _FIELDS = (
+        ('x', np.float64), ('y', np.float64), ('z', np.float64), ('yaw', np.float64),
+        ('road_id', np.int32), ('section_id', np.int32), ('lane_id', np.int32), ('road_option', np.int8),
+    )
+
+    def __init__(self, capacity=256):
+        """
+        :param capacity: initial number of entries of the arrays
+        """
+        self._capacity = max(int(capacity), 1)
+        self._arrays = {name: np.zeros(self._capacity, dtype=dtype) for name, dtype in self._FIELDS}
+        self._waypoints = [None] * self._capacity
+        self._road_options = [None] * self._capacity
+        self._head = 0
+        self._tail = 0
+        # For caches of values derived from the entries: the generation changes when
+        # the entries are cleared, start counts the entries removed from the head since
+        self.generation = 0
+        self.start = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def __iter__(self):
+        for i in range(self._head, self._tail):
+            yield self._waypoints[i], self._road_options[i]
+
+    def __getitem__(self, index):
+        return self._waypoints[self._position(index)], self._road_options[self._position(index)]
+
+    def _position(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('plan index out of range')
+        return self._head + index
+
+    def _reserve(self, count):
+        """Makes room for count more entries at the tail"""
+        if self._tail + count <= self._capacity:
+            return
+        size = len(self)
+        capacity = self._capacity
+        while size + count > capacity:
+            capacity *= 2
+        for name, dtype in self._FIELDS:
+            array = np.zeros(capacity, dtype=dtype)
+            array[:size] = self._arrays[name][self._head:self._tail]
+            self._arrays[name] = array
+        self._waypoints = self._waypoints[self._head:self._tail] + [None] * (capacity - size)
+        self._road_options = self._road_options[self._head:self._tail] + [None] * (capacity - size)
+        self._capacity, self._head, self._tail = capacity, 0, size
+
+    def append(self, waypoint, road_option):
+        """Adds a waypoint at the end of the plan"""
+        self.extend([(waypoint, road_option)])
+
+    def extend(self, plan):
+        """Adds a list of (carla.Waypoint, RoadOption) at the end of the plan"""
+        plan = list(plan)
+        if not plan:
+            return
+        self._reserve(len(plan))
+        start, end = self._tail, self._tail + len(plan)
+        values = {name: [] for name, _ in self._FIELDS}
+        for waypoint, road_option in plan:
+            transform = waypoint.transform
+            values['x'].append(transform.location.x)
+            values['y'].append(transform.location.y)
+            values['z'].append(transform.location.z)
+            values['yaw'].append(transform.rotation.yaw)
+            values['road_id'].append(waypoint.road_id)
+            values['section_id'].append(waypoint.section_id)
+            values['lane_id'].append(waypoint.lane_id)
+            values['road_option'].append(int(road_option))
+        for name, _ in self._FIELDS:
+            self._arrays[name][start:end] = values[name]
+        self._waypoints[start:end] = [waypoint for waypoint, _ in plan]
+        self._road_options[start:end] = [road_option for _, road_option in plan]
+        self._tail = end
+
+    def clear(self):
+        """Removes all the entries"""
+        self._waypoints[self._head:self._tail] = [None] * len(self)
+        self._road_options[self._head:self._tail] = [None] * len(self)
+        self._head = self._tail = 0
+        self.generation += 1
+        self.start = 0
+
+    def popleft(self, count=1):
+        """Removes the first count entries"""
+        count = min(count, len(self))
+        if count <= 0:
+            return
+        end = self._head + count
+        self._waypoints[self._head:end] = [None] * count
+        self._road_options[self._head:end] = [None] * count
+        self._head = end
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        self.start += count
+
+    def array(self, name, start=0, stop=None):
+        """
+        Returns a view of the entries start:stop of one of the arrays: x, y, z,
+        yaw (degrees), road_id, section_id, lane_id or road_option
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._arrays[name][self._head + start:self._head + stop]
+
+    def xyz(self, start=0, stop=None):
+        """Returns the positions of the entries start:stop as an array (N, 3)"""
+        return np.stack([self.array(name, start, stop) for name in ('x', 'y', 'z')], axis=1)
+
+    def waypoints(self, start=0, stop=None):
+        """Returns the carla.Waypoint of the entries start:stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._waypoints[self._head + start:self._head + stop]
+
+    def distances(self, location, start=0, stop=None):
+        """Returns the distances of the entries start:stop to a carla.Location"""
+        offsets = self.xyz(start, stop) - np.array([location.x, location.y, location.z])
+        return np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+
+    def horizon(self, location, max_distance):
+        """
+        Returns the number of leading entries closer than max_distance to the
+        location, up to the first one that is further
+        """
+        return self._leading(location, max_distance, max_distance, inclusive=True)
+
+    def purge(self, location, min_distance, last_min_distance=1.0):
+        """
+        Removes the leading entries closer than min_distance to the location,
+        up to the first one that is further. The last entry is only removed
+        closer than last_min_distance.
+
+            :return: number of removed entries
+        """
+        count = self._leading(location, min_distance, last_min_distance)
+        self.popleft(count)
+        return count
+
+    def _leading(self, location, distance, last_distance, inclusive=False):
+        """Counts the leading entries within the distance, checked in growing windows"""
+        within_distance = np.less_equal if inclusive else np.less
+        size, start, window = len(self), 0, 32
+        while start < size:
+            stop = min(start + window, size)
+            within = within_distance(self.distances(location, start, stop), distance)
+            if stop == size:
+                within[-1] = within_distance(self.distances(location, size - 1)[0], last_distance)
+            if not within.all():
+                return start + int(np.argmin(within))
+            start, window = stop, window * 2
+        return size
+
+    def right_vectors(self, start=0, stop=None):
+        """Returns the x-y right vectors of the entries start:stop, for waypoints without roll"""
+        yaw = np.radians(self.array('yaw', start, stop))
+        return np.stack((-np.sin(yaw), np.cos(yaw)), axis=1)
+
@@ -0,0 +1,146 @@
+""" Module with a rate-limited debug drawing layer on top of carla.DebugHelper. """
+
+import numpy as np
+import carla
+
+
+def decimate_polyline(points, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification of a polyline.
+
+        :param points: array of shape (N, 3)
+        :param tolerance: maximum distance in meters of a removed point to the simplified line
+        :return: indices of the kept points
+    """
+    n = len(points)
+    if n < 3:
+        return list(range(n))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        length = np.linalg.norm(segment)
+        offsets = points[start + 1:end] - points[start]
+        if length > 0:
+            distances = np.linalg.norm(np.cross(offsets, segment / length), axis=1)
+        else:
+            distances = np.linalg.norm(offsets, axis=1)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep).tolist()
+
+
+class NullDebugDrawer(object):
+    """
+    Debug drawer that draws nothing, used when debug drawing is switched off.
+    Callers can check `enabled` to skip building the primitives altogether.
+    """
+
+    enabled = False
+
+    def point(self, location, size=0.1, color=carla.Color(255, 0, 0), life_time=1.0):
+        pass
+
+    def polyline(self, locations, thickness=0.05, color=carla.Color(255, 0, 0), life_time=1.0, tolerance=None):
+        pass
+
+    def arrow(self, begin, end, arrow_size=0.3, color=carla.Color(255, 0, 0), life_time=1.0):
+        pass
+
+    def flush(self):
+        return 0
+
+
+class DebugDrawer(NullDebugDrawer):
+    """
+    Collects the debug primitives of a frame and draws them on `flush`.
+
+    Polylines are decimated into a few line segments, and at most
+    `max_calls_per_tick` primitives are sent per flush. Primitives over the
+    cap that live at least `carry_life_time` seconds, like a route drawn once,
+    are carried into the next flushes ahead of the new ones; shorter lived
+    ones are redrawn by the next frames anyway, so they are dropped and
+    counted in `dropped`.
+    """
+
+    enabled = True
+
+    def __init__(self, world, max_calls_per_tick=100, tolerance=0.1, carry_life_time=5.0):
+        """
+        :param world: carla.World to draw in
+        :param max_calls_per_tick: maximum number of draw calls per flush
+        :param tolerance: default decimation tolerance of polylines in meters
+        :param carry_life_time: minimum life time in seconds of the primitives
+            over the cap that are drawn by the next flushes instead of dropped
+        """
+        self._debug = world.debug
+        self.max_calls_per_tick = max_calls_per_tick
+        self.tolerance = tolerance
+        self.carry_life_time = carry_life_time
+        self._primitives = []
+        self._carried = []
+        self.dropped = 0
+
+    def point(self, location, size=0.1, color=carla.Color(255, 0, 0), life_time=1.0):
+        self._primitives.append((self._debug.draw_point, (location,), {
+            'size': size, 'color': color, 'life_time': life_time}))
+
+    def polyline(self, locations, thickness=0.05, color=carla.Color(255, 0, 0), life_time=1.0, tolerance=None):
+        """
+        Queues a polyline through the locations, simplified to the given tolerance.
+        """
+        locations = list(locations)
+        if len(locations) == 1:
+            self.point(locations[0], size=2 * thickness, color=color, life_time=life_time)
+            return
+        points = np.array([[l.x, l.y, l.z] for l in locations])
+        indices = decimate_polyline(points, self.tolerance if tolerance is None else tolerance)
+        for begin, end in zip(indices[:-1], indices[1:]):
+            self._primitives.append((self._debug.draw_line, (locations[begin], locations[end]), {
+                'thickness': thickness, 'color': color, 'life_time': life_time}))
+
+    def arrow(self, begin, end, arrow_size=0.3, color=carla.Color(255, 0, 0), life_time=1.0):
+        self._primitives.append((self._debug.draw_arrow, (begin, end), {
+            'arrow_size': arrow_size, 'color': color, 'life_time': life_time}))
+
+    def flush(self):
+        """
+        Draws the carried and the new primitives, up to the cap; returns the number of draw calls.
+        """
+        pending = self._carried + self._primitives
+        primitives = pending[:self.max_calls_per_tick]
+        overflow = pending[self.max_calls_per_tick:]
+        self._carried = [p for p in overflow if p[2]['life_time'] >= self.carry_life_time]
+        self.dropped += len(overflow) - len(self._carried)
+        self._primitives = []
+        for draw, args, kwargs in primitives:
+            draw(*args, **kwargs)
+        return len(primitives)
+
+
+_NULL_DRAWER = NullDebugDrawer()
+_drawer = _NULL_DRAWER
+
+
+def set_debug_drawer(drawer):
+    """
+    Sets the drawer used by get_debug_drawer, None switches debug drawing off.
+    """
+    global _drawer
+    _drawer = drawer if drawer is not None else _NULL_DRAWER
+
+
+def get_debug_drawer():
+    """
+    Returns the active debug drawer, a NullDebugDrawer when debug drawing is off.
+    """
+    return _drawer
@@ -12,20 +12,25 @@ import math
 import numpy as np
 import carla
 
+from agents.tools.debug_draw import get_debug_drawer
+
 def draw_waypoints(world, waypoints, z=0.5):
     """
-    Draw a list of waypoints at a certain height given in z.
+    Draw a list of waypoints at a certain height given in z, with the active debug drawer.
 
-        :param world: carla.world object
+        :param world: carla.world object (unused, kept for compatibility)
         :param waypoints: list or iterable container with the waypoints to draw
         :param z: height in meters
     """
+    drawer = get_debug_drawer()
+    if not drawer.enabled:
+        return
     for wpt in waypoints:
         wpt_t = wpt.transform
         begin = wpt_t.location + carla.Location(z=z)
         angle = math.radians(wpt_t.rotation.yaw)
         end = begin + carla.Location(x=math.cos(angle), y=math.sin(angle))
-        world.debug.draw_arrow(begin, end, arrow_size=0.3, life_time=1.0)
+        drawer.arrow(begin, end, arrow_size=0.3, life_time=1.0)
 
 
 def get_speed(vehicle):
@@ -103,6 +108,29 @@ def is_within_distance(target_transform, reference_transform, max_distance, angl
     return min_angle < angle < max_angle
 
 
+def are_within_distance(target_points, reference_point, reference_forward, max_distance, angle_interval=None):
+    """
+    Vectorized is_within_distance over many targets, in the x-y plane.
+
+    :param target_points: array (N, 2) of the x-y locations of the targets
+    :param reference_point: x-y location of the reference object
+    :param reference_forward: x-y of the forward vector of the reference object
+    :param max_distance: maximum allowed distance
+    :param angle_interval: only locations between [min, max] angles will be considered. This isn't checked by default.
+    :return: boolean array (N,)
+    """
+    target_vectors = np.asarray(target_points, dtype=np.float64) - np.asarray(reference_point, dtype=np.float64)
+    norm_targets = np.linalg.norm(target_vectors, axis=1)
+    within = norm_targets <= max_distance
+    if angle_interval:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosines = target_vectors.dot(np.asarray(reference_forward, dtype=np.float64)) / norm_targets
+        angles = np.degrees(np.arccos(np.clip(cosines, -1., 1.)))
+        within &= (angle_interval[0] < angles) & (angles < angle_interval[1])
+    # If the vector is too short, the target is within
+    return within | (norm_targets < 0.001)
+
+
 def compute_magnitude_angle(target_location, current_location, orientation):
     """
     Compute relative angle and distance between a target_location and a current_location
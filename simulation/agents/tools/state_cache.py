@@ -0,0 +1,157 @@
+""" Module with a per-frame cache of actor states read from the world snapshot. """
+
+import collections
+import math
+
+import numpy as np
+
+
+class ActorStateCache(object):
+    """
+    Per-frame view of actor states built from the carla.WorldSnapshot of a tick.
+
+    The transforms and velocities of all actors are read from the snapshot,
+    so the consumers of a frame share one state instead of each querying the
+    actor. Queries that cannot be answered from the snapshot (no snapshot
+    yet, actor not in the snapshot, speed limits) fall back to the actor and
+    are counted per tick in `remaining_calls`. Without snapshot nothing is
+    cached, as no tick tells when the values go stale.
+    """
+
+    def __init__(self, speed_limit_period=10, waypoint_tolerance=0.1):
+        """
+        :param speed_limit_period: number of frames the speed limit of an actor
+            is reused before it is fetched again
+        :param waypoint_tolerance: distance in meters an actor moves before the
+            map waypoint of its location is looked up again
+        """
+        self._snapshot = None
+        self._frame_cache = {}
+        self._speed_limits = {}
+        self._speed_limit_period = speed_limit_period
+        self._waypoints = {}
+        self._waypoint_tolerance = waypoint_tolerance
+        self.frame = None
+        # Fallback queries of the current tick, by query name
+        self.remaining_calls = collections.Counter()
+        # Fallback queries of the previous tick
+        self.last_calls = collections.Counter()
+
+    def update(self, snapshot):
+        """
+        Starts a new frame from the snapshot of a tick.
+
+            :param snapshot: carla.WorldSnapshot
+        """
+        self._snapshot = snapshot
+        self._frame_cache = {}
+        # Waypoints of the actors gone from the world are dropped
+        if self._waypoints:
+            actor_ids = self.actor_ids()
+            self._waypoints = {key: value for key, value in self._waypoints.items() if key[0] in actor_ids}
+        self.frame = snapshot.frame
+        self.last_calls = self.remaining_calls
+        self.remaining_calls = collections.Counter()
+
+    def _actor_snapshot(self, actor):
+        if self._snapshot is None:
+            return None
+        return self._snapshot.find(actor.id)
+
+    def get_transform(self, actor):
+        if self._snapshot is None:
+            self.remaining_calls['get_transform'] += 1
+            return actor.get_transform()
+        key = (actor.id, 'transform')
+        if key not in self._frame_cache:
+            actor_snapshot = self._actor_snapshot(actor)
+            if actor_snapshot is not None:
+                self._frame_cache[key] = actor_snapshot.get_transform()
+            else:
+                self.remaining_calls['get_transform'] += 1
+                self._frame_cache[key] = actor.get_transform()
+        return self._frame_cache[key]
+
+    def get_location(self, actor):
+        return self.get_transform(actor).location
+
+    def get_poses(self, actors):
+        """
+        Poses of several actors as arrays.
+
+            :param actors: list of carla.Actor
+            :return: (locations, rotations), arrays (N, 3) of x, y, z and of pitch, yaw, roll in degrees
+        """
+        poses = np.zeros((len(actors), 6))
+        for i, actor in enumerate(actors):
+            transform = self.get_transform(actor)
+            location, rotation = transform.location, transform.rotation
+            poses[i] = (location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll)
+        return poses[:, :3], poses[:, 3:]
+
+    def actor_ids(self):
+        """
+        Ids of the actors of the current snapshot, or None without snapshot.
+        """
+        if self._snapshot is None:
+            return None
+        if 'actor_ids' not in self._frame_cache:
+            self._frame_cache['actor_ids'] = frozenset(actor_snapshot.id for actor_snapshot in self._snapshot)
+        return self._frame_cache['actor_ids']
+
+    def get_waypoint(self, actor, wmap, lane_type=None):
+        """
+        Map waypoint of the location of the actor, as carla.Map.get_waypoint.
+        It is kept while the actor stays within `waypoint_tolerance` of where
+        it was looked up, so standing actors are only projected once.
+
+            :param wmap: carla.Map of the actor
+            :param lane_type: carla.LaneType of the waypoint, by default the one of get_waypoint
+        """
+        location = self.get_location(actor)
+        key = (actor.id, lane_type)
+        cached = self._waypoints.get(key)
+        if cached is not None and cached[0].distance(location) < self._waypoint_tolerance:
+            return cached[1]
+        if lane_type is None:
+            waypoint = wmap.get_waypoint(location)
+        else:
+            waypoint = wmap.get_waypoint(location, lane_type=lane_type)
+        self._waypoints[key] = (location, waypoint)
+        return waypoint
+
+    def get_velocity(self, actor):
+        if self._snapshot is None:
+            self.remaining_calls['get_velocity'] += 1
+            return actor.get_velocity()
+        key = (actor.id, 'velocity')
+        if key not in self._frame_cache:
+            actor_snapshot = self._actor_snapshot(actor)
+            if actor_snapshot is not None:
+                self._frame_cache[key] = actor_snapshot.get_velocity()
+            else:
+                self.remaining_calls['get_velocity'] += 1
+                self._frame_cache[key] = actor.get_velocity()
+        return self._frame_cache[key]
+
+    def get_speed(self, actor):
+        """
+        Speed of the actor in Km/h, same as agents.tools.misc.get_speed.
+        """
+        vel = self.get_velocity(actor)
+        return 3.6 * math.sqrt(vel.x ** 2 + vel.y ** 2 + vel.z ** 2)
+
+    def get_speed_limit(self, vehicle):
+        """
+        Speed limit of the vehicle in Km/h, refreshed every `speed_limit_period` frames.
+        """
+        if self.frame is None:
+            self.remaining_calls['get_speed_limit'] += 1
+            return vehicle.get_speed_limit()
+        frame = self.frame
+        cached = self._speed_limits.get(vehicle.id)
+        if cached is None or frame - cached[0] >= self._speed_limit_period or frame < cached[0]:
+            self.remaining_calls['get_speed_limit'] += 1
+            cached = (frame, vehicle.get_speed_limit())
+            self._speed_limits[vehicle.id] = cached
+        return cached[1]
@@ -0,0 +1,78 @@
+""" Module with a bounded cache of the lane graph queries of carla.Waypoint. """
+
+import collections
+import threading
+
+
+class WaypointCache(object):
+    """
+    Memoizes the successors of waypoints at a distance (carla.Waypoint.next) and
+    their neighbouring lanes (get_left_lane / get_right_lane).
+
+    Entries are keyed by the OpenDRIVE position of the waypoint (road_id,
+    section_id, lane_id, s) and the query, so waypoints returned by different
+    calls share them. Beyond max_entries the least recently used entries are
+    dropped. Hits and misses are counted per query.
+    """
+
+    def __init__(self, max_entries=100000):
+        """
+        :param max_entries: maximum number of cached queries
+        """
+        self._entries = collections.OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def next(self, waypoint, distance):
+        """Returns the list of waypoints at the distance ahead of the waypoint"""
+        return list(self._query(waypoint, 'next', distance, lambda: tuple(waypoint.next(distance))))
+
+    def left_lane(self, waypoint):
+        """Returns the waypoint of the lane on the left of the waypoint, or None"""
+        return self._query(waypoint, 'left_lane', None, waypoint.get_left_lane)
+
+    def right_lane(self, waypoint):
+        """Returns the waypoint of the lane on the right of the waypoint, or None"""
+        return self._query(waypoint, 'right_lane', None, waypoint.get_right_lane)
+
+    def _query(self, waypoint, query, distance, compute):
+        key = (waypoint.road_id, waypoint.section_id, waypoint.lane_id, round(waypoint.s, 3), query, distance)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits[query] += 1
+                return self._entries[key]
+            self.misses[query] += 1
+        # The map is queried without the lock, a concurrent miss computes the same value
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        """Returns the number of hits, misses and cached entries, and the hit rate"""
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            size = len(self._entries)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'size': size,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_waypoint_cache(wmap):
+    """Returns the cache shared by all users of the map, one per map name"""
+    with _caches_lock:
+        if wmap.name not in _caches:
+            _caches[wmap.name] = WaypointCache()
+        return _caches[wmap.name]
@@ -0,0 +1,364 @@
+"""
+Runs batches of scenario trials over a pool of CARLA servers.
+
+Every scenario from `scenarios/aisa_conflicts.xml` (or the given subset) is
+run a number of times. The trials are scheduled over the CARLA endpoints with
+one worker process per endpoint; a trial ends when the vehicle reaches the
+destination, at the first takeover request, or when the simulation time
+limit is reached, and a worker stuck for longer than the wall-clock limit is
+replaced. The metrics of all trials are collected in one CSV table.
+
+    python -m batch_runner --scenarios all --repetitions 5 \
+        --endpoints localhost:2000,localhost:3000 --output results.csv
+
+The function running a trial can be replaced with `--trial_fn module:function`,
+e.g. `--trial_fn stub_trial:run_trial` runs the scheduling without a server.
+"""
+
+import argparse
+import collections
+import csv
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import time
+from typing import Callable, List, Tuple
+
+RESULT_COLUMNS = [
+    "trial",
+    "scenario",
+    "repetition",
+    "endpoint",
+    "outcome",
+    "frames",
+    "sim_time",
+    "wall_time",
+    "takeovers",
+    "distance_to_destination",
+    "mean_speed",
+    "actor_queries",
+    "waypoint_cache_hit_rate",
+    "slip",
+    "max_slip",
+    "missed_deadlines",
+    "error",
+]
+
+
+def parse_endpoint(endpoint: str) -> Tuple[str, int]:
+    """
+    Parses "host:port" into (host, port).
+    """
+    host, _, port = endpoint.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Expected an endpoint as host:port, got '{endpoint}'")
+    return host, int(port)
+
+
+# Offset of the Traffic Manager port from the CARLA port, as the defaults 2000 and 8000
+TRAFFIC_MANAGER_PORT_OFFSET = 6000
+
+
+def make_trials(scenarios: List[str], repetitions: int) -> List[dict]:
+    return [
+        {"trial": len(scenarios) * repetition + i, "scenario": scenario, "repetition": repetition}
+        for repetition in range(repetitions)
+        for i, scenario in enumerate(scenarios)
+    ]
+
+
+def load_function(path: str) -> Callable:
+    """
+    Loads a function given as "module:function".
+    """
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_trial(endpoint: str, trial: dict, options: dict) -> dict:
+    """
+    Runs one trial of the simulation against a CARLA server.
+    """
+    # Imported here, so that only the worker processes connect to CARLA.
+    import simulation
+    # Imported here, so that scheduling trials does not need the CARLA module.
+    from configurator import ConflictConfigurator
+
+    host, port = parse_endpoint(endpoint)
+    argv = [
+        "--conflict", trial["scenario"],
+        "--model", options["model"],
+        "--host", host,
+        "--port", str(port),
+        "--tm_port", str(port + TRAFFIC_MANAGER_PORT_OFFSET),
+        "--headless",
+        "--no_debug_draw",
+        "--stop_on_tor",
+        "--goal_distance", str(options["goal_distance"]),
+    ]
+    if options.get("max_seconds") is not None:
+        argv += ["--max_seconds", str(options["max_seconds"])]
+    simulation.configuration = ConflictConfigurator.parse_xml(trial["scenario"])
+    return simulation.main(simulation.parse_args(argv))
+
+
+def _worker(endpoint, trial_fn, options, connection):
+    while True:
+        trial = connection.recv()
+        if trial is None:
+            return
+        try:
+            metrics = trial_fn(endpoint, trial, options)
+        except Exception as e:  # pylint: disable=broad-except
+            metrics = {"outcome": "error", "error": repr(e)}
+        connection.send((trial["trial"], metrics))
+
+
+class _EndpointWorker(object):
+    """
+    Worker process of one endpoint and the trial it is running.
+
+    Trials and results go through a pipe of the worker alone, so a worker
+    terminated in the middle of a trial only breaks its own channel, which
+    is discarded with it.
+    """
+
+    def __init__(self, context, endpoint, trial_fn, options):
+        self.endpoint = endpoint
+        self.trial = None
+        self.trial_start = None
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker,
+            args=(endpoint, trial_fn, options, worker_connection),
+            name=f"trials-{endpoint}",
+            daemon=True,
+        )
+        self.process.start()
+        worker_connection.close()
+
+    def assign(self, trial):
+        self.trial = trial
+        self.trial_start = time.perf_counter()
+        self.connection.send(trial)
+
+    def stop(self, timeout=10):
+        """
+        Asks the worker to exit once its trial is done, and terminates it if
+        it is still running after the timeout.
+        """
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+def run_batch(
+    trials: List[dict],
+    endpoints: List[str],
+    trial_fn: Callable = run_trial,
+    options: dict = None,
+    trial_timeout: float = None,
+) -> List[dict]:
+    """
+    Runs the trials over the endpoints and returns one result row per trial.
+
+    :param trial_fn: picklable function (endpoint, trial, options) -> metrics
+    :param trial_timeout: wall-clock seconds after which a trial is aborted
+        and the worker process of its endpoint is restarted
+    """
+    options = options or {}
+    context = multiprocessing.get_context("spawn")
+    pending = collections.deque(trials)
+    rows = {}
+
+    def start_worker(endpoint):
+        return _EndpointWorker(context, endpoint, trial_fn, options)
+
+    def add_row(worker, metrics):
+        row = dict(worker.trial, endpoint=worker.endpoint)
+        row.update(metrics)
+        rows[row["trial"]] = row
+        print(
+            f"[{len(rows)}/{len(trials)}] {row['scenario']} #{row['repetition']}"
+            f" on {worker.endpoint}: {row['outcome']}"
+        )
+        worker.trial = None
+
+    workers = [start_worker(endpoint) for endpoint in endpoints]
+    try:
+        while len(rows) < len(trials):
+            for worker in workers:
+                if worker.trial is None and pending:
+                    worker.assign(pending.popleft())
+
+            busy = {worker.connection: worker for worker in workers if worker.trial is not None}
+            for connection in multiprocessing.connection.wait(list(busy), timeout=0.5):
+                worker = busy[connection]
+                try:
+                    trial_id, metrics = connection.recv()
+                except (EOFError, OSError):
+                    # The worker died, handled below
+                    continue
+                if trial_id == worker.trial["trial"]:
+                    add_row(worker, metrics)
+
+            for i, worker in enumerate(workers):
+                if worker.trial is None:
+                    continue
+                elapsed = time.perf_counter() - worker.trial_start
+                if not worker.process.is_alive():
+                    add_row(worker, {"outcome": "error", "error": "worker process died"})
+                elif trial_timeout is not None and elapsed > trial_timeout:
+                    add_row(worker, {"outcome": "wall_timeout", "wall_time": elapsed})
+                else:
+                    continue
+                worker.stop(timeout=0)
+                workers[i] = start_worker(worker.endpoint)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    return [rows[trial["trial"]] for trial in trials]
+
+
+def summarize(rows: List[dict]) -> List[str]:
+    """
+    One line per scenario with the outcome counts and mean times.
+    """
+    by_scenario = collections.OrderedDict()
+    for row in rows:
+        by_scenario.setdefault(row["scenario"], []).append(row)
+
+    lines = [
+        "{:<24}{:>7}{:>11}{:>10}{:>9}{:>8}{:>11}{:>11}".format(
+            "scenario", "trials", "completed", "takeover", "timeout", "error",
+            "sim_time", "wall_time",
+        )
+    ]
+    for scenario, scenario_rows in by_scenario.items():
+        outcomes = collections.Counter(row["outcome"] for row in scenario_rows)
+        mean = lambda key: sum(row.get(key) or 0.0 for row in scenario_rows) / len(scenario_rows)
+        lines.append(
+            "{:<24}{:>7}{:>11}{:>10}{:>9}{:>8}{:>11.1f}{:>11.1f}".format(
+                scenario,
+                len(scenario_rows),
+                outcomes["completed"],
+                outcomes["takeover"],
+                outcomes["timeout"] + outcomes["wall_timeout"],
+                outcomes["error"] + outcomes["quit"],
+                mean("sim_time"),
+                mean("wall_time"),
+            )
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs batches of scenarios over a pool of CARLA servers."
+    )
+
+    parser.add_argument(
+        "--scenarios",
+        default="all",
+        help="Comma-separated scenario names from scenarios/aisa_conflicts.xml, or 'all'.",
+    )
+
+    parser.add_argument(
+        "--repetitions",
+        type=int,
+        default=1,
+        help="Number of trials per scenario.",
+    )
+
+    parser.add_argument(
+        "--endpoints",
+        default="localhost:2000",
+        help="Comma-separated list of CARLA servers as host:port.",
+    )
+
+    parser.add_argument(
+        "--model",
+        choices=["lane_detection"],
+        default="lane_detection",
+        help="Model for controlling the vehicle.",
+    )
+
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        default=120.0,
+        help="Simulation time limit of a trial.",
+    )
+
+    parser.add_argument(
+        "--goal_distance",
+        type=float,
+        default=5.0,
+        help="Distance to the destination in meters at which a trial is completed.",
+    )
+
+    parser.add_argument(
+        "--trial_timeout",
+        type=float,
+        default=600.0,
+        help="Wall-clock limit of a trial in seconds, including loading the world.",
+    )
+
+    parser.add_argument(
+        "--trial_fn",
+        default="batch_runner:run_trial",
+        help="Function running a trial, as module:function.",
+    )
+
+    parser.add_argument(
+        "--output",
+        default="results.csv",
+        help="CSV file for the results table.",
+    )
+
+    args = parser.parse_args()
+
+    # Imported here, so that scheduling trials does not need the CARLA module.
+    from configurator import ConflictConfigurator
+
+    # Scenarios without start and dest waypoints can not be driven
+    if args.scenarios == "all":
+        scenarios = ConflictConfigurator.scenario_names(with_route=True)
+    else:
+        scenarios = args.scenarios.split(",")
+        unknown = set(scenarios) - set(ConflictConfigurator.scenario_names())
+        if unknown:
+            parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        without_route = set(scenarios) - set(ConflictConfigurator.scenario_names(with_route=True))
+        if without_route:
+            parser.error(f"Scenarios without start and dest waypoints: {', '.join(sorted(without_route))}")
+    endpoints = args.endpoints.split(",")
+    for endpoint in endpoints:
+        parse_endpoint(endpoint)
+
+    rows = run_batch(
+        make_trials(scenarios, args.repetitions),
+        endpoints,
+        trial_fn=load_function(args.trial_fn),
+        options={
+            "model": args.model,
+            "max_seconds": args.max_seconds,
+            "goal_distance": args.goal_distance,
+        },
+        trial_timeout=args.trial_timeout,
+    )
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    for line in summarize(rows):
+        print(line)
@@ -1,6 +1,7 @@
 import carla
 import pygame
 
+import math
 import queue
 import numpy as np
 
@@ -9,15 +10,38 @@ def carla_vec_to_np_array(vec):
                      vec.y,
                      vec.z])
 
+def set_sensor_period(blueprint, period, fps):
+    """
+    Sets the sensor_tick of a sensor blueprint, so that the server only renders
+    the sensor every `period` world ticks at the given fps.
+    """
+    if period > 1:
+        blueprint.set_attribute("sensor_tick", str(period / fps))
+
+
 class CarlaSyncMode(object):
     """
     Context manager to synchronize output from different sensors. Synchronous
     mode is enabled as long as we are inside this context
 
-        with CarlaSyncMode(world, sensors) as sync_mode:
+        with CarlaSyncMode(world, sensors, fps=30, periods=[1, 2]) as sync_mode:
             while True:
                 data = sync_mode.tick(timeout=1.0)
 
+    With `substep`, the physics runs in substeps of at most that many seconds
+    within each fixed delta.
+
+    `tick` returns the world snapshot followed by one entry per sensor. Camera
+    images are decoded into RGB numpy arrays on the callback thread, into a
+    ring of preallocated buffers; the arrays are read-only and are reused
+    after `ring_size` frames, copy them to keep them longer.
+
+    A sensor with a period n (see `set_sensor_period`) is only rendered by the
+    server every n-th frame. Its data is not waited for: `tick` returns the
+    newest data that arrived for the frame or an earlier one, and None when
+    nothing new arrived, so data that comes in after its tick is returned on
+    the next one. Sensors with period 1 are waited for and matched by frame;
+    their entry is None when the data misses the timeout.
     """
 
     def __init__(self, world, *sensors, **kwargs):
@@ -25,44 +49,178 @@ class CarlaSyncMode(object):
         self.sensors = sensors
         self.frame = None
         self.delta_seconds = 1.0 / kwargs.get('fps', 20)
+        self.periods = list(kwargs.get('periods') or [1] * len(sensors))
+        self.ring_size = kwargs.get('ring_size', 4)
+        self.substep = kwargs.get('substep')
         self._queues = []
+        self._rings = []
+        # Data of the periodic sensors received for a frame after the current one
+        self._early = [None] * len(sensors)
+        # Frames per sensor whose data did not arrive in time
+        self.missed = [0] * len(sensors)
         self._settings = None
 
     def __enter__(self):
         self._settings = self.world.get_settings()
-        self.frame = self.world.apply_settings(carla.WorldSettings(
+        settings = carla.WorldSettings(
             no_rendering_mode=False,
             synchronous_mode=True,
-            fixed_delta_seconds=self.delta_seconds))
+            fixed_delta_seconds=self.delta_seconds)
+        if self.substep:
+            # CARLA requires fixed_delta_seconds <= max_substep_delta_time * max_substeps.
+            settings.substepping = True
+            settings.max_substep_delta_time = self.substep
+            settings.max_substeps = max(1, math.ceil(self.delta_seconds / self.substep - 1e-9))
+        self.frame = self.world.apply_settings(settings)
 
-        def make_queue(register_event):
+        self._queues.append(queue.Queue())
+        self.world.on_tick(self._queues[0].put)
+        for sensor in self.sensors:
             q = queue.Queue()
-            register_event(q.put)
+            ring = _ImageRing(sensor, self.ring_size)
+            sensor.listen(lambda data, q=q, ring=ring: q.put((data.frame, ring.decode(data))))
             self._queues.append(q)
-
-        make_queue(self.world.on_tick)
-        for sensor in self.sensors:
-            make_queue(sensor.listen)
+            self._rings.append(ring)
         return self
 
     def tick(self, timeout):
         self.frame = self.world.tick()
-        data = [self._retrieve_data(q, timeout) for q in self._queues]
-        assert all(x.frame == self.frame for x in data)
+        data = [self._retrieve_snapshot(timeout)]
+        for i, sensor_queue in enumerate(self._queues[1:]):
+            data.append(self._retrieve_sensor_data(i, sensor_queue, timeout))
         return data
 
     def __exit__(self, *args, **kwargs):
+        for sensor in self.sensors:
+            sensor.stop()
         self.world.apply_settings(self._settings)
 
-    def _retrieve_data(self, sensor_queue, timeout):
+    def _retrieve_snapshot(self, timeout):
+        while True:
+            snapshot = self._queues[0].get(timeout=timeout)
+            if snapshot.frame >= self.frame:
+                return snapshot
+
+    def _retrieve_sensor_data(self, i, sensor_queue, timeout):
+        """
+        Data of sensor i for the current frame, or None if it is late. Periodic
+        sensors are only polled, see the class documentation.
+        """
+        if self.periods[i] > 1:
+            return self._poll_sensor_data(i, sensor_queue)
         while True:
-            data = sensor_queue.get(timeout=timeout)
-            if data.frame == self.frame:
-                return data
+            try:
+                frame, payload = sensor_queue.get(timeout=timeout)
+            except queue.Empty:
+                self.missed[i] += 1
+                print(f"Warning: no data of sensor {self.sensors[i].type_id} for frame {self.frame}")
+                return None
+            if frame == self.frame:
+                return payload
+            if frame > self.frame:
+                # Newer than the world tick, the sensor is out of sync; give up on this frame.
+                self.missed[i] += 1
+                return None
+
+    def _poll_sensor_data(self, i, sensor_queue):
+        """
+        Newest data of sensor i received for the current frame or an earlier
+        one, without waiting; None if there is none.
+        """
+        latest = None
+        if self._early[i] is not None and self._early[i][0] <= self.frame:
+            latest, self._early[i] = self._early[i], None
+        while self._early[i] is None:
+            try:
+                data = sensor_queue.get_nowait()
+            except queue.Empty:
+                break
+            if data[0] > self.frame:
+                self._early[i] = data
+            else:
+                latest = data
+        return None if latest is None else latest[1]
+
+
+class _ImageRing(object):
+    """
+    Ring of preallocated buffers camera images of a sensor are decoded into.
+    """
 
+    def __init__(self, sensor, size):
+        self._buffers = None
+        self._index = 0
+        self._size = size
+        attributes = sensor.attributes
+        if "image_size_x" in attributes and "image_size_y" in attributes:
+            self._allocate(int(attributes["image_size_y"]), int(attributes["image_size_x"]))
+
+    def _allocate(self, height, width):
+        self._buffers = np.empty((self._size, height, width, 3), dtype=np.uint8)
+
+    def decode(self, data):
+        """
+        Decodes a carla.Image into the next buffer; other sensor data is returned as is.
+        """
+        if not isinstance(data, carla.Image):
+            return data
+        if self._buffers is None or self._buffers.shape[1:3] != (data.height, data.width):
+            self._allocate(data.height, data.width)
+        bgra = np.frombuffer(data.raw_data, dtype=np.uint8).reshape(data.height, data.width, 4)
+        buffer = self._buffers[self._index]
+        self._index = (self._index + 1) % self._size
+        np.copyto(buffer, bgra[:, :, 2::-1])
+        image = buffer.view()
+        image.flags.writeable = False
+        return image
+
+
+# Actor types removed when a world is reset for a new run.
+RESETTABLE_ACTOR_TYPES = ("vehicle.", "walker.", "sensor.", "controller.")
+
+
+def reset_world(client, world):
+    """
+    Restores asynchronous mode and destroys the vehicles, walkers, sensors
+    and controllers left in the world, in a single batch.
+    """
+    settings = world.get_settings()
+    if settings.synchronous_mode or settings.fixed_delta_seconds is not None:
+        settings.synchronous_mode = False
+        settings.fixed_delta_seconds = None
+        world.apply_settings(settings)
+
+    actor_ids = [
+        actor.id
+        for actor in world.get_actors()
+        if actor.type_id.startswith(RESETTABLE_ACTOR_TYPES)
+    ]
+    if actor_ids:
+        client.apply_batch_sync(
+            [carla.command.DestroyActor(actor_id) for actor_id in actor_ids], False
+        )
+    return len(actor_ids)
+
+
+def load_or_reuse_world(client, town, force_reload=False):
+    """
+    Returns (world, map) for the given town. If the town is already loaded,
+    the world is reset instead of reloaded, which takes a fraction of the time.
+    """
+    world = client.get_world()
+    world_map = world.get_map()
+    if not force_reload and world_map.name.split("/")[-1] == town:
+        reset_world(client, world)
+        return world, world_map
+
+    world = client.load_world(town)
+    return world, world.get_map()
 
 
 def carla_img_to_array(image):
+    if isinstance(image, np.ndarray):
+        # Already decoded by CarlaSyncMode.
+        return image
     array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
     array = np.reshape(array, (image.height, image.width, 4))
     array = array[:, :, :3]
@@ -88,13 +246,21 @@ def draw_image_np(surface, image, blend=False):
     surface.blit(image_surface, (0, 0))
 
 
-def should_quit():
+def should_quit(key_handlers=None):
+    """
+    Processes the pending pygame events. Returns True on quit or Escape.
+
+    :param key_handlers: optional dict mapping pygame key codes to callables
+        invoked when the key is released.
+    """
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             return True
         elif event.type == pygame.KEYUP:
             if event.key == pygame.K_ESCAPE:
                 return True
+            if key_handlers and event.key in key_handlers:
+                key_handlers[event.key]()
     return False
 
 def find_weather_presets():
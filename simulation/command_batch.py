@@ -0,0 +1,123 @@
+"""
+Batching of actor commands into a single round trip to the CARLA server.
+
+Commands are queued during a tick and sent together with
+`client.apply_batch_sync` when the batch is flushed, which turns one RPC
+per actor into one RPC per tick.
+
+    batch = CommandBatch(client)
+    ticket = batch.spawn(blueprint, transform)
+    batch.set_transform(obstacle_id, transform)
+    result = batch.flush()
+    actor_id = result.actor_id(ticket)
+"""
+
+from typing import Iterable, List, Optional
+
+import carla
+
+
+class BatchResult(object):
+    """
+    Outcome of a flushed batch.
+    """
+
+    def __init__(self, responses, spawn_indices):
+        self.responses = responses
+        self._spawn_indices = spawn_indices
+        self.errors = [r.error for r in responses if r.has_error()]
+
+    def actor_id(self, ticket: int) -> Optional[int]:
+        """
+        Id of the actor spawned by the command with the given ticket,
+        or None if spawning failed.
+        """
+        response = self.responses[self._spawn_indices[ticket]]
+        return None if response.has_error() else response.actor_id
+
+    def actor_ids(self) -> List[Optional[int]]:
+        """
+        Ids of all actors spawned in the batch, in the order of the spawn calls.
+        """
+        return [self.actor_id(ticket) for ticket in range(len(self._spawn_indices))]
+
+
+class CommandBatch(object):
+    """
+    Queue of spawn, transform, control and destroy commands.
+    """
+
+    def __init__(self, client: carla.Client, traffic_manager_port: int = 8000):
+        self._client = client
+        self._traffic_manager_port = traffic_manager_port
+        self._commands = []
+        self._spawn_indices = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def spawn(
+        self,
+        blueprint: carla.ActorBlueprint,
+        transform: carla.Transform,
+        parent_id: Optional[int] = None,
+        autopilot: bool = False,
+    ) -> int:
+        """
+        Queues spawning an actor; returns a ticket to look up its id in the
+        result of `flush`. With `autopilot`, the vehicle is handed to the
+        Traffic Manager in the same command.
+        """
+        if parent_id is None:
+            command = carla.command.SpawnActor(blueprint, transform)
+        else:
+            command = carla.command.SpawnActor(blueprint, transform, parent_id)
+        if autopilot:
+            command = command.then(
+                carla.command.SetAutopilot(
+                    carla.command.FutureActor, True, self._traffic_manager_port
+                )
+            )
+        self._spawn_indices.append(len(self._commands))
+        self._commands.append(command)
+        return len(self._spawn_indices) - 1
+
+    def set_transform(self, actor_id: int, transform: carla.Transform):
+        self._commands.append(carla.command.ApplyTransform(actor_id, transform))
+
+    def apply_control(self, actor_id: int, control):
+        """
+        Queues a carla.VehicleControl or carla.WalkerControl.
+        """
+        if isinstance(control, carla.WalkerControl):
+            command = carla.command.ApplyWalkerControl(actor_id, control)
+        else:
+            command = carla.command.ApplyVehicleControl(actor_id, control)
+        self._commands.append(command)
+
+    def set_target_velocity(self, actor_id: int, velocity: carla.Vector3D):
+        self._commands.append(carla.command.ApplyTargetVelocity(actor_id, velocity))
+
+    def set_autopilot(self, actor_id: int, enabled: bool = True):
+        self._commands.append(
+            carla.command.SetAutopilot(actor_id, enabled, self._traffic_manager_port)
+        )
+
+    def destroy(self, actor_ids: Iterable[int]):
+        self._commands.extend(
+            carla.command.DestroyActor(actor_id) for actor_id in actor_ids
+        )
+
+    def flush(self, do_tick: bool = False) -> BatchResult:
+        """
+        Sends all queued commands in one call and clears the queue.
+        """
+        if not self._commands:
+            return BatchResult([], [])
+        commands, self._commands = self._commands, []
+        spawn_indices, self._spawn_indices = self._spawn_indices, []
+        responses = self._client.apply_batch_sync(commands, do_tick)
+        result = BatchResult(responses, spawn_indices)
+        for error in result.errors:
+            print(f"Warning: batch command failed: {error}")
+        return result
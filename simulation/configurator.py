@@ -2,17 +2,98 @@
 import warnings
 import xml.etree.ElementTree as ET
 from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 import carla
 
+# Blueprint filter and number of wheels for the object types of the XML
+OBJECT_TYPES = {
+    "vehicle_4W": ("vehicle.*", 4),
+    "vehicle_2W": ("vehicle.*", 2),
+    "pedestrian": ("walker.pedestrian.*", None),
+}
+
+
+@dataclass
+class ObjectSpec:
+    """An actor described by an <object> element of a scenario."""
+    name: str
+    type: str
+    model: str
+    start: carla.Transform
+    end: Optional[carla.Location] = None
+    autopilot: bool = False
+    color: Optional[str] = None
+    # Speed in m/s along the line from start to end, 0 for a static object
+    speed: float = 0.0
+
+    @property
+    def is_pedestrian(self) -> bool:
+        return self.type == "pedestrian"
+
+    @property
+    def number_of_wheels(self) -> Optional[int]:
+        return OBJECT_TYPES[self.type][1]
+
+    @staticmethod
+    def from_xml(element) -> "ObjectSpec":
+        attrib = element.attrib
+        object_type = attrib["type"]
+        if object_type not in OBJECT_TYPES:
+            raise ValueError(f"Unknown object type '{object_type}' of object '{attrib['name']}'")
+        start = carla.Transform(
+            carla.Location(float(attrib["start_x"]), float(attrib["start_y"]), float(attrib["start_z"])),
+            carla.Rotation(float(attrib.get("pitch", 0)), float(attrib.get("yaw", 0)), float(attrib.get("roll", 0))),
+        )
+        end = None
+        if "end_x" in attrib:
+            end = carla.Location(float(attrib["end_x"]), float(attrib["end_y"]), float(attrib.get("end_z", 0)))
+        return ObjectSpec(
+            name=attrib["name"],
+            type=object_type,
+            model=attrib.get("model", OBJECT_TYPES[object_type][0]),
+            start=start,
+            end=end,
+            autopilot=attrib.get("autopilot", "False").lower() == "true",
+            color=attrib.get("color"),
+            speed=float(attrib.get("speed", 0)),
+        )
+
+
+@dataclass
+class ActorPlan:
+    """The actors of a scenario besides the ego vehicle."""
+    objects: List[ObjectSpec] = field(default_factory=list)
+    npc_vehicles: int = 0
+    npc_pedestrians: int = 0
+
+
+# path to scenarios.xml
+CONFIG_FILE_NAME = "./scenarios/aisa_conflicts.xml"
+
 class ConflictConfigurator():
 
     @staticmethod
-    def parse_xml(conflictname):
+    def scenario_names(config_file_name=CONFIG_FILE_NAME, with_route=False):
+        """
+        Returns the names of all scenarios in the configuration file; with
+        `with_route`, only those with a start and a dest waypoint.
+        """
+        root = ET.parse(config_file_name).getroot()
+        return [
+            scenario.attrib["name"]
+            for scenario in root.iter("scenario")
+            if not with_route or all(
+                scenario.find('.//waypoints/waypoint[@name="{}"]'.format(name)) is not None
+                for name in ("start", "dest")
+            )
+        ]
+
+    @staticmethod
+    def parse_xml(conflictname, config_file_name=CONFIG_FILE_NAME):
 
         config = {}
-        # path to scenarios.xml
-        config_file_name = "./scenarios/aisa_conflicts.xml"
         tree = ET.parse(config_file_name)
         root = tree.getroot()
 
@@ -21,13 +102,29 @@ class ConflictConfigurator():
             
         # find scenario by name
         scenario = root.find('.//scenarios/scenario[@name="{}"]'.format(conflictname))
+        if scenario is None:
+            raise ValueError(f"Unknown scenario: {conflictname}")
 
         config["scenario"] = scenario.attrib["name"]
         config["town"] = scenario.attrib["town"]
         config["weather"] = int(scenario.attrib["WeatherId"])
-        npc_pedestrians = scenario.attrib["npc_pedestrians"]
-        npc_vehicles = scenario.attrib["npc_vehicles"]
         config["sensor_noise"] = float(scenario.attrib["sensor_noise"])
+        config["noise_seed"] = int(scenario.attrib["noise_seed"]) if "noise_seed" in scenario.attrib else None
+        config["noise_bank"] = int(scenario.attrib.get("noise_bank", 0))
+
+        # get camera image degradations, applied in the given order
+        config["degradations"] = []
+        for degradation in scenario.findall('.//degradations/degradation'):
+            spec = {key: float(value) for key, value in degradation.attrib.items() if key != "type"}
+            spec["type"] = degradation.attrib["type"]
+            config["degradations"].append(spec)
+
+        # get the objects and the numbers of NPCs to spawn
+        config["actor_plan"] = ActorPlan(
+            objects=[ObjectSpec.from_xml(o) for o in scenario.findall('object')],
+            npc_vehicles=int(scenario.attrib["npc_vehicles"]),
+            npc_pedestrians=int(scenario.attrib["npc_pedestrians"]),
+        )
 
         # get waypoints
         config["wp_start"] = scenario.find('.//waypoints/waypoint[@name="{}"]'.format("start"))
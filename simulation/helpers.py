@@ -6,6 +6,7 @@ import carla
 from agents.navigation.basic_agent import (
     BasicAgent,
 )
+from agents.tools.debug_draw import get_debug_drawer
 
 def parse_spawn_point(point_string: str) -> carla.Transform:
     """
@@ -17,17 +18,22 @@ def parse_spawn_point(point_string: str) -> carla.Transform:
 
 def draw_route(agent: BasicAgent, world: carla.World):
     """Draws waypoints of the predicted route by the global planner."""
-    waypoint_queue = agent.get_local_planner()._waypoints_queue
-    for wq in waypoint_queue:
-        loc = wq[0].transform.location
-        world.debug.draw_point(
-            loc, size=0.1, color=carla.Color(255, 255, 0), life_time=120
-        )
+    drawer = get_debug_drawer()
+    if not drawer.enabled:
+        return
+    plan = agent.get_local_planner().get_plan()
+    drawer.polyline(
+        [carla.Location(x, y, z) for x, y, z in plan.xyz().tolist()],
+        thickness=0.1, color=carla.Color(255, 255, 0), life_time=120
+    )
 
-def draw_trajectory(trajectory: list, world: carla.World, actor: carla.Actor):
-    actor_loc = actor.get_transform().location
-    for wp in trajectory:
-        loc = carla.Location(x=wp[1]+actor_loc.x, y=wp[0]+actor_loc.y, z = actor_loc.z)
-        world.debug.draw_point(
-            loc, size=0.1, color=carla.Color(255, 0, 255), life_time=1
-        )
+def draw_trajectory(trajectory: list, world: carla.World, actor_transform: carla.Transform):
+    """Draws the trajectory predicted by the controller, relative to the actor."""
+    drawer = get_debug_drawer()
+    if not drawer.enabled:
+        return
+    actor_loc = actor_transform.location
+    drawer.polyline(
+        [carla.Location(x=wp[1]+actor_loc.x, y=wp[0]+actor_loc.y, z = actor_loc.z) for wp in trajectory],
+        thickness=0.1, color=carla.Color(255, 0, 255), life_time=1
+    )
@@ -3,7 +3,7 @@ Base class ControllerModel.
 """
 
 from abc import ABC, abstractmethod
-from typing import Tuple, List
+from typing import Dict, Tuple, List
 import numpy as np
 import carla
 
@@ -21,6 +21,7 @@ class ControllerModel(ABC):
         self._display_info = []
         self._predicted_trajectory = []
         self._overlay_image = None
+        self._timings = {}
 
     @abstractmethod
     def control(
@@ -71,6 +72,21 @@ class ControllerModel(ABC):
         """
         return self._predicted_trajectory
 
+    # @abstractmethod
+    def timings(self) -> Dict[str, float]:
+        """
+        Return the duration in seconds of the stages of the last control step.
+        """
+        return self._timings
+
+    # @abstractmethod
+    def record_data(self) -> dict:
+        """
+        Return the model outputs of the last control step
+        to be stored in a recording.
+        """
+        return {"tor": self.initiate_tor()}
+
     # @abstractmethod
     def initiate_tor(self) -> bool:
         """
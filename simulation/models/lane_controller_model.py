@@ -1,4 +1,5 @@
 import copy
+import time
 from pathlib import Path
 from typing import Tuple
 import numpy as np
@@ -29,9 +30,19 @@ def get_trajectory_from_lane_detector(ld, img):
         traj,
         ld_detection_overlay(img, left_mask, right_mask),
         (left_mask, right_mask),
+        (poly_left, poly_right),
     )
 
 
+def poly_coefficients(poly, degree=3):
+    """
+    Coefficients of a np.poly1d padded to a fixed length,
+    since np.poly1d drops leading zero coefficients.
+    """
+    coeffs = poly.coeffs
+    return np.concatenate((np.zeros(degree + 1 - len(coeffs)), coeffs))
+
+
 def ld_detection_overlay(image, left_mask, right_mask):
     res = copy.copy(image)
     res[left_mask > 0.4, :] = [255, 0, 0]
@@ -60,6 +71,7 @@ class LaneControllerModel(ControllerModel):
         # in order to not require ToR in the beginning
         self._left_lane_confidence = 1.0
         self._right_lane_confidence = 1.0
+        self._lane_polynomials = (np.poly1d([0.0]), np.poly1d([0.0]))
 
         # Threshold for raising a warning for
         # low lane markings detection
@@ -77,8 +89,7 @@ class LaneControllerModel(ControllerModel):
 
         self._pid_controller = PurePursuitPlusPID()
 
-        # TODO: Get below values from the simulation
-        # Frames per second.
+        # Frames per second, updated from the sensor data of the simulation
         self._fps = 30
         # Desired vehicle speed
         self._desired_speed = 5
@@ -95,11 +106,15 @@ class LaneControllerModel(ControllerModel):
         """
         # We exect the first sensor data to be the camera image.
         image_windshield = sensor_data["camera_image"]
+        self._fps = sensor_data.get("fps", self._fps)
 
-        traj, viz, masks = get_trajectory_from_lane_detector(
+        start = time.perf_counter()
+        traj, viz, masks, polys = get_trajectory_from_lane_detector(
             self._lane_detector, image_windshield
         )
+        lane_detection_end = time.perf_counter()
         self._predicted_trajectory = traj
+        self._lane_polynomials = polys
         self._overlay_image = viz
         self._left_lane_confidence = masks[0].max()
         self._right_lane_confidence = masks[1].max()
@@ -109,6 +124,10 @@ class LaneControllerModel(ControllerModel):
         )
 
         self._fill_messages()
+        self._timings = {
+            "lane_detection": lane_detection_end - start,
+            "pure_pursuit": time.perf_counter() - lane_detection_end,
+        }
 
         return throttle, steer, 0, traj
 
@@ -135,6 +154,15 @@ class LaneControllerModel(ControllerModel):
             f" - Right lane: {self._right_lane_confidence:.2f}",
         ]
 
+    def record_data(self) -> dict:
+        return {
+            "left_poly": poly_coefficients(self._lane_polynomials[0]),
+            "right_poly": poly_coefficients(self._lane_polynomials[1]),
+            "left_confidence": self._left_lane_confidence,
+            "right_confidence": self._right_lane_confidence,
+            "tor": self.initiate_tor(),
+        }
+
     def initiate_tor(self) -> bool:
         return (
             self._right_lane_confidence < self._tor_threshold
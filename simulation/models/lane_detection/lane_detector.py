@@ -27,7 +27,7 @@ class LaneDetector():
         return self.detect(img_array)
 
     def _predict(self, img):
-        with torch.no_grad():
+        with torch.no_grad(), torch.profiler.record_function("LaneDetector._predict"):
             image_tensor = img.transpose(2,0,1).astype('float32')/255
             x_tensor = torch.from_numpy(image_tensor).to(self.device).unsqueeze(0)
             model_output = torch.softmax(self.model.forward(x_tensor), dim=1).cpu().numpy()
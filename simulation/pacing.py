@@ -0,0 +1,78 @@
+"""
+Wall-clock pacing of the simulation loop.
+
+In synchronous mode the simulation only advances when the client ticks it,
+so the wall-clock rate is whatever the client manages. The Pacer holds the
+loop to a schedule:
+
+* realtime - one simulated second per wall-clock second, e.g. for human
+  takeover studies
+* scaled - `time_scale` simulated seconds per wall-clock second
+* unlimited - as fast as possible, e.g. for batch runs
+
+Slip is the wall-clock time the loop is behind the schedule (negative when
+it runs ahead, as in unlimited mode). A frame that is ready only after its
+deadline counts as a missed deadline; the schedule is then moved, so that
+the loop does not rush to catch up.
+"""
+
+import time
+
+PACING_MODES = ("realtime", "scaled", "unlimited")
+
+
+class Pacer(object):
+    """
+    Sleeps between frames to keep the simulation on a wall-clock schedule.
+    """
+
+    def __init__(self, mode: str = "unlimited", time_scale: float = 1.0):
+        """
+        :param mode: one of PACING_MODES
+        :param time_scale: simulated seconds per wall-clock second in scaled mode
+        """
+        if mode not in PACING_MODES:
+            raise ValueError(f"Unknown pacing mode '{mode}', expected one of {PACING_MODES}")
+        if mode == "scaled" and time_scale <= 0:
+            raise ValueError("The time scale must be positive")
+        self.mode = mode
+        self.time_scale = time_scale if mode == "scaled" else 1.0
+        self._wall_start = None
+        self._sim_start = None
+        # Time the schedule was moved by after missed deadlines
+        self._delay = 0.0
+        self.frames = 0
+        self.missed_deadlines = 0
+        self.slip = 0.0
+        self.max_slip = 0.0
+
+    def wait(self, sim_time: float):
+        """
+        Waits until the wall-clock time of the frame with the given simulation time.
+        Called once per frame, after the frame was processed.
+        """
+        now = time.perf_counter()
+        if self._wall_start is None:
+            self._wall_start, self._sim_start = now, sim_time
+        self.frames += 1
+
+        wall_elapsed = now - self._wall_start
+        scheduled = (sim_time - self._sim_start) / self.time_scale
+        if self.mode == "unlimited":
+            self.slip = wall_elapsed - scheduled
+        else:
+            lag = wall_elapsed - scheduled - self._delay
+            if lag > 0:
+                self.missed_deadlines += 1
+                self._delay += lag
+            elif lag < 0:
+                time.sleep(-lag)
+            self.slip = self._delay
+        self.max_slip = max(self.max_slip, self.slip)
+
+    def stats(self) -> dict:
+        return {
+            "slip": self.slip,
+            "max_slip": self.max_slip,
+            "missed_deadlines": self.missed_deadlines,
+        }
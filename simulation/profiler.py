@@ -0,0 +1,230 @@
+"""
+On-demand sampling profiler for live simulation runs.
+
+A profiling window is requested with a hotkey or a POSIX signal and covers
+a fixed number of simulation frames. During the window the Python stack of
+the simulation thread is sampled from a background thread, and optionally
+the torch profiler records the lane detection model. The session keeps
+running while profiling and after the results are written.
+"""
+
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Optional
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return "{} ({}:{})".format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+    )
+
+
+class StackSampler(object):
+    """
+    Samples the stack of one thread at a fixed interval and aggregates
+    the samples into folded stacks (one "root;...;leaf count" line per stack),
+    which is the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.num_samples = 0
+
+    def start(self):
+        self._stacks.clear()
+        self.num_samples = 0
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def folded_stacks(self) -> collections.Counter:
+        return self._stacks
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self.num_samples += 1
+
+
+class ProfilingWindow(object):
+    """
+    Bounded profiling window driven by the simulation loop.
+
+    `request()` may be called from a key handler or a signal handler;
+    the window starts at the next call to `on_frame()` and stops after
+    `num_frames` frames, writing
+    - profile_<timestamp>.folded: flamegraph-compatible folded stacks
+    - profile_<timestamp>.txt: summary of frame times and hottest functions
+    - profile_<timestamp>.torch.json: chrome trace of the torch profiler (optional)
+    into `output_dir`.
+    """
+
+    def __init__(
+        self,
+        num_frames: int = 300,
+        output_dir: str = "profiles",
+        interval: float = 0.005,
+        use_torch: bool = False,
+    ):
+        self._num_frames = num_frames
+        self._output_dir = output_dir
+        self._use_torch = use_torch and torch is not None
+        self._sampler = StackSampler(threading.get_ident(), interval)
+        self._requested = False
+        self._active = False
+        self._torch_profiler = None
+        self._frame_times = []
+        self._last_frame_time = None
+        self._start_time = None
+
+    def request(self, *args):
+        """
+        Asks for a profiling window. Extra arguments are accepted so that
+        the method can be used directly as a signal handler.
+        """
+        if not self._active:
+            self._requested = True
+
+    def install_signal_handler(self, signum: Optional[int] = None) -> bool:
+        """
+        Starts a window on the given POSIX signal (SIGUSR1 by default).
+        Returns False on platforms without the signal.
+        """
+        if signum is None:
+            signum = getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            return False
+        signal.signal(signum, self.request)
+        return True
+
+    def is_active(self) -> bool:
+        return self._active
+
+    def on_frame(self):
+        """
+        Called once per simulation frame from the simulation thread.
+        """
+        now = time.perf_counter()
+        if self._active:
+            self._frame_times.append(now - self._last_frame_time)
+            self._last_frame_time = now
+            if len(self._frame_times) >= self._num_frames:
+                self._stop()
+        elif self._requested:
+            self._requested = False
+            self._start(now)
+
+    def close(self):
+        """
+        Stops a window still running, e.g. when the simulation ends early,
+        and writes the results of the frames profiled so far.
+        """
+        self._requested = False
+        if self._active:
+            print(f"Profiling stopped after {len(self._frame_times)} frames.")
+            self._stop()
+
+    def _start(self, now: float):
+        print(f"Profiling the next {self._num_frames} frames.")
+        self._active = True
+        self._frame_times = []
+        self._start_time = now
+        self._last_frame_time = now
+        if self._use_torch:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profiler = torch.profiler.profile(activities=activities)
+            self._torch_profiler.__enter__()
+        self._sampler.start()
+
+    def _stop(self):
+        self._sampler.stop()
+        if self._torch_profiler is not None:
+            self._torch_profiler.__exit__(None, None, None)
+        self._active = False
+        try:
+            prefix = self._write_results()
+            print(f"Profile written to {prefix}.*")
+        finally:
+            self._torch_profiler = None
+
+    def _write_results(self) -> str:
+        os.makedirs(self._output_dir, exist_ok=True)
+        prefix = os.path.join(
+            self._output_dir, "profile_" + time.strftime("%Y%m%d-%H%M%S")
+        )
+        stacks = self._sampler.folded_stacks()
+
+        with open(prefix + ".folded", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        self_counts = collections.Counter()
+        total_counts = collections.Counter()
+        for stack, count in stacks.items():
+            functions = stack.split(";")
+            self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+        num_samples = max(sum(stacks.values()), 1)
+
+        frame_times = sorted(self._frame_times)
+        with open(prefix + ".txt", "w") as f:
+            f.write(f"frames: {len(frame_times)}\n")
+            f.write(f"wall time: {time.perf_counter() - self._start_time:.3f} s\n")
+            if frame_times:
+                mean = sum(frame_times) / len(frame_times)
+                p95 = frame_times[int(0.95 * (len(frame_times) - 1))]
+                f.write(
+                    f"frame time: mean {1000 * mean:.2f} ms, "
+                    f"p95 {1000 * p95:.2f} ms, max {1000 * frame_times[-1]:.2f} ms\n"
+                )
+            f.write(f"stack samples: {self._sampler.num_samples}\n\n")
+            f.write("top functions by self time:\n")
+            for function, count in self_counts.most_common(20):
+                f.write(f"{100.0 * count / num_samples:6.2f}%  {function}\n")
+            f.write("\ntop functions by total time:\n")
+            for function, count in total_counts.most_common(20):
+                f.write(f"{100.0 * count / num_samples:6.2f}%  {function}\n")
+            if self._torch_profiler is not None:
+                f.write("\ntorch profiler:\n")
+                f.write(
+                    self._torch_profiler.key_averages().table(
+                        sort_by="self_cpu_time_total", row_limit=20
+                    )
+                )
+                f.write("\n")
+
+        if self._torch_profiler is not None:
+            self._torch_profiler.export_chrome_trace(prefix + ".torch.json")
+        return prefix
@@ -0,0 +1,261 @@
+"""
+Recording of sensor data, model outputs and controls to chunked,
+memory-mapped files.
+
+A recording is a directory with an `index.json` and one entry per chunk:
+- chunk_<n>/<field>.npy  memory-mappable arrays with one row per frame, or
+- chunk_<n>.npz          the same arrays compressed, if compression is enabled.
+
+The fields are named arrays; their dtype and per-frame shape are taken from
+the first recorded frame. Frames are written by a background thread, so the
+simulation loop never waits for the disk: when the writer falls behind,
+frames are dropped and counted in the index instead.
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+INDEX_FILE_NAME = "index.json"
+RECORDING_FORMAT_VERSION = 1
+
+
+def _chunk_name(chunk_id: int) -> str:
+    return "chunk_{:05d}".format(chunk_id)
+
+
+class Recorder(object):
+    """
+    Writes frames to a recording directory from a background thread.
+
+        with Recorder("recordings/run") as recorder:
+            recorder.record(frame=frame, image=img, speed=speed)
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        chunk_size: int = 256,
+        compress: bool = False,
+        queue_size: int = 64,
+        meta: Optional[dict] = None,
+    ):
+        """
+        :param output_dir: directory of the recording, created if missing
+        :param chunk_size: number of frames per chunk
+        :param compress: whether finished chunks are compressed
+        :param queue_size: number of frames buffered before frames are dropped
+        :param meta: extra information stored in the index
+        """
+        self._output_dir = output_dir
+        self._chunk_size = chunk_size
+        self._compress = compress
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._fields = None
+        self._chunks = []
+        self._chunk_arrays = None
+        self._chunk_count = 0
+        self._num_frames = 0
+        self._num_dropped = 0
+        self._meta = dict(meta or {})
+        self._meta["created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._error = None
+
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="recorder", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def record(self, **fields):
+        """
+        Queues one frame. Values are copied, so buffers may be reused by the
+        caller right away. Never blocks; returns False if the frame was dropped.
+        """
+        if self._error is not None:
+            return False
+        frame = {name: np.array(value) for name, value in fields.items()}
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self._num_dropped += 1
+            return False
+        return True
+
+    def close(self):
+        """
+        Writes the remaining frames and the final index.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            print(f"Recording stopped early: {self._error}")
+        print(
+            f"Recorded {self._num_frames} frames to {self._output_dir}"
+            f" ({self._num_dropped} dropped)."
+        )
+
+    def _run(self):
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    break
+                self._write_frame(frame)
+        except Exception as e:  # pylint: disable=broad-except
+            self._error = e
+            # Keep draining so that the producer never blocks on a full queue.
+            while self._queue.get() is not None:
+                self._num_dropped += 1
+        finally:
+            if self._chunk_arrays is not None:
+                self._finish_chunk()
+            self._write_index()
+
+    def _write_frame(self, frame: Dict[str, np.ndarray]):
+        if self._fields is None:
+            self._fields = {
+                name: {"dtype": value.dtype.str, "shape": list(value.shape)}
+                for name, value in frame.items()
+            }
+        if set(frame) != set(self._fields):
+            raise ValueError(
+                f"Recorded fields {sorted(frame)} differ from {sorted(self._fields)}"
+            )
+
+        if self._chunk_arrays is None:
+            self._start_chunk()
+
+        row = self._chunk_count
+        for name, value in frame.items():
+            self._chunk_arrays[name][row] = value
+        self._chunk_count += 1
+        self._num_frames += 1
+
+        if self._chunk_count == self._chunk_size:
+            self._finish_chunk()
+
+    def _start_chunk(self):
+        chunk_dir = os.path.join(self._output_dir, _chunk_name(len(self._chunks)))
+        os.makedirs(chunk_dir, exist_ok=True)
+        self._chunk_arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(chunk_dir, name + ".npy"),
+                mode="w+",
+                dtype=np.dtype(field["dtype"]),
+                shape=(self._chunk_size,) + tuple(field["shape"]),
+            )
+            for name, field in self._fields.items()
+        }
+        self._chunk_count = 0
+
+    def _finish_chunk(self):
+        name = _chunk_name(len(self._chunks))
+        count = self._chunk_count
+        arrays, self._chunk_arrays = self._chunk_arrays, None
+        for array in arrays.values():
+            array.flush()
+
+        if self._compress:
+            np.savez_compressed(
+                os.path.join(self._output_dir, name + ".npz"),
+                **{field: array[:count] for field, array in arrays.items()},
+            )
+            # The memory maps must be released before removing their files.
+            del arrays
+            shutil.rmtree(os.path.join(self._output_dir, name))
+
+        self._chunks.append(
+            {
+                "name": name,
+                "start": self._num_frames - count,
+                "count": count,
+                "compressed": self._compress,
+            }
+        )
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            "version": RECORDING_FORMAT_VERSION,
+            "chunk_size": self._chunk_size,
+            "num_frames": sum(chunk["count"] for chunk in self._chunks),
+            "num_dropped": self._num_dropped,
+            "fields": self._fields or {},
+            "chunks": self._chunks,
+            "meta": self._meta,
+        }
+        path = os.path.join(self._output_dir, INDEX_FILE_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+class RecordingReader(object):
+    """
+    Reads a recording written by `Recorder`. Uncompressed chunks are
+    memory-mapped, so only the frames that are accessed are read from disk.
+    """
+
+    def __init__(self, recording_dir: str):
+        self._recording_dir = recording_dir
+        with open(os.path.join(recording_dir, INDEX_FILE_NAME)) as f:
+            self.index = json.load(f)
+        if self.index["version"] != RECORDING_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported recording format version {self.index['version']}"
+            )
+        self.fields = self.index["fields"]
+        self.chunks = self.index["chunks"]
+        self.meta = self.index["meta"]
+
+    def __len__(self):
+        return self.index["num_frames"]
+
+    def read_chunk(self, chunk_id: int, fields=None) -> Dict[str, np.ndarray]:
+        """
+        Returns the arrays of one chunk, limited to the given fields.
+        """
+        chunk = self.chunks[chunk_id]
+        fields = fields or list(self.fields)
+        count = chunk["count"]
+        if chunk["compressed"]:
+            path = os.path.join(self._recording_dir, chunk["name"] + ".npz")
+            with np.load(path) as data:
+                return {name: data[name] for name in fields}
+        chunk_dir = os.path.join(self._recording_dir, chunk["name"])
+        return {
+            name: np.load(os.path.join(chunk_dir, name + ".npy"), mmap_mode="r")[
+                :count
+            ]
+            for name in fields
+        }
+
+    def iter_frames(self, start: int = 0, stop: Optional[int] = None, fields=None):
+        """
+        Yields (frame_index, {field: value}) for the frames in [start, stop).
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for chunk_id, chunk in enumerate(self.chunks):
+            chunk_start = chunk["start"]
+            chunk_stop = chunk_start + chunk["count"]
+            if chunk_stop <= start or chunk_start >= stop:
+                continue
+            arrays = self.read_chunk(chunk_id, fields)
+            for i in range(max(start, chunk_start), min(stop, chunk_stop)):
+                yield i, {name: array[i - chunk_start] for name, array in arrays.items()}
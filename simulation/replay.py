@@ -0,0 +1,242 @@
+"""
+Replays a recording through a ControllerModel without a CARLA server.
+
+The recorded windshield frames (or noise-injected model inputs) and speeds
+are streamed from disk into the controller, and the resulting controls,
+takeover decisions and per-stage timings are written to a CSV file.
+
+    python -m replay --recording recordings/sensornoise_20250101-120000 \
+        --model lane_detection --workers 4
+"""
+
+import sys
+import os
+import glob
+
+try:
+    sys.path.append(
+        glob.glob(
+            f"{os.environ['CARLA_HOME']}/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+            % (
+                sys.version_info.major,
+                sys.version_info.minor,
+                "win-amd64" if os.name == "nt" else "linux-x86_64",
+            )
+        )[0]
+    )
+except (IndexError, KeyError):
+    pass
+
+import argparse
+import csv
+import multiprocessing
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from models.controller_factory import ControllerModelFactory
+from recorder import RecordingReader
+
+# Fields of a recording used by the replay.
+INPUT_FIELDS = ("frame", "timestamp", "speed", "control")
+
+
+def shard_ranges(reader: RecordingReader, num_shards: int) -> List[Tuple[int, int]]:
+    """
+    Splits the frames of a recording into at most `num_shards` contiguous
+    ranges aligned to chunk boundaries, with similar numbers of frames.
+    """
+    target = len(reader) / max(num_shards, 1)
+    ranges = []
+    start = 0
+    for chunk in reader.chunks:
+        end = chunk["start"] + chunk["count"]
+        if end - start >= target and len(ranges) < num_shards - 1:
+            ranges.append((start, end))
+            start = end
+    if start < len(reader):
+        ranges.append((start, len(reader)))
+    return ranges
+
+
+def replay_range(
+    recording: str,
+    model: str,
+    input_field: str,
+    start: int,
+    stop: int,
+    realtime: bool = False,
+) -> List[dict]:
+    """
+    Runs the controller over the frames [start, stop) of a recording.
+    The controller is created here, so that every worker process owns one.
+    """
+    reader = RecordingReader(recording)
+    controller = ControllerModelFactory.create_model(model)
+
+    rows = []
+    wall_start = None
+    sim_start = None
+    read_start = time.perf_counter()
+    for index, data in reader.iter_frames(
+        start, stop, fields=INPUT_FIELDS + (input_field,)
+    ):
+        if realtime:
+            if wall_start is None:
+                wall_start, sim_start = time.perf_counter(), float(data["timestamp"])
+            delay = (float(data["timestamp"]) - sim_start) - (
+                time.perf_counter() - wall_start
+            )
+            if delay > 0:
+                time.sleep(delay)
+
+        # The model only reads its input, so the image stays a view of the recording.
+        sensor_data = {"camera_image": data[input_field]}
+        if "fps" in reader.meta:
+            sensor_data["fps"] = reader.meta["fps"]
+        control_start = time.perf_counter()
+        throttle, steer, brake, _ = controller.control(
+            sensor_data, float(data["speed"]), None
+        )
+        control_end = time.perf_counter()
+
+        row = {
+            "index": index,
+            "frame": int(data["frame"]),
+            "timestamp": float(data["timestamp"]),
+            "speed": float(data["speed"]),
+            "throttle": float(np.clip(throttle, 0.0, 1.0)),
+            "steer": float(np.clip(steer, -1.0, 1.0)),
+            "brake": float(np.clip(brake, 0.0, 1.0)),
+            "tor": bool(controller.initiate_tor()),
+            "recorded_throttle": float(data["control"][0]),
+            "recorded_steer": float(data["control"][1]),
+            "recorded_brake": float(data["control"][2]),
+            "t_read": control_start - read_start,
+            "t_control": control_end - control_start,
+        }
+        for stage, duration in controller.timings().items():
+            row["t_" + stage] = duration
+        rows.append(row)
+        read_start = time.perf_counter()
+    return rows
+
+
+def _replay_shard(task):
+    return replay_range(*task)
+
+
+def replay(
+    recording: str,
+    model: str,
+    input_field: str = "camera_input",
+    workers: int = 1,
+    realtime: bool = False,
+) -> List[dict]:
+    """
+    Replays a whole recording, sharded over `workers` processes.
+
+    Controllers are stateful (e.g. the PID integral), so each shard starts
+    from a fresh controller; results at the shard boundaries can differ
+    slightly from a single-process replay.
+    """
+    reader = RecordingReader(recording)
+    if input_field not in reader.fields:
+        raise ValueError(f"Recording has no field '{input_field}'")
+
+    tasks = [
+        (recording, model, input_field, start, stop, realtime)
+        for start, stop in shard_ranges(reader, workers)
+    ]
+    if len(tasks) <= 1:
+        return [row for task in tasks for row in _replay_shard(task)]
+
+    # "spawn" avoids sharing torch/CUDA state with forked workers.
+    with multiprocessing.get_context("spawn").Pool(len(tasks)) as pool:
+        shards = pool.map(_replay_shard, tasks)
+    return [row for shard in shards for row in shard]
+
+
+def summarize(rows: List[dict], wall_time: float) -> List[str]:
+    """
+    Text summary of a replay.
+    """
+    if not rows:
+        return ["No frames replayed."]
+    steer_diff = np.abs(
+        np.array([r["steer"] - r["recorded_steer"] for r in rows])
+    )
+    lines = [
+        f"frames: {len(rows)} in {wall_time:.2f} s ({len(rows) / wall_time:.1f} frames/s)",
+        f"takeover requests: {sum(r['tor'] for r in rows)}",
+        f"steer difference to recording: mean {steer_diff.mean():.4f}, max {steer_diff.max():.4f}",
+    ]
+    for key in rows[0]:
+        if key.startswith("t_"):
+            values = np.array([r.get(key, 0.0) for r in rows])
+            lines.append(
+                f"{key[2:]}: mean {1000 * values.mean():.2f} ms, max {1000 * values.max():.2f} ms"
+            )
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays a recording through a controller model without CARLA."
+    )
+
+    parser.add_argument(
+        "--recording",
+        required=True,
+        help="Directory of the recording.",
+    )
+
+    parser.add_argument(
+        "--model",
+        choices=["lane_detection"],
+        required=True,
+        help="Model for controlling the vehicle.",
+    )
+
+    parser.add_argument(
+        "--input",
+        default="camera_input",
+        choices=["camera_input", "windshield"],
+        help="Recorded image given to the model: the noise-injected input or the raw windshield frame.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes the recording is sharded over.",
+    )
+
+    parser.add_argument(
+        "--realtime",
+        help="Whether to pace the replay by the recorded timestamps instead of running as fast as possible.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--output",
+        default="replay.csv",
+        help="CSV file for the per-frame results.",
+    )
+
+    args = parser.parse_args()
+    if args.realtime and args.workers > 1:
+        parser.error("--realtime cannot be combined with multiple workers.")
+
+    start = time.perf_counter()
+    rows = replay(args.recording, args.model, args.input, args.workers, args.realtime)
+    wall_time = time.perf_counter() - start
+
+    if rows:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    for line in summarize(rows, wall_time):
+        print(line)
@@ -0,0 +1,184 @@
+"""
+Spawning of the actors described in a scenario's ActorPlan.
+
+All objects and NPCs are spawned with batched commands: vehicles with
+autopilot and NPC vehicles are handed to the Traffic Manager in the spawn
+command, and walkers with autopilot and NPC walkers get an AI controller.
+"""
+
+import random
+from typing import Dict, List, Optional
+
+import carla
+
+from command_batch import CommandBatch
+from configurator import ActorPlan
+
+# Minimum distance in meters between NPC vehicle spawn points and the ego vehicle
+NPC_SPAWN_CLEARANCE = 10.0
+
+
+def choose_blueprint(
+    blueprint_library: carla.BlueprintLibrary,
+    model: str,
+    number_of_wheels: Optional[int] = None,
+    rng: random.Random = random,
+) -> carla.ActorBlueprint:
+    """
+    Random blueprint matching the filter and, for vehicles, the number of wheels.
+    """
+    blueprints = blueprint_library.filter(model)
+    if number_of_wheels is not None:
+        blueprints = [
+            bp
+            for bp in blueprints
+            if bp.has_attribute("number_of_wheels")
+            and int(bp.get_attribute("number_of_wheels")) == number_of_wheels
+        ]
+    if not blueprints:
+        raise ValueError(f"No blueprint matches '{model}' with {number_of_wheels} wheels")
+    blueprint = rng.choice(list(blueprints))
+    if blueprint.has_attribute("is_invincible"):
+        blueprint.set_attribute("is_invincible", "false")
+    if blueprint.has_attribute("role_name"):
+        blueprint.set_attribute("role_name", "scenario")
+    return blueprint
+
+
+class ScenarioActors(object):
+    """
+    Spawns and destroys the actors of an ActorPlan.
+    """
+
+    def __init__(
+        self,
+        client: carla.Client,
+        world: carla.World,
+        batch: CommandBatch,
+        traffic_manager_port: int = 8000,
+        seed: Optional[int] = None,
+    ):
+        self._client = client
+        self._world = world
+        self._batch = batch
+        self._traffic_manager_port = traffic_manager_port
+        self._traffic_manager = None
+        self._rng = random.Random(seed)
+        # Ids of the spawned objects by name
+        self.ids = {}
+        self.vehicle_ids = []
+        self.walker_ids = []
+        self.controller_ids = []
+
+    @property
+    def actor_ids(self) -> List[int]:
+        return self.vehicle_ids + self.walker_ids + self.controller_ids
+
+    def spawn(self, plan: ActorPlan, world_map: carla.Map, ego_location: carla.Location) -> Dict[str, int]:
+        """
+        Spawns the objects and NPCs of the plan; returns the ids of the objects by name.
+        """
+        blueprint_library = self._world.get_blueprint_library()
+        uses_autopilot = plan.npc_vehicles > 0 or any(
+            o.autopilot and not o.is_pedestrian for o in plan.objects
+        )
+        if uses_autopilot:
+            self._traffic_manager = self._client.get_trafficmanager(self._traffic_manager_port)
+            self._traffic_manager.set_synchronous_mode(True)
+            self._traffic_manager.set_random_device_seed(self._rng.randrange(2 ** 31))
+
+        # Objects and NPC vehicles
+        vehicles = []
+        walkers = []
+        for spec in plan.objects:
+            blueprint = choose_blueprint(
+                blueprint_library, spec.model, spec.number_of_wheels, self._rng
+            )
+            if spec.color and blueprint.has_attribute("color"):
+                blueprint.set_attribute("color", spec.color)
+            if spec.is_pedestrian:
+                walkers.append((spec, blueprint, spec.start))
+            else:
+                vehicles.append((spec, blueprint, spec.start))
+
+        spawn_points = [
+            t
+            for t in world_map.get_spawn_points()
+            if t.location.distance(ego_location) > NPC_SPAWN_CLEARANCE
+        ]
+        self._rng.shuffle(spawn_points)
+        if plan.npc_vehicles > len(spawn_points):
+            print(f"Warning: only {len(spawn_points)} spawn points for {plan.npc_vehicles} NPC vehicles")
+        for transform in spawn_points[: plan.npc_vehicles]:
+            blueprint = choose_blueprint(blueprint_library, "vehicle.*", 4, self._rng)
+            vehicles.append((None, blueprint, transform))
+
+        for spec, blueprint, transform in vehicles:
+            autopilot = spec is None or spec.autopilot
+            self._batch.spawn(blueprint, transform, autopilot=autopilot)
+        for (spec, _, _), actor_id in zip(vehicles, self._batch.flush().actor_ids()):
+            if actor_id is None:
+                continue
+            self.vehicle_ids.append(actor_id)
+            if spec is not None:
+                self.ids[spec.name] = actor_id
+
+        # Objects and NPC walkers
+        for _ in range(plan.npc_pedestrians):
+            location = self._world.get_random_location_from_navigation()
+            if location is not None:
+                blueprint = choose_blueprint(blueprint_library, "walker.pedestrian.*", rng=self._rng)
+                walkers.append((None, blueprint, carla.Transform(location)))
+        for spec, blueprint, transform in walkers:
+            self._batch.spawn(blueprint, transform)
+        spawned_walkers = []
+        for (spec, _, _), actor_id in zip(walkers, self._batch.flush().actor_ids()):
+            if actor_id is None:
+                continue
+            self.walker_ids.append(actor_id)
+            if spec is not None:
+                self.ids[spec.name] = actor_id
+            if spec is None or spec.autopilot:
+                spawned_walkers.append((spec, actor_id))
+
+        self._start_walker_controllers(spawned_walkers, blueprint_library)
+        return self.ids
+
+    def _start_walker_controllers(self, walkers, blueprint_library):
+        """
+        Attaches an AI controller to each walker, walking to the object's end
+        location or, for NPCs, to random locations.
+        """
+        if not walkers:
+            return
+        controller_bp = blueprint_library.find("controller.ai.walker")
+        for _, walker_id in walkers:
+            self._batch.spawn(controller_bp, carla.Transform(), parent_id=walker_id)
+        controller_ids = self._batch.flush().actor_ids()
+        self.controller_ids.extend(i for i in controller_ids if i is not None)
+
+        # The controllers need one tick on the server before they can be started.
+        self._world.wait_for_tick()
+        controllers = {a.id: a for a in self._world.get_actors(self.controller_ids)}
+        for (spec, _), controller_id in zip(walkers, controller_ids):
+            if controller_id not in controllers:
+                continue
+            controller = controllers[controller_id]
+            controller.start()
+            if spec is not None and spec.end is not None:
+                controller.go_to_location(spec.end)
+            else:
+                controller.go_to_location(self._world.get_random_location_from_navigation())
+
+    def destroy(self):
+        """
+        Stops the walker controllers and queues destroying all actors in the batch.
+        """
+        if self.controller_ids:
+            for controller in self._world.get_actors(self.controller_ids):
+                controller.stop()
+        self._batch.destroy(self.controller_ids + self.walker_ids + self.vehicle_ids)
+        if self._traffic_manager is not None:
+            self._traffic_manager.set_synchronous_mode(False)
+        self.ids = {}
+        self.vehicle_ids, self.walker_ids, self.controller_ids = [], [], []
@@ -0,0 +1,202 @@
+"""
+Reproducible sensor noise and image degradations for the camera input.
+
+The degradations of a scenario are applied in the order given in the
+scenario XML, followed by Gaussian sensor noise, in one preallocated float32
+buffer. The result is clipped to 0-255 and returned as uint8, the same format
+as the undisturbed camera image. Without any configured effect the image is
+returned unchanged.
+
+The float32 buffer is not handed to the model directly: the same image is
+drawn in the detection overlay and recorded as the `camera_input` that
+replays feed to the model, both uint8, and the lane detector scales uint8
+frames itself. Keeping the quantized frame makes live runs and replays see
+the same input.
+"""
+
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+
+class Degradation(object):
+    """
+    Base class for image degradations working in place on a float32 image.
+    """
+
+    def __call__(self, image: np.ndarray, rng: np.random.Generator):
+        raise NotImplementedError
+
+
+class Blur(Degradation):
+    """
+    Gaussian blur, e.g. for a defocused or dirty lens.
+    """
+
+    def __init__(self, kernel_size: int = 5, sigma: float = 0.0):
+        # The kernel size of cv2.GaussianBlur must be odd.
+        self.kernel_size = int(kernel_size) | 1
+        self.sigma = float(sigma)
+
+    def __call__(self, image, rng):
+        cv2.GaussianBlur(
+            image, (self.kernel_size, self.kernel_size), self.sigma, dst=image
+        )
+
+
+class Dropout(Degradation):
+    """
+    Sets a random fraction of the pixels to black, e.g. for dead pixels
+    or transmission errors.
+    """
+
+    def __init__(self, probability: float = 0.01):
+        self.probability = float(probability)
+
+    def __call__(self, image, rng):
+        mask = rng.random(image.shape[:2], dtype=np.float32) < self.probability
+        image[mask] = 0.0
+
+
+class Occlusion(Degradation):
+    """
+    Square patches at random positions, e.g. for dirt or leaves on the lens.
+    """
+
+    def __init__(self, patches: int = 3, size: int = 50, value: float = 0.0):
+        self.patches = int(patches)
+        self.size = int(size)
+        self.value = float(value)
+
+    def __call__(self, image, rng):
+        height, width = image.shape[:2]
+        rows = rng.integers(0, max(height - self.size, 1), self.patches)
+        cols = rng.integers(0, max(width - self.size, 1), self.patches)
+        for row, col in zip(rows, cols):
+            image[row : row + self.size, col : col + self.size] = self.value
+
+
+class LaneFade(Degradation):
+    """
+    Fades bright pixels (lane markings) towards the mean intensity of the
+    road in the lower part of the image, e.g. for worn lane markings.
+    """
+
+    def __init__(self, strength: float = 0.5, threshold: float = 180.0, horizon: float = 0.5):
+        self.strength = float(strength)
+        self.threshold = float(threshold)
+        # Fraction of the image height above which nothing is faded.
+        self.horizon = float(horizon)
+
+    def __call__(self, image, rng):
+        road = image[int(self.horizon * image.shape[0]) :]
+        brightness = road.mean(axis=2)
+        markings = brightness > self.threshold
+        if not markings.any() or markings.all():
+            return
+        road_color = road[~markings].mean(axis=0)
+        road[markings] += self.strength * (road_color - road[markings])
+
+
+DEGRADATIONS = {
+    "blur": Blur,
+    "dropout": Dropout,
+    "occlusion": Occlusion,
+    "lane_fade": LaneFade,
+}
+
+
+def create_degradation(spec: dict) -> Degradation:
+    """
+    Creates a degradation from {"type": name, <parameter>: value, ...}.
+    """
+    params = dict(spec)
+    degradation_type = params.pop("type")
+    if degradation_type not in DEGRADATIONS:
+        raise ValueError(f"Unknown degradation type: {degradation_type}")
+    return DEGRADATIONS[degradation_type](**params)
+
+
+class SensorNoise(object):
+    """
+    Seeded noise model for camera images.
+    """
+
+    def __init__(
+        self,
+        sigma: float = 0.0,
+        degradations: Optional[List[Degradation]] = None,
+        seed: Optional[int] = None,
+        bank_size: int = 0,
+    ):
+        """
+        :param sigma: standard deviation of the Gaussian noise in intensity levels
+        :param degradations: degradations applied before the noise
+        :param seed: seed of the random generator, for reproducible runs
+        :param bank_size: if positive, the noise fields are precomputed once
+            and used cyclically instead of being drawn for every image
+        """
+        self.sigma = float(sigma)
+        self.degradations = list(degradations or [])
+        self.bank_size = int(bank_size)
+        self._rng = np.random.default_rng(seed)
+        self._bank = None
+        self._bank_index = 0
+        self._buffer = None
+        self._output = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SensorNoise":
+        """
+        Creates the noise model of a scenario configuration.
+        """
+        return cls(
+            sigma=config["sensor_noise"],
+            degradations=[create_degradation(d) for d in config.get("degradations", [])],
+            seed=config.get("noise_seed"),
+            bank_size=config.get("noise_bank", 0),
+        )
+
+    def is_identity(self) -> bool:
+        return self.sigma <= 0.0 and not self.degradations
+
+    def apply(self, image: np.ndarray) -> np.ndarray:
+        """
+        Returns the degraded image as uint8. The returned array is reused
+        by the next call, copy it to keep it.
+        """
+        if self.is_identity():
+            return image
+
+        if self._buffer is None or self._buffer.shape != image.shape:
+            self._buffer = np.empty(image.shape, dtype=np.float32)
+            self._output = np.empty(image.shape, dtype=np.uint8)
+            self._bank = None
+        buffer = self._buffer
+        np.copyto(buffer, image)
+
+        for degradation in self.degradations:
+            degradation(buffer, self._rng)
+
+        if self.sigma > 0.0:
+            buffer += self._noise_field(image.shape)
+
+        np.clip(buffer, 0.0, 255.0, out=buffer)
+        np.copyto(self._output, buffer, casting="unsafe")
+        return self._output
+
+    def _noise_field(self, shape) -> np.ndarray:
+        if self.bank_size <= 0:
+            noise = self._rng.standard_normal(shape, dtype=np.float32)
+            noise *= self.sigma
+            return noise
+
+        if self._bank is None:
+            self._bank = self._rng.standard_normal(
+                (self.bank_size,) + tuple(shape), dtype=np.float32
+            )
+            self._bank *= self.sigma
+        noise = self._bank[self._bank_index]
+        self._bank_index = (self._bank_index + 1) % self.bank_size
+        return noise
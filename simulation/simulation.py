@@ -5,6 +5,7 @@
 import sys
 import os
 import glob
+import time
 
 try:
     sys.path.append(
@@ -26,11 +27,14 @@ import random
 from pathlib import Path
 import numpy as np
 import argparse
+import math
 from carla_util import (
     carla_vec_to_np_array,
     carla_img_to_array,
     CarlaSyncMode,
+    set_sensor_period,
     find_weather_presets,
+    load_or_reuse_world,
     draw_image_np,
     should_quit,
 )
@@ -48,12 +52,27 @@ from helpers import (
     draw_trajectory,
 )
 from configurator import ConflictConfigurator
+from profiler import ProfilingWindow
+from pacing import Pacer, PACING_MODES
+from recorder import Recorder
+from command_batch import CommandBatch
+from scenario_actors import ScenarioActors
+from trajectories import ScriptedTrajectories
+from sensor_noise import SensorNoise
 from agents.navigation.basic_agent import BasicAgent
+from agents.navigation.planner_registry import get_planner_registry
+from agents.tools.state_cache import ActorStateCache
+from agents.tools.waypoint_cache import get_waypoint_cache
+from agents.tools.debug_draw import DebugDrawer, get_debug_drawer, set_debug_drawer
 
 main_image_shape = (800, 600)
+# Upper limit of max_substeps in the CARLA world settings
+MAX_SUBSTEPS = 16
 CAMERA_LOCATION_INSIDE_VEHICLE = carla.Location(x=0.2, y=-0.2, z=1.3)
 CAMERA_LOCATION_BEHIND_VEHICLE = carla.Location(x=-5.5, z=2.8)
 CAMERA_ROTATION = carla.Rotation(pitch=-10)
+# Distance in meters between the waypoints of the planned route
+ROUTE_SAMPLING_RESOLUTION = 2.0
 
 configuration = dict()
 
@@ -70,15 +89,6 @@ def create_wp(wp_raw):
     )
 
 
-def inject_noise(sensor_reading: np.array, sigma: float) -> np.array:
-    """
-    Adds noise to the given array.
-    """
-    noise = np.random.normal(0, sigma, sensor_reading.shape)
-    noisy_reading = sensor_reading + noise
-    return noisy_reading
-
-
 def play_sound_file(sound_file: str):
     pygame.mixer.init()
     # Load the audio file into Pygame
@@ -99,13 +109,20 @@ def audio_switch_to_automatic_control():
 
 
 def send_control(
-    vehicle, throttle, steer, brake, hand_brake=False, reverse=False
+    vehicle, throttle, steer, brake, hand_brake=False, reverse=False, batch=None
 ):
+    """
+    Applies the clipped control to the vehicle, or queues it in the batch if given.
+    """
     throttle = np.clip(throttle, 0.0, 1.0)
     steer = np.clip(steer, -1.0, 1.0)
     brake = np.clip(brake, 0.0, 1.0)
     control = carla.VehicleControl(throttle, steer, brake, hand_brake, reverse)
-    vehicle.apply_control(control)
+    if batch is not None:
+        batch.apply_control(vehicle.id, control)
+    else:
+        vehicle.apply_control(control)
+    return control
 
 
 def create_controller_model(model_name: str) -> ControllerModel:
@@ -113,10 +130,16 @@ def create_controller_model(model_name: str) -> ControllerModel:
     return factory.create_model(model_name)
 
 
-def main(args: dict):
+def main(args: dict) -> dict:
+    """
+    Runs the scenario given in the global configuration.
+    Returns the metrics of the run.
+    """
     manual_control = args.model == "manual"
 
     actor_list = []
+    if args.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
     pygame.init()
 
     display = pygame.display.set_mode(
@@ -125,11 +148,21 @@ def main(args: dict):
     font = pygame.font.SysFont("monospace", 15)
     clock = pygame.time.Clock()
 
-    client = carla.Client("localhost", 2000)
+    client = carla.Client(args.host, args.port)
     client.set_timeout(80.0)
 
-    client.load_world(configuration["town"])
-    world = client.get_world()
+    world, m = load_or_reuse_world(
+        client, configuration["town"], force_reload=args.reload_world
+    )
+
+    # The route planner is built in the background while the rest is set up
+    planner_registry = get_planner_registry()
+    planner_registry.register_map(world, m)
+    planner_options = {
+        "cache_dir": args.route_cache or None,
+        "from_opendrive": args.route_from_opendrive,
+    }
+    planner_registry.prefetch(m, ROUTE_SAMPLING_RESOLUTION, **planner_options)
 
     # set weather conditions
     weather_preset, _ = find_weather_presets()[configuration["weather"]]
@@ -137,13 +170,50 @@ def main(args: dict):
 
     if not manual_control:
         controller = create_controller_model(args.model)
+    sensor_noise = SensorNoise.from_config(configuration)
 
     manual_controller = KeyboardControl()
 
+    # Debug primitives are collected per frame and drawn together
+    debug_drawer = None if args.no_debug_draw else DebugDrawer(world)
+    set_debug_drawer(debug_drawer)
+
+    # Profiling window started with F9 or SIGUSR1
+    profiler = ProfilingWindow(
+        num_frames=args.profile_frames,
+        output_dir=args.profile_dir,
+        use_torch=args.profile_torch,
+    )
+    profiler.install_signal_handler()
+    key_handlers = {pygame.K_F9: profiler.request}
+
+    recorder = None
+    agent = None
+    if args.record and not manual_control:
+        recorder = Recorder(
+            os.path.join(
+                args.record,
+                configuration["scenario"] + time.strftime("_%Y%m%d-%H%M%S"),
+            ),
+            chunk_size=args.record_chunk_size,
+            compress=args.record_compress,
+            meta={
+                "scenario": configuration["scenario"],
+                "town": configuration["town"],
+                "model": args.model,
+                "sensor_noise": configuration["sensor_noise"],
+                "fps": args.fps,
+            },
+        )
+
+    # Actor commands are queued and sent once per tick
+    batch = CommandBatch(client, traffic_manager_port=args.tm_port)
+    scenario_actors = ScenarioActors(client, world, batch, traffic_manager_port=args.tm_port)
+
     try:
         sensor_data = {}
-        m = world.get_map()
         sensor_data["carla_map"] = m
+        sensor_data["fps"] = args.fps
 
         # Starting spawn point for the ego vehicle
         spawn_point = create_wp(configuration["wp_start"])
@@ -159,37 +229,35 @@ def main(args: dict):
         # Set a destination and draw the route to it
         destination = create_wp(configuration["wp_dest"])
 
-        # Spawning obstacles and actors for certain scenarios
-        if(configuration["scenario"]) == "obstaclestatic":
-            spawn_point_obstacle = carla.Transform(carla.Location(151.40000000, -38.40, 0.600000),carla.Rotation(0,0,0))
-            world.try_spawn_actor(veh_bp, spawn_point_obstacle)
-        elif(configuration["scenario"]) == "narrowingroad":
-            spawn_point_obstacle = carla.Transform(carla.Location(149.40000000, -38.40, 0.600000),carla.Rotation(0,90,0))
-            world.try_spawn_actor(veh_bp, spawn_point_obstacle)
-        elif(configuration["scenario"]) == "customramp":
-            for i in range(8):
-                spawn_point_obstacle = carla.Transform(carla.Location(2370.0 + i * 1000, -256.0, 0.600000),carla.Rotation(0,90,0))
-                world.try_spawn_actor(veh_bp, spawn_point_obstacle) 
-        elif(configuration["scenario"]) == "obstacledynamic":
-            spawn_point_obstacle = carla.Transform(carla.Location(155.40000000, -38.40, 0.600000),carla.Rotation(0,0,0))
-            obs_actor = world.spawn_actor(veh_bp, spawn_point_obstacle)
-            actor_list.append(obs_actor)    
-
-        agent = BasicAgent(vehicle, 30)
-        agent.follow_speed_limits(True)
-        agent.set_destination(destination.location)
-        if args.show_route:
-            draw_route(agent, world)
+        # Spawning the objects and NPCs of the scenario
+        scenario_ids = scenario_actors.spawn(
+            configuration["actor_plan"], m, spawn_point.location
+        )
+        trajectories = ScriptedTrajectories(
+            world, batch, configuration["actor_plan"].objects, scenario_ids
+        )
+
+        # Vehicle states of a frame, read from the snapshot of the tick
+        state_cache = ActorStateCache()
+
+        FPS = args.fps
+        # The windshield camera is consumed every second frame, the visual
+        # camera at display rate; the server does not render the frames between.
+        WINDSHIELD_PERIOD = 2
+        display_period = 10 if args.headless else 1
 
         # visualization cam (no functionality)
+        bp = blueprint_library.find("sensor.camera.rgb")
+        set_sensor_period(bp, display_period, FPS)
         camera_rgb = world.spawn_actor(
-            blueprint_library.find("sensor.camera.rgb"),
+            bp,
             carla.Transform(CAMERA_LOCATION_INSIDE_VEHICLE, CAMERA_ROTATION),
             attach_to=vehicle,
         )
         actor_list.append(camera_rgb)
 
         sensors = [camera_rgb]
+        periods = [display_period]
 
         if not manual_control:
             cg = CameraGeometry()
@@ -204,47 +272,89 @@ def main(args: dict):
             bp.set_attribute("image_size_x", str(cg.image_width))
             bp.set_attribute("image_size_y", str(cg.image_height))
             bp.set_attribute("fov", str(fov))
+            set_sensor_period(bp, WINDSHIELD_PERIOD, FPS)
             camera_windshield = world.spawn_actor(
                 bp, cam_windshield_transform, attach_to=vehicle
             )
             actor_list.append(camera_windshield)
             sensors.append(camera_windshield)
+            periods.append(WINDSHIELD_PERIOD)
 
         frame = 0
         max_error = 0
-        FPS = 30
+        viz = None
+        display_image = None
+        metrics = {
+            "outcome": "quit",
+            "frames": 0,
+            "sim_time": 0.0,
+            "wall_time": 0.0,
+            "takeovers": 0,
+            "distance_to_destination": None,
+            "mean_speed": 0.0,
+            # Actor queries not answered from the tick snapshot
+            "actor_queries": 0,
+            # Share of the waypoint successor and lane queries served from the cache
+            "waypoint_cache_hit_rate": 0.0,
+        }
+
+        # Created last, so the planner had the whole setup to be built
+        agent = BasicAgent(
+            vehicle,
+            30,
+            opt_dict={
+                "state_cache": state_cache,
+                "sampling_resolution": ROUTE_SAMPLING_RESOLUTION,
+            },
+            map_inst=m,
+            grp_inst=planner_registry.get_planner(
+                m, ROUTE_SAMPLING_RESOLUTION, **planner_options
+            ),
+        )
+        agent.follow_speed_limits(True)
+        # The drawn route needs all the waypoints, otherwise they are resolved when used
+        agent.set_destination(destination.location, stream=not args.show_route)
+        if args.show_route:
+            draw_route(agent, world)
+
+        waypoint_cache = get_waypoint_cache(m)
+        pacer = Pacer(args.pacing, args.time_scale)
+        metrics.update(pacer.stats())
+        start_wall_time = time.perf_counter()
+        start_sim_time = None
+        speed_sum = 0.0
         # Create a synchronous mode context.
-        with CarlaSyncMode(world, *sensors, fps=FPS) as sync_mode:
+        with CarlaSyncMode(
+            world, *sensors, fps=FPS, periods=periods, substep=args.substep
+        ) as sync_mode:
             while True:
-                if should_quit():
-                    return
+                if should_quit(key_handlers):
+                    return metrics
                 clock.tick()
+                profiler.on_frame()
 
                 # Advance the simulation and wait for the data.
                 tick_response = sync_mode.tick(timeout=2.0)
+                trajectories.update(tick_response[0])
+                state_cache.update(tick_response[0])
 
                 if manual_controller.switch_to_auto():
                     # controller = create_controller_model(model)
                     if args.audio and manual_control:
                         audio_switch_to_automatic_control()
+                    if manual_control:
+                        # Join the route again from wherever the driver left it
+                        agent.replan()
+                        if args.show_route:
+                            draw_route(agent, world)
                     manual_control = False
 
-                elif(configuration["scenario"]) == "obstacledynamic":
-                    location = obs_actor.get_location()
-                    location.x -= .01
-                    obs_actor.set_location(location)    
-
-                # get velocity and angular velocity
-                vel = carla_vec_to_np_array(vehicle.get_velocity())
-                forward = carla_vec_to_np_array(
-                    vehicle.get_transform().get_forward_vector()
-                )
-                right = carla_vec_to_np_array(
-                    vehicle.get_transform().get_right_vector()
-                )
-                up = carla_vec_to_np_array(
-                    vehicle.get_transform().get_up_vector()
-                )
+                # get velocity and angular velocity from the snapshot of the tick
+                vehicle_transform = state_cache.get_transform(vehicle)
+                vel = carla_vec_to_np_array(state_cache.get_velocity(vehicle))
+                forward = carla_vec_to_np_array(vehicle_transform.get_forward_vector())
+                right = carla_vec_to_np_array(vehicle_transform.get_right_vector())
+                up = carla_vec_to_np_array(vehicle_transform.get_up_vector())
                 # vx = vel.dot(forward)
                 # vy = vel.dot(right)
                 # vz = vel.dot(up)
@@ -256,25 +366,42 @@ def main(args: dict):
                 #     )
                 # )
 
-                speed = np.linalg.norm(
-                    carla_vec_to_np_array(vehicle.get_velocity())
-                )
+                speed = np.linalg.norm(vel)
 
                 if not manual_control:
                     snapshot, image_rgb, image_windshield = tick_response
-                    if frame % 2 == 0:
+                    if image_windshield is not None:
                         img = carla_img_to_array(image_windshield)
-                        sensor_data["camera_image"] = inject_noise(
-                            img, configuration["sensor_noise"]
-                        )
+                        sensor_data["camera_image"] = sensor_noise.apply(img)
                         throttle, steer, brake, traj = controller.control(
                             sensor_data, speed, vehicle
                         )
                         # print("traj:", traj[0], vehicle.get_transform())
-                        draw_trajectory(traj, world, vehicle)
+                        draw_trajectory(traj, world, vehicle_transform)
 
-                        send_control(vehicle, throttle, steer, brake)
+                        control = send_control(vehicle, throttle, steer, brake, batch=batch)
                         viz = controller.overlay_image()
+
+                        if recorder is not None:
+                            transform = vehicle_transform
+                            recorder.record(
+                                frame=snapshot.frame,
+                                timestamp=snapshot.timestamp.elapsed_seconds,
+                                windshield=img,
+                                camera_input=sensor_data["camera_image"],
+                                speed=speed,
+                                velocity=vel,
+                                transform=[
+                                    transform.location.x,
+                                    transform.location.y,
+                                    transform.location.z,
+                                    transform.rotation.pitch,
+                                    transform.rotation.yaw,
+                                    transform.rotation.roll,
+                                ],
+                                control=[control.throttle, control.steer, control.brake],
+                                **controller.record_data(),
+                            )
                 else:
                     snapshot, image_rgb, _ = tick_response
                     # print('tick_response:', snapshot, image_rgb)
@@ -282,11 +409,18 @@ def main(args: dict):
                     manual_controller.manual_control(
                         vehicle, pygame.key.get_pressed(), clock.get_time()
                     )
+                # The visual camera only delivers at display rate.
+                if image_rgb is not None:
+                    display_image = carla_img_to_array(image_rgb)
+                if display_image is None:
+                    display_image = np.zeros(
+                        (main_image_shape[1], main_image_shape[0], 3), dtype=np.uint8
+                    )
                 if viz is None:
-                    viz = carla_img_to_array(image_rgb)
+                    viz = display_image
 
                 # Draw the display.
-                image_rgb = copy.copy(carla_img_to_array(image_rgb))
+                image_rgb = copy.copy(display_image)
                 viz = cv2.resize(viz, (400, 200), interpolation=cv2.INTER_AREA)
                 image_rgb[0 : viz.shape[0], 0 : viz.shape[1], :] = viz
 
@@ -306,6 +440,8 @@ def main(args: dict):
                 # Check if takeover request suggested by the controller model.
                 if controller.initiate_tor():
                     takeover_messages.append("Switching to manual control.")
+                    if not manual_control:
+                        metrics["takeovers"] += 1
                     if args.audio and not manual_control:
                         audio_switch_to_manual_control()
                     manual_control = True
@@ -347,19 +483,66 @@ def main(args: dict):
                 # Stop the car if no lanes detected.
                 if not manual_control:
                     if controller.initiate_tor():
-                        send_control(vehicle, 0, 0, 0)
+                        send_control(vehicle, 0, 0, 0, batch=batch)
+
+                # Send the commands queued during this tick.
+                batch.flush()
+                get_debug_drawer().flush()
 
                 pygame.display.flip()
                 frame += 1
+
+                # Update the metrics and check the termination criteria.
+                sim_time = snapshot.timestamp.elapsed_seconds
+                if start_sim_time is None:
+                    start_sim_time = sim_time
+                pacer.wait(sim_time)
+                speed_sum += speed
+                vehicle_location = vehicle_transform.location
+                metrics.update(
+                    frames=frame,
+                    sim_time=sim_time - start_sim_time,
+                    wall_time=time.perf_counter() - start_wall_time,
+                    distance_to_destination=vehicle_location.distance(
+                        destination.location
+                    ),
+                    mean_speed=speed_sum / frame,
+                    actor_queries=metrics["actor_queries"]
+                    + sum(state_cache.remaining_calls.values()),
+                    waypoint_cache_hit_rate=waypoint_cache.stats()["hit_rate"],
+                    **pacer.stats(),
+                )
+                if (
+                    args.goal_distance is not None
+                    and metrics["distance_to_destination"] < args.goal_distance
+                ):
+                    metrics["outcome"] = "completed"
+                    return metrics
+                if args.stop_on_tor and metrics["takeovers"] > 0:
+                    metrics["outcome"] = "takeover"
+                    return metrics
+                if args.max_seconds is not None and metrics["sim_time"] >= args.max_seconds:
+                    metrics["outcome"] = "timeout"
+                    return metrics
     finally:
+        profiler.close()
+        if agent is not None:
+            agent.destroy()
+        if recorder is not None:
+            recorder.close()
         print("destroying actors.")
         for actor in actor_list:
-            actor.destroy()
+            if isinstance(actor, carla.Sensor):
+                actor.stop()
+        scenario_actors.destroy()
+        batch.destroy([actor.id for actor in actor_list])
+        batch.flush()
+        set_debug_drawer(None)
         pygame.quit()
         print("done.")
 
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Runs Carla simulation.")
 
     parser.add_argument(
@@ -389,7 +572,152 @@ if __name__ == "__main__":
         action="store_true",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no_debug_draw",
+        help="Whether to switch off all debug drawing in the simulator, e.g. for batch runs.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--profile_frames",
+        type=int,
+        default=300,
+        help="Number of frames profiled after pressing F9 or sending SIGUSR1.",
+    )
+
+    parser.add_argument(
+        "--profile_dir",
+        default="profiles",
+        help="Directory for the profiling results.",
+    )
+
+    parser.add_argument(
+        "--profile_torch",
+        help="Whether to also run the torch profiler during a profiling window.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Records sensor data, model outputs and controls to a new recording in DIR.",
+    )
+
+    parser.add_argument(
+        "--record_chunk_size",
+        type=int,
+        default=256,
+        help="Number of frames per recording chunk.",
+    )
+
+    parser.add_argument(
+        "--record_compress",
+        help="Whether to compress the recording chunks.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--host",
+        default="localhost",
+        help="Host of the CARLA server.",
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=2000,
+        help="Port of the CARLA server.",
+    )
+
+    parser.add_argument(
+        "--tm_port",
+        type=int,
+        default=8000,
+        help="Port of the Traffic Manager of the autopilot actors.",
+    )
+
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        help="Ends the run after this many seconds of simulation time.",
+    )
+
+    parser.add_argument(
+        "--goal_distance",
+        type=float,
+        help="Ends the run when the vehicle is closer than this many meters to the destination.",
+    )
+
+    parser.add_argument(
+        "--stop_on_tor",
+        help="Whether to end the run at the first takeover request.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--reload_world",
+        help="Whether to reload the town even if it is already loaded on the server.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--headless",
+        help="Whether to run without opening a window.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--route_cache",
+        default="route_cache",
+        help="Directory in which the route graphs of the maps are cached, '' disables the cache.",
+    )
+
+    parser.add_argument(
+        "--route_from_opendrive",
+        action="store_true",
+        help="Build a route graph that is not cached from the OpenDRIVE content of the map.",
+    )
+
+    parser.add_argument(
+        "--fps",
+        type=float,
+        default=30.0,
+        help="Simulation steps per simulated second, the fixed delta is 1 / fps.",
+    )
+
+    parser.add_argument(
+        "--pacing",
+        choices=PACING_MODES,
+        default="unlimited",
+        help="Wall-clock pacing: realtime, scaled (by --time_scale) or unlimited (as fast as possible).",
+    )
+
+    parser.add_argument(
+        "--time_scale",
+        type=float,
+        default=1.0,
+        help="Simulated seconds per wall-clock second with --pacing scaled.",
+    )
+
+    parser.add_argument(
+        "--substep",
+        type=float,
+        default=None,
+        help="Maximum physics substep in seconds, e.g. 0.01; by default the server settings are used.",
+    )
+
+    args = parser.parse_args(argv)
+    if args.fps <= 0:
+        parser.error("--fps must be positive.")
+    if args.substep is not None and args.substep <= 0:
+        parser.error("--substep must be positive.")
+    if args.substep is not None and math.ceil(1.0 / args.fps / args.substep - 1e-9) > MAX_SUBSTEPS:
+        parser.error(f"A fixed delta of 1 / {args.fps} s needs more than {MAX_SUBSTEPS} substeps of {args.substep} s.")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
 
     configuration = ConflictConfigurator.parse_xml(args.conflict)
 
@@ -0,0 +1,31 @@
+"""
+Stand-in for batch_runner.run_trial that needs no CARLA server, to try the
+scheduling of batch runs:
+
+    python -m batch_runner --scenarios all --repetitions 2 \
+        --endpoints localhost:2000,localhost:3000 --trial_fn stub_trial:run_trial
+
+A trial takes `stub_seconds` of wall-clock time (0.1 by default), or the
+time given for its scenario in `stub_scenario_seconds`, and completes. The
+scenarios in `stub_errors` raise instead.
+"""
+
+import time
+
+from batch_runner import parse_endpoint
+
+
+def run_trial(endpoint: str, trial: dict, options: dict) -> dict:
+    parse_endpoint(endpoint)
+    scenario = trial["scenario"]
+    if scenario in options.get("stub_errors", ()):
+        raise RuntimeError(f"Stub error in scenario {scenario}")
+    seconds = options.get("stub_scenario_seconds", {}).get(scenario, options.get("stub_seconds", 0.1))
+    start = time.perf_counter()
+    time.sleep(seconds)
+    return {
+        "outcome": "completed",
+        "frames": int(seconds * 30),
+        "sim_time": seconds,
+        "wall_time": time.perf_counter() - start,
+    }
@@ -0,0 +1,168 @@
+"""
+Offline stand-in of the parts of the carla module used by the tests: the
+geometry types and a map of one straight road along the x axis with two
+driving lanes, enough to build planners without a CARLA server.
+"""
+
+import math
+
+
+class Vector3D(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x, self.y, self.z = float(x), float(y), float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return type(self)(self.x * k, self.y * k, self.z * k)
+
+    __rmul__ = __mul__
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+    def distance(self, other):
+        return (self - other).length()
+
+
+class Location(Vector3D):
+    pass
+
+
+class Rotation(object):
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch, self.yaw, self.roll = float(pitch), float(yaw), float(roll)
+
+    def get_forward_vector(self):
+        yaw = math.radians(self.yaw)
+        return Vector3D(math.cos(yaw), math.sin(yaw), 0.0)
+
+    def get_right_vector(self):
+        yaw = math.radians(self.yaw)
+        return Vector3D(-math.sin(yaw), math.cos(yaw), 0.0)
+
+    def get_up_vector(self):
+        return Vector3D(0.0, 0.0, 1.0)
+
+
+class Transform(object):
+    def __init__(self, location=None, rotation=None):
+        location = location or Location()
+        self.location = Location(location.x, location.y, location.z)
+        self.rotation = rotation or Rotation()
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+    def get_right_vector(self):
+        return self.rotation.get_right_vector()
+
+    def get_up_vector(self):
+        return self.rotation.get_up_vector()
+
+
+class Color(object):
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+
+class VehicleControl(object):
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False, manual_gear_shift=False):
+        self.throttle, self.steer, self.brake = throttle, steer, brake
+        self.hand_brake, self.reverse, self.manual_gear_shift = hand_brake, reverse, manual_gear_shift
+
+
+class WorldSettings(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Image(object):
+    def __init__(self, frame, height, width, raw_data):
+        self.frame, self.height, self.width, self.raw_data = frame, height, width, raw_data
+
+
+class LaneType(object):
+    Driving = 2
+    Any = -2
+
+
+class LaneChange(object):
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
+class LaneMarking(object):
+    def __init__(self, lane_change):
+        self.lane_change = lane_change
+
+
+class Actor(object):
+    pass
+
+
+class World(object):
+    pass
+
+
+class WorldSnapshot(object):
+    pass
+
+
+LANE_WIDTH = 3.5
+
+
+class Waypoint(object):
+    """Waypoint on lane -1 (y = 1.75) or -2 (y = 5.25) of the road of a StraightMap"""
+
+    def __init__(self, wmap, lane_id, s):
+        self._map = wmap
+        self.road_id, self.section_id, self.lane_id, self.s = 1, 0, lane_id, float(s)
+        self.id = hash((lane_id, round(self.s, 3)))
+        self.is_junction = False
+        self.lane_type = LaneType.Driving
+        self.lane_width = LANE_WIDTH
+        self.lane_change = LaneChange.Right if lane_id == -1 else LaneChange.Left
+        self.left_lane_marking = LaneMarking(LaneChange.NONE if lane_id == -1 else LaneChange.Both)
+        self.right_lane_marking = LaneMarking(LaneChange.NONE if lane_id == -2 else LaneChange.Both)
+
+    @property
+    def transform(self):
+        return Transform(Location(self.s, (abs(self.lane_id) - 0.5) * LANE_WIDTH, 0.0), Rotation())
+
+    def next(self, distance):
+        if self.s + distance > self._map.length:
+            return []
+        return [Waypoint(self._map, self.lane_id, self.s + distance)]
+
+    def get_left_lane(self):
+        return Waypoint(self._map, -1, self.s) if self.lane_id == -2 else None
+
+    def get_right_lane(self):
+        return Waypoint(self._map, -2, self.s) if self.lane_id == -1 else None
+
+
+class Map(object):
+    """Map of one straight road of the given length"""
+
+    def __init__(self, name='Carla/Maps/StubTown', length=500.0):
+        self.name = name
+        self.length = float(length)
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=LaneType.Driving):
+        lane_id = -1 if location.y < LANE_WIDTH else -2
+        return Waypoint(self, lane_id, min(max(location.x, 0.0), self.length))
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        if road_id != 1 or lane_id not in (-1, -2) or not 0.0 <= s <= self.length:
+            return None
+        return Waypoint(self, lane_id, s)
+
+    def get_topology(self):
+        return [(Waypoint(self, lane_id, 0.0), Waypoint(self, lane_id, self.length)) for lane_id in (-1, -2)]
@@ -0,0 +1,15 @@
+"""
+The tests run without a CARLA server: the carla module is replaced by the
+stub of carla_stub, and the simulation directory is made importable.
+"""
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
+
+import carla_stub  # noqa: E402
+
+sys.modules["carla"] = carla_stub
@@ -0,0 +1,27 @@
+import time
+
+from batch_runner import make_trials, run_batch
+from stub_trial import run_trial
+
+ENDPOINTS = ["localhost:2000", "localhost:3000"]
+
+
+def test_trials_are_spread_over_the_endpoints():
+    trials = make_trials(["a", "b", "c"], 2)
+    rows = run_batch(trials, ENDPOINTS, trial_fn=run_trial, options={"stub_seconds": 0.2})
+    assert [row["trial"] for row in rows] == [trial["trial"] for trial in trials]
+    assert all(row["outcome"] == "completed" for row in rows)
+    assert {row["endpoint"] for row in rows} == set(ENDPOINTS)
+
+
+def test_stuck_trial_is_aborted_and_its_worker_restarted():
+    trials = make_trials(["slow", "broken"] + ["quick"] * 8, 1)
+    options = {"stub_seconds": 0.4, "stub_scenario_seconds": {"slow": 60.0}, "stub_errors": ["broken"]}
+    start = time.perf_counter()
+    rows = run_batch(trials, ENDPOINTS, trial_fn=run_trial, options=options, trial_timeout=1.0)
+    assert time.perf_counter() - start < 30.0
+    assert rows[0]["outcome"] == "wall_timeout"
+    assert rows[1]["outcome"] == "error" and "Stub error" in rows[1]["error"]
+    assert all(row["outcome"] == "completed" for row in rows[2:])
+    # The endpoint of the aborted trial runs trials again
+    assert rows[0]["endpoint"] in {row["endpoint"] for row in rows[2:]}
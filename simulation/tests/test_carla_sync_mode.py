@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+import pytest
+
+import carla
+
+pytest.importorskip("pygame")
+from carla_util import CarlaSyncMode  # noqa: E402
+
+
+class Snapshot(object):
+    def __init__(self, frame):
+        self.frame = frame
+
+
+class Sensor(object):
+    type_id = "sensor.camera.rgb"
+    attributes = {"image_size_x": "3", "image_size_y": "2"}
+
+    def __init__(self, period, delay=0):
+        """Renders every period-th frame, its data arrives delay ticks late"""
+        self.period = period
+        self.delay = delay
+        self.callback = None
+
+    def listen(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        pass
+
+    def image(self, frame):
+        raw_data = np.full(2 * 3 * 4, frame, dtype=np.uint8).tobytes()
+        return carla.Image(frame, 2, 3, raw_data)
+
+
+class World(object):
+    def __init__(self, sensors):
+        self.frame = 0
+        self.sensors = sensors
+        self.on_tick_callbacks = []
+
+    def get_settings(self):
+        return carla.WorldSettings()
+
+    def apply_settings(self, settings):
+        return self.frame
+
+    def on_tick(self, callback):
+        self.on_tick_callbacks.append(callback)
+
+    def tick(self):
+        self.frame += 1
+        for callback in self.on_tick_callbacks:
+            callback(Snapshot(self.frame))
+        for sensor in self.sensors:
+            frame = self.frame - sensor.delay
+            if frame > 0 and frame % sensor.period == 0:
+                sensor.callback(sensor.image(frame))
+        return self.frame
+
+
+def frames_of(data):
+    return [None if image is None else int(image[0, 0, 0]) for image in data]
+
+
+def test_periodic_sensors_are_polled_without_waiting():
+    sensors = [Sensor(1), Sensor(2), Sensor(3, delay=1)]
+    world = World(sensors)
+    returned = []
+    with CarlaSyncMode(world, *sensors, fps=30, periods=[1, 2, 3]) as sync_mode:
+        for _ in range(7):
+            start = time.perf_counter()
+            data = sync_mode.tick(timeout=1.0)
+            assert time.perf_counter() - start < 0.5
+            assert data[0].frame == sync_mode.frame
+            returned.append(frames_of(data[1:]))
+    assert [r[0] for r in returned] == [1, 2, 3, 4, 5, 6, 7]
+    assert [r[1] for r in returned] == [None, 2, None, 4, None, 6, None]
+    # Data arriving after its tick is returned on the next one
+    assert [r[2] for r in returned] == [None, None, None, 3, None, None, 6]
+    assert sync_mode.missed == [0, 0, 0]
@@ -0,0 +1,33 @@
+import carla
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+
+
+def test_resolved_waypoints_are_bounded():
+    planner = GlobalRoutePlanner(carla.Map(), 2.0, waypoint_cache_size=8)
+    route = planner.trace_route(carla.Location(10.0, 1.75, 0.0), carla.Location(200.0, 1.75, 0.0))
+    assert len(route) > 8
+    assert len(planner._waypoints) == 8
+    xs = [waypoint.transform.location.x for waypoint, _ in route]
+    assert xs == sorted(xs)
+    assert route[-1][0].transform.location.x > 190.0
+
+    # The route is resolved again the same, past the evicted waypoints
+    again = planner.trace_route(carla.Location(10.0, 1.75, 0.0), carla.Location(200.0, 1.75, 0.0))
+    assert [waypoint.s for waypoint, _ in again] == [waypoint.s for waypoint, _ in route]
+
+
+def test_destination_trees_are_kept_per_destination():
+    planner = GlobalRoutePlanner(carla.Map(), 2.0, destination_tree_cache_size=2)
+    origin = carla.Location(10.0, 1.75, 0.0)
+    destinations = [carla.Location(200.0, 1.75, 0.0), carla.Location(300.0, 5.25, 0.0)]
+    routes = [planner.replan_route(origin, destination) for destination in destinations]
+    trees = dict(planner._destination_trees)
+    assert len(trees) == 2
+
+    # Alternating destinations reuses their trees and gives the same routes
+    for destination, route in zip(destinations, routes):
+        again = planner.replan_route(origin, destination)
+        assert [(waypoint.lane_id, waypoint.s, option) for waypoint, option in again] == \
+            [(waypoint.lane_id, waypoint.s, option) for waypoint, option in route]
+    assert all(planner._destination_trees[node] is tree for node, tree in trees.items())
@@ -0,0 +1,70 @@
+import carla
+
+from agents.navigation.local_planner import LocalPlanner, RoadOption
+
+
+class StubVehicle(object):
+    """Vehicle standing still at a location of the stub map"""
+
+    id = 1
+
+    def __init__(self, wmap, location):
+        self._map = wmap
+        self._transform = carla.Transform(location)
+
+    def get_world(self):
+        return self
+
+    def get_map(self):
+        return self._map
+
+    def get_transform(self):
+        return self._transform
+
+    def get_location(self):
+        return self._transform.location
+
+    def get_velocity(self):
+        return carla.Vector3D()
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_speed_limit(self):
+        return 30.0
+
+
+def make_planner(**opt_dict):
+    wmap = carla.Map()
+    vehicle = StubVehicle(wmap, carla.Location(10.0, 1.75, 0.0))
+    return LocalPlanner(vehicle, opt_dict=opt_dict, map_inst=wmap), wmap
+
+
+def test_construction_queues_the_current_waypoint():
+    planner, _ = make_planner(prefetch_horizon=False)
+    assert len(planner.get_plan()) == 1
+    waypoint, road_option = planner.get_plan()[0]
+    assert (waypoint.lane_id, waypoint.s) == (-1, 10.0)
+    assert road_option == RoadOption.LANEFOLLOW
+
+
+def test_run_step_extends_the_plan_along_the_lane():
+    planner, _ = make_planner(prefetch_horizon=False)
+    control = planner.run_step()
+    assert isinstance(control, carla.VehicleControl)
+    waypoints = planner.get_plan().waypoints()
+    assert len(waypoints) > 1
+    assert all(b.s - a.s == 2.0 for a, b in zip(waypoints, waypoints[1:]))
+
+
+def test_global_plan_and_prefetched_horizon():
+    planner, wmap = make_planner(horizon_budget=1.0)
+    try:
+        plan = [(wmap.get_waypoint(carla.Location(x, 1.75, 0.0)), RoadOption.LANEFOLLOW) for x in range(20, 40, 2)]
+        planner.set_global_plan(plan, stop_waypoint_creation=False)
+        planner.run_step()
+        waypoints = planner.get_plan().waypoints()
+        assert waypoints[0].s == 20.0
+        assert len(waypoints) > len(plan)
+    finally:
+        planner.stop()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import carla
+
+from agents.navigation.local_planner import RoadOption
+from agents.navigation.waypoint_plan import WaypointPlan
+from agents.tools.state_cache import ActorStateCache
+
+
+class StubActor(object):
+    def __init__(self, actor_id, location):
+        self.id = actor_id
+        self.location = location
+
+    def get_transform(self):
+        return carla.Transform(self.location)
+
+
+class CountingMap(carla.Map):
+    def __init__(self):
+        super(CountingMap, self).__init__()
+        self.queries = 0
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=carla.LaneType.Driving):
+        self.queries += 1
+        return super(CountingMap, self).get_waypoint(location, project_to_road, lane_type)
+
+
+def test_waypoint_of_an_actor_is_kept_while_it_stands():
+    wmap = CountingMap()
+    cache = ActorStateCache(waypoint_tolerance=0.1)
+    actor = StubActor(7, carla.Location(20.0, 1.75, 0.0))
+    first = cache.get_waypoint(actor, wmap, lane_type=carla.LaneType.Any)
+    assert cache.get_waypoint(actor, wmap, lane_type=carla.LaneType.Any) is first
+    actor.location = carla.Location(20.05, 1.75, 0.0)
+    assert cache.get_waypoint(actor, wmap, lane_type=carla.LaneType.Any) is first
+    assert wmap.queries == 1
+
+    actor.location = carla.Location(25.0, 5.25, 0.0)
+    moved = cache.get_waypoint(actor, wmap, lane_type=carla.LaneType.Any)
+    assert (moved.lane_id, moved.s) == (-2, 25.0)
+    assert wmap.queries == 2
+
+
+def test_corridor_sides_follow_the_plan_incrementally():
+    pytest.importorskip("shapely")
+    from agents.navigation.basic_agent import BasicAgent
+
+    wmap = carla.Map()
+    plan = WaypointPlan()
+    plan.extend((wmap.get_waypoint(carla.Location(x, 1.75, 0.0)), RoadOption.LANEFOLLOW) for x in range(0, 100, 2))
+    agent = BasicAgent.__new__(BasicAgent)
+    agent._corridor = None
+
+    def full_sides(horizon):
+        centers = plan.xyz(0, horizon)
+        offsets = np.zeros_like(centers)
+        offsets[:, :2] = plan.right_vectors(0, horizon)
+        return np.stack((centers + 1.0 * offsets, centers - 1.0 * offsets), axis=1)
+
+    for consumed, horizon in [(0, 10), (3, 10), (1, 20), (5, 4), (0, 30)]:
+        plan.popleft(consumed)
+        np.testing.assert_allclose(agent._corridor_sides(plan, horizon, 1.0, -1.0), full_sides(horizon))
+
+    plan.clear()
+    plan.extend((wmap.get_waypoint(carla.Location(x, 5.25, 0.0)), RoadOption.LANEFOLLOW) for x in range(0, 20, 2))
+    np.testing.assert_allclose(agent._corridor_sides(plan, 5, 1.0, -1.0), full_sides(5))
@@ -0,0 +1,12 @@
+import pytest
+
+from agents.navigation.route_graph_data import cache_file_name
+
+
+def test_cache_file_name_is_keyed_by_the_builder():
+    topology = cache_file_name("Town01", "<OpenDRIVE/>", 2.0, "topology")
+    opendrive = cache_file_name("Town01", "<OpenDRIVE/>", 2.0, "opendrive")
+    assert topology != opendrive
+    assert topology.startswith("Town01_") and topology.endswith("_2_topology.npz")
+    with pytest.raises(ValueError):
+        cache_file_name("Town01", "<OpenDRIVE/>", 2.0, "networkx")
@@ -0,0 +1,141 @@
+"""
+Scripted straight-line trajectories of scenario objects.
+
+An object with an end location and a positive speed moves from its start to
+its end location. The motion runs on the server: vehicles get a constant
+velocity (physics-driven, in the vehicle's local frame) and walkers a
+persistent WalkerControl. The client only reads the progress from the tick
+snapshot and sends one command when an object arrives, so moving objects
+cost no round trips per tick.
+"""
+
+import time
+from typing import Dict, List
+
+import carla
+
+from command_batch import CommandBatch
+from configurator import ObjectSpec
+
+
+def _dot(a: carla.Vector3D, b: carla.Vector3D) -> float:
+    return a.x * b.x + a.y * b.y + a.z * b.z
+
+
+class Trajectory(object):
+    """
+    Motion of one object from its start to its end location.
+    """
+
+    def __init__(self, actor_id: int, spec: ObjectSpec):
+        self.actor_id = actor_id
+        self.spec = spec
+        self.start = spec.start.location
+        self.end = spec.end
+        offset = self.end - self.start
+        self.length = offset.length()
+        self.direction = offset / self.length if self.length > 0 else carla.Vector3D()
+        self.started = False
+        self.finished = self.length == 0
+
+    def local_velocity(self) -> carla.Vector3D:
+        """
+        Velocity in the local frame of the spawn transform, as expected by
+        `enable_constant_velocity`.
+        """
+        rotation = self.spec.start.rotation
+        velocity = self.direction * self.spec.speed
+        return carla.Vector3D(
+            _dot(velocity, rotation.get_forward_vector()),
+            _dot(velocity, rotation.get_right_vector()),
+            _dot(velocity, rotation.get_up_vector()),
+        )
+
+    def progress(self, location: carla.Location) -> float:
+        """
+        Distance travelled along the trajectory.
+        """
+        return _dot(location - self.start, self.direction)
+
+
+class ScriptedTrajectories(object):
+    """
+    Starts, tracks and stops the trajectories of the scenario objects.
+    """
+
+    def __init__(
+        self,
+        world: carla.World,
+        batch: CommandBatch,
+        objects: List[ObjectSpec],
+        ids: Dict[str, int],
+        budget: float = 0.001,
+    ):
+        """
+        :param objects: objects of the scenario, those with an end location,
+            a positive speed and no autopilot are moved
+        :param ids: ids of the spawned objects by name
+        :param budget: seconds per tick the updates may take before a warning
+        """
+        self._world = world
+        self._batch = batch
+        self.trajectories = [
+            Trajectory(ids[spec.name], spec)
+            for spec in objects
+            if spec.name in ids and spec.end is not None and spec.speed > 0 and not spec.autopilot
+        ]
+        self.budget = budget
+        self.overruns = 0
+
+    def __len__(self):
+        return len(self.trajectories)
+
+    def update(self, snapshot: carla.WorldSnapshot):
+        """
+        Starts the trajectories on the first tick and stops the objects that
+        reached their end location. Reads the actor states from the snapshot.
+        """
+        update_start = time.perf_counter()
+        for trajectory in self.trajectories:
+            if trajectory.finished:
+                continue
+            if not trajectory.started:
+                self._start(trajectory)
+                continue
+            actor_snapshot = snapshot.find(trajectory.actor_id)
+            if actor_snapshot is None:
+                trajectory.finished = True
+            elif trajectory.progress(actor_snapshot.get_transform().location) >= trajectory.length:
+                self._stop(trajectory)
+
+        elapsed = time.perf_counter() - update_start
+        if elapsed > self.budget:
+            self.overruns += 1
+            if self.overruns == 1:
+                print(
+                    f"Warning: updating {len(self)} trajectories took {1000 * elapsed:.2f} ms,"
+                    f" more than the budget of {1000 * self.budget:.2f} ms per tick"
+                )
+
+    def _start(self, trajectory: Trajectory):
+        trajectory.started = True
+        if trajectory.spec.is_pedestrian:
+            # Walker controls persist until replaced.
+            self._batch.apply_control(
+                trajectory.actor_id,
+                carla.WalkerControl(trajectory.direction, trajectory.spec.speed),
+            )
+        else:
+            self._world.get_actor(trajectory.actor_id).enable_constant_velocity(
+                trajectory.local_velocity()
+            )
+
+    def _stop(self, trajectory: Trajectory):
+        trajectory.finished = True
+        if trajectory.spec.is_pedestrian:
+            self._batch.apply_control(trajectory.actor_id, carla.WalkerControl())
+        else:
+            self._world.get_actor(trajectory.actor_id).disable_constant_velocity()
+            self._batch.apply_control(
+                trajectory.actor_id, carla.VehicleControl(brake=1.0, hand_brake=True)
+            )